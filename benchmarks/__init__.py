@@ -0,0 +1,297 @@
+"""
+Benchmarks of Mycroft's hot paths: text encoding, training, prediction and model loading.
+
+The benchmarks run on synthetic corpora built from the word distributions of the test fixtures, so they need no network
+access. Run them from the top of the repository with `python -m benchmarks`.
+
+Each benchmark produces a named measurement. Throughputs are in texts per second and higher is better. Latencies are in
+seconds and lower is better. Results are written as JSON and may be compared against a saved baseline.
+"""
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+FIXTURES = [("Joyce", "joyce.txt"), ("Kafka", "kafka.txt")]
+
+
+def synthetic_corpus(size, seed=0, minimum_length=5, maximum_length=60):
+    """
+    Generate a labeled corpus by sampling words from the test fixtures.
+
+    Each text is labeled with the name of an author, and its words are drawn from the frequency distribution of the
+    words in that author's fixture, so the labels are learnable. Text lengths are uniformly distributed.
+
+    :param size: number of texts
+    :type size: int
+    :param seed: random number generator seed
+    :type seed: int
+    :param minimum_length: minimum number of words in a text
+    :type minimum_length: int
+    :param maximum_length: maximum number of words in a text
+    :type maximum_length: int
+    :return: texts, their labels and the label names
+    :rtype: (list of str, list of str, list of str)
+    """
+    from test import to_lines
+
+    generator = random.Random(seed)
+    distributions = []
+    for label, filename in FIXTURES:
+        counts = Counter(word for line in to_lines(filename) for word in re.findall(r"\w+|[^\w\s]", line))
+        words, weights = zip(*sorted(counts.items()))
+        distributions.append((label, words, weights))
+    texts, labels = [], []
+    for _ in range(size):
+        label, words, weights = generator.choice(distributions)
+        length = generator.randint(minimum_length, maximum_length)
+        texts.append(" ".join(generator.choices(words, weights, k=length)))
+        labels.append(label)
+    return texts, labels, [label for label, _ in FIXTURES]
+
+
+class Measurement:
+    """
+    The value of a benchmark, its unit, and whether higher values are better.
+    """
+
+    def __init__(self, value, unit, higher_is_better):
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def __repr__(self):
+        return "%0.4g %s" % (self.value, self.unit)
+
+    def as_dict(self):
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["value"], d["unit"], d["higher_is_better"])
+
+
+def best_time(function, repeat):
+    """
+    :param function: function of no arguments to time
+    :type function: callable
+    :param repeat: number of times to run it
+    :type repeat: int
+    :return: the shortest running time in seconds, and the result of the last call
+    :rtype: (float, object)
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def throughput(texts, seconds):
+    return Measurement(texts / seconds, "texts/s", True)
+
+
+def latency(seconds):
+    return Measurement(seconds, "s", False)
+
+
+MODELS = ["bow", "conv", "rnn"]
+
+
+def create_model(name, data, sequence_length):
+    from mycroft.model import BagOfWordsClassifier, ConvolutionNetClassifier, RNNClassifier
+
+    if name == "bow":
+        return BagOfWordsClassifier(data)
+    model_class = {"conv": ConvolutionNetClassifier, "rnn": RNNClassifier}[name]
+    return model_class(data, sequence_length=sequence_length)
+
+
+def encode_benchmarks(texts, sequence_length, repeat):
+    """
+    Throughput of tokenization alone and of every embedder with every tokenizer.
+
+    :return: measurements by name
+    :rtype: iterator of (str, Measurement)
+    """
+    from mycroft.text import BagOfWordsEmbedder, TextSequenceEmbedder, TOKENIZERS, tokenize
+
+    for tokenizer in TOKENIZERS:
+        seconds, _ = best_time(lambda: tokenize(texts, tokenizer=tokenizer), repeat)
+        yield "tokenize/%s" % tokenizer, throughput(len(texts), seconds)
+    for tokenizer in TOKENIZERS:
+        for embedder in [BagOfWordsEmbedder(tokenizer=tokenizer), TextSequenceEmbedder(None, sequence_length,
+                                                                                       tokenizer=tokenizer)]:
+            if isinstance(embedder, TextSequenceEmbedder):
+                # Build the vocabulary outside the timed region.
+                embedder.vocabulary
+            seconds, _ = best_time(lambda: embedder.encode(texts), repeat)
+            yield "encode/%s/%s" % (embedder.__class__.__name__, tokenizer), throughput(len(texts), seconds)
+
+
+def model_benchmarks(name, data, sequence_length, epochs, batch_sizes, repeat):
+    """
+    Training throughput per epoch, prediction throughput at several batch sizes and load latency of a model.
+
+    The texts are encoded before any of these are timed, so they measure the model and not the embedder. Training
+    throughput counts only the time spent in the epochs, as recorded by the profiler's epoch callback, and not the
+    checkpoints and final save written to the model directory.
+
+    :return: measurements by name
+    :rtype: iterator of (str, Measurement)
+    """
+    from mycroft.model import load_embedding_model
+    from mycroft.profiling import Profiler
+
+    model = create_model(name, data, sequence_length)
+    model.encode(data)
+    model_directory = tempfile.mkdtemp()
+    try:
+        with Profiler() as profiler:
+            model.train(data, epochs=epochs, early_stop=None, reduce=None, model_directory=model_directory, verbose=0)
+        yield "train/%s" % name, throughput(sum(epoch["samples"] for epoch in profiler.epochs),
+                                            sum(epoch["seconds"] for epoch in profiler.epochs))
+        for batch_size in batch_sizes:
+            seconds, _ = best_time(lambda: model.predict(data, batch_size), repeat)
+            yield "predict/%s/batch-%d" % (name, batch_size), throughput(len(data), seconds)
+        seconds, _ = best_time(lambda: load_embedding_model(model_directory), repeat)
+        yield "load/%s" % name, latency(seconds)
+    finally:
+        shutil.rmtree(model_directory)
+
+
+def parallel_benchmarks(name, data, sequence_length, epochs, workers, repeat):
+    """
+    Training throughput per epoch of a model trained in data-parallel worker processes, for several numbers of
+    workers. One worker is the ordinary single-process training.
+
+    Throughput counts only the time spent training in the epochs, as recorded by the profiler's epoch callback. The
+    rest of the training time, which for several workers includes writing the data to disk, starting the processes and
+    loading the model in each of them, is reported separately as startup latency.
+
+    :return: measurements by name
+    :rtype: iterator of (str, Measurement)
+    """
+    from mycroft.profiling import Profiler
+
+    for worker_count in workers:
+        throughputs, startups = [], []
+        for _ in range(repeat):
+            model = create_model(name, data, sequence_length)
+            model.encode(data)
+            with Profiler() as profiler:
+                start = time.perf_counter()
+                model.train(data, epochs=epochs, early_stop=None, reduce=None, verbose=0, workers=worker_count)
+                seconds = time.perf_counter() - start
+            epoch_seconds = sum(epoch["seconds"] for epoch in profiler.epochs)
+            throughputs.append(sum(epoch["samples"] for epoch in profiler.epochs) / epoch_seconds)
+            startups.append(seconds - epoch_seconds)
+        yield "train/%s/workers-%d" % (name, worker_count), Measurement(max(throughputs), "texts/s", True)
+        yield "train-startup/%s/workers-%d" % (name, worker_count), latency(min(startups))
+
+
+BENCHMARKS = ["encode", "model", "parallel"]
+
+
+def run_benchmarks(sizes, benchmarks=tuple(BENCHMARKS), models=tuple(MODELS), epochs=2, batch_sizes=(32, 256),
+                   sequence_length=64, repeat=3, seed=0, progress=None, workers=(1, 2, 4)):
+    """
+    Run benchmarks on synthetic corpora of different sizes.
+
+    :param sizes: number of texts in each corpus
+    :type sizes: list of int
+    :param benchmarks: which benchmarks to run: "encode" for the embedders, "model" for training, prediction and
+        loading, "parallel" for data-parallel training
+    :type benchmarks: sequence of str
+    :param models: models to train: any of "bow", "conv" and "rnn"
+    :type models: sequence of str
+    :param epochs: number of training epochs
+    :type epochs: int
+    :param batch_sizes: prediction batch sizes
+    :type batch_sizes: sequence of int
+    :param sequence_length: sequence length of the sequential models
+    :type sequence_length: int
+    :param repeat: number of times to repeat each timing, keeping the best
+    :type repeat: int
+    :param seed: random number generator seed for the corpora
+    :type seed: int
+    :param progress: function called with the name and measurement of each benchmark as it finishes
+    :type progress: callable or None
+    :param workers: numbers of worker processes with which to measure data-parallel training
+    :type workers: sequence of int
+    :return: measurements by name
+    :rtype: dict of str to Measurement
+    """
+    from mycroft.data import Dataset
+
+    results = {}
+    for size in sizes:
+        texts, labels, label_names = synthetic_corpus(size, seed)
+        measurements = []
+        if "encode" in benchmarks:
+            measurements.append(encode_benchmarks(texts, sequence_length, repeat))
+        if "model" in benchmarks:
+            data = Dataset.from_labels(texts, labels, label_names)
+            measurements.extend(model_benchmarks(name, data, sequence_length, epochs, batch_sizes, repeat)
+                                for name in models)
+        if "parallel" in benchmarks:
+            data = Dataset.from_labels(texts, labels, label_names)
+            measurements.extend(parallel_benchmarks(name, data, sequence_length, epochs, workers, repeat)
+                                for name in models)
+        for group in measurements:
+            for name, measurement in group:
+                name = "%s/%d" % (name, size)
+                results[name] = measurement
+                if progress is not None:
+                    progress(name, measurement)
+    return results
+
+
+def save_results(filename, results):
+    from mycroft import __version__
+
+    d = {"mycroft_version": __version__, "python_version": platform.python_version(), "machine": platform.machine(),
+         "processors": os.cpu_count(),
+         "results": dict((name, measurement.as_dict()) for name, measurement in sorted(results.items()))}
+    with open(filename, "w") as f:
+        json.dump(d, f, sort_keys=True, indent=4, separators=(",", ": "))
+
+
+def load_results(filename):
+    with open(filename) as f:
+        return dict((name, Measurement.from_dict(d)) for name, d in json.load(f)["results"].items())
+
+
+def compare_results(results, baseline, tolerance=0.1):
+    """
+    Compare results against a baseline.
+
+    The change of each benchmark is the relative improvement over the baseline, so it is positive when a throughput goes
+    up or a latency goes down. A change below -tolerance is a regression.
+
+    :param results: current measurements
+    :type results: dict of str to Measurement
+    :param baseline: baseline measurements
+    :type baseline: dict of str to Measurement
+    :param tolerance: largest relative slowdown that is not a regression
+    :type tolerance: float
+    :return: name, baseline value, current value, relative change and whether it is a regression for each benchmark in
+        both sets of results
+    :rtype: list of (str, float, float, float, bool)
+    """
+    comparisons = []
+    for name in sorted(set(results).intersection(baseline)):
+        current, previous = results[name].value, baseline[name].value
+        if results[name].higher_is_better:
+            change = current / previous - 1
+        else:
+            change = previous / current - 1
+        comparisons.append((name, previous, current, change, change < -tolerance))
+    return comparisons
@@ -0,0 +1,56 @@
+"""
+Command line interface to the benchmarks.
+"""
+import argparse
+import sys
+
+from benchmarks import BENCHMARKS, MODELS, compare_results, load_results, run_benchmarks, save_results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark Mycroft's encoding, training, prediction and loading")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 4000], metavar="SIZE",
+                        help="numbers of texts in the synthetic corpora (default 1000 4000)")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS,
+                        help="benchmarks to run: encoding, training, prediction and loading, or data-parallel "
+                             "training (default all)")
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS, help="models to train (default all)")
+    parser.add_argument("--epochs", type=int, default=2, help="training epochs (default 2)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[32, 256], metavar="SIZE",
+                        help="prediction batch sizes (default 32 256)")
+    parser.add_argument("--sequence-length", type=int, default=64, metavar="LENGTH",
+                        help="sequence length of the sequential models (default 64)")
+    parser.add_argument("--repeat", type=int, default=3, help="repeat each timing this many times and keep the best "
+                                                              "(default 3)")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], metavar="PROCESSES",
+                        help="numbers of processes for data-parallel training (default 1 2 4)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthetic corpora (default 0)")
+    parser.add_argument("--output", metavar="FILE", help="write the results to this JSON file")
+    parser.add_argument("--baseline", metavar="FILE", help="compare the results against these saved results")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative slowdown from the baseline that counts as a regression (default 0.1)")
+    args = parser.parse_args(args=args)
+
+    results = run_benchmarks(args.sizes, args.benchmarks, args.models, args.epochs, args.batch_sizes,
+                             args.sequence_length, args.repeat, args.seed,
+                             lambda name, measurement: print("%-40s %s" % (name, measurement), flush=True),
+                             args.workers)
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        comparisons = compare_results(results, load_results(args.baseline), args.tolerance)
+        print("\n%-40s %12s %12s %8s" % ("benchmark", "baseline", "current", "change"))
+        for name, previous, current, change, regression in comparisons:
+            print("%-40s %12.4g %12.4g %+7.1f%%%s" % (name, previous, current, 100 * change,
+                                                      " REGRESSION" if regression else ""))
+        regressions = sum(comparison[-1] for comparison in comparisons)
+        if regressions:
+            print("\n%d of %d benchmarks regressed by more than %0.0f%%" % (
+                regressions, len(comparisons), 100 * args.tolerance))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
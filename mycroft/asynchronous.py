@@ -0,0 +1,161 @@
+"""
+Asyncio interface to prediction.
+"""
+import asyncio
+from collections import deque
+
+from .server import PredictionBatcher
+
+
+class AsyncClassifier:
+    """
+    Classify texts from asyncio coroutines without blocking the event loop.
+
+    Requests are queued on a PredictionBatcher, which coalesces them into batches and runs the model on its own thread,
+    and the coroutines await the results. The model's numerical libraries release the interpreter lock while they
+    compute, so the event loop keeps running during predictions.
+
+    The number of texts that have been submitted but not yet predicted is limited to max_pending. A request that would
+    exceed it waits until there is room, in the order the requests were made, or is rejected with asyncio.QueueFull if
+    reject is True. A single request larger than max_pending is accepted when nothing else is pending.
+
+    All the coroutines of a classifier must run on the same event loop.
+    """
+    MAX_PENDING = 4096
+
+    def __init__(self, model, max_batch_size=PredictionBatcher.MAX_BATCH_SIZE, max_wait=PredictionBatcher.MAX_WAIT,
+                 batch_size=32, max_pending=MAX_PENDING, reject=False):
+        """
+        :param model: the model
+        :type model: mycroft.model.TextEmbeddingClassifier or mycroft.inference.InferenceModel
+        :param max_batch_size: maximum number of texts to predict in a single call
+        :type max_batch_size: int
+        :param max_wait: maximum number of seconds to wait for more requests after the first one in a batch arrives
+        :type max_wait: float
+        :param batch_size: batch size passed to the model's predict method
+        :type batch_size: int
+        :param max_pending: maximum number of texts submitted but not yet predicted
+        :type max_pending: int
+        :param reject: if True, reject requests when there is no room for them instead of waiting
+        :type reject: bool
+        """
+        if max_pending < 1:
+            raise ValueError("Invalid maximum number of pending texts %d" % max_pending)
+        self.batcher = PredictionBatcher(model, max_batch_size, max_wait, batch_size)
+        self.max_pending = max_pending
+        self.reject = reject
+        self.pending_requests = 0
+        self.pending_texts = 0
+        self.maximum_pending_texts = 0
+        self.rejected_requests = 0
+        # Requests waiting for room, as (number of texts, future set when room has been reserved for them).
+        self.waiters = deque()
+
+    def __repr__(self):
+        return "Async classifier: %d of %d texts pending, %d requests waiting" % (
+            self.pending_texts, self.max_pending, len(self.waiters))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def label_names(self):
+        return self.batcher.model.label_names
+
+    async def predict_one(self, text):
+        """
+        :param text: text to classify
+        :type text: str
+        :return: label probabilities and predicted label
+        :rtype: (numpy.array, str)
+        """
+        label_probabilities, predicted_labels = await self.predict_many([text])
+        return label_probabilities[0], predicted_labels[0]
+
+    async def predict_many(self, texts):
+        """
+        :param texts: texts to classify
+        :type texts: sequence of str
+        :return: label probabilities and predicted labels
+        :rtype: (numpy.array, list of str)
+        """
+        texts = list(texts)
+        if not texts:
+            import numpy
+
+            return numpy.zeros((0, len(self.label_names)), dtype="float32"), []
+        await self.reserve(len(texts))
+        try:
+            prediction = asyncio.wrap_future(self.batcher.submit(texts))
+        except BaseException:
+            self.release(len(texts))
+            raise
+        # Room is released when the batcher finishes the request, even if the caller stops waiting for it first.
+        prediction.add_done_callback(lambda _: self.release(len(texts)))
+        return await asyncio.shield(prediction)
+
+    async def reserve(self, size):
+        if not self.waiters and self.has_room(size):
+            self.add_pending(size)
+            return
+        if self.reject:
+            self.rejected_requests += 1
+            raise asyncio.QueueFull("%d texts are pending, the maximum is %d" % (self.pending_texts, self.max_pending))
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append((size, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if (size, waiter) in self.waiters:
+                    self.waiters.remove((size, waiter))
+                    # The requests behind this one may now fit.
+                    self.admit_waiters()
+            else:
+                # Room was reserved just before the cancellation.
+                self.release(size)
+            raise
+
+    def release(self, size):
+        self.pending_requests -= 1
+        self.pending_texts -= size
+        self.admit_waiters()
+
+    def admit_waiters(self):
+        while self.waiters and self.has_room(self.waiters[0][0]):
+            size, waiter = self.waiters.popleft()
+            if not waiter.cancelled():
+                self.add_pending(size)
+                waiter.set_result(None)
+
+    def has_room(self, size):
+        return self.pending_texts + size <= self.max_pending or not self.pending_texts
+
+    def add_pending(self, size):
+        self.pending_requests += 1
+        self.pending_texts += size
+        self.maximum_pending_texts = max(self.maximum_pending_texts, self.pending_texts)
+
+    @property
+    def metrics(self):
+        """
+        The queue depths and backpressure counts of the classifier, and the statistics of its batcher.
+
+        :return: metrics
+        :rtype: dict
+        """
+        d = self.batcher.statistics.as_dict()
+        d.update(pending_requests=self.pending_requests, pending_texts=self.pending_texts,
+                 maximum_pending_texts=self.maximum_pending_texts, waiting_requests=len(self.waiters),
+                 rejected_requests=self.rejected_requests, queue_depth=self.batcher.queue_depth)
+        return d
+
+    async def close(self):
+        """
+        Predict all the requests that have been submitted and stop the batcher's thread. Later requests raise
+        RuntimeError.
+        """
+        await asyncio.get_event_loop().run_in_executor(None, self.batcher.close)
@@ -0,0 +1,135 @@
+"""
+Persistent on-disk cache of text encodings.
+"""
+import hashlib
+import json
+import os
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "mycroft")
+
+
+class EncodingCache:
+    """
+    A directory of text encodings keyed by a hash of the texts and the configuration of the embedder that encoded them.
+
+    Each encoding is stored as a NumPy .npy file. When the total size of the cached files exceeds a maximum, the least
+    recently used ones are deleted.
+    """
+    MAXIMUM_SIZE = 10 * 2 ** 30
+    suffix = ".npy"
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, maximum_size=MAXIMUM_SIZE):
+        """
+        :param directory: directory in which to store the encodings
+        :type directory: str
+        :param maximum_size: maximum total size of the cached encodings in bytes
+        :type maximum_size: int
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.maximum_size = maximum_size
+
+    def __repr__(self):
+        return "Encoding cache: %s, maximum size %d bytes" % (self.directory, self.maximum_size)
+
+    def encode(self, embedder, texts):
+        """
+        Encode texts with an embedder, using a cached encoding if one is available.
+
+        :param embedder: embedder that converts text to vector embeddings
+        :type embedder: mycroft.text.Embedder
+        :param texts: texts to encode
+        :type texts: sequence of str
+        :return: text encodings
+        :rtype: numpy.array
+        """
+        key = self.key(embedder.configuration(), texts)
+        encoding = self.get(key)
+        if encoding is None:
+            encoding = embedder.encode(texts)
+            self.put(key, encoding)
+        return encoding
+
+    @staticmethod
+    def key(configuration, texts):
+        """
+        Hash of a set of texts and the configuration of the process that transforms them.
+
+        :param configuration: JSON-serializable description of the transformation
+        :type configuration: dict
+        :param texts: texts to transform
+        :type texts: sequence of str
+        :return: hexadecimal digest
+        :rtype: str
+        """
+        h = hashlib.sha256(json.dumps(configuration, sort_keys=True).encode("utf-8"))
+        for text in texts:
+            data = str(text).encode("utf-8")
+            # Prefix each text with its length so that different segmentations of the same characters differ.
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :type key: str
+        :return: the cached array, or None if there is none
+        :rtype: numpy.array or None
+        """
+        import numpy
+
+        filename = self.filename(key)
+        try:
+            array = numpy.load(filename)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        # The file modification time records when it was last used.
+        os.utime(filename)
+        return array
+
+    def put(self, key, array):
+        """
+        Add an array to the cache, then delete least recently used arrays until the cache is within its maximum size.
+
+        :param key: cache key
+        :type key: str
+        :param array: array to store
+        :type array: numpy.array
+        """
+        import numpy
+
+        filename = self.filename(key)
+        # Write to a temporary file and rename it so that concurrent processes never read partial files.
+        temporary_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temporary_filename, mode="wb") as f:
+            numpy.save(f, array)
+        os.replace(temporary_filename, filename)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                try:
+                    status = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.maximum_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory) if name.endswith(self.suffix))
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + self.suffix)
@@ -2,17 +2,19 @@
 Command line interface to the text classifier.
 """
 import argparse
+import json
 import os
+import sys
 import textwrap
 from functools import partial
 
-import numpy
-import pandas
-from sklearn.datasets import fetch_20newsgroups
-
 from mycroft import __version__
+from .cache import DEFAULT_CACHE_DIRECTORY, EncodingCache
+from .profiling import Profiler, span
+from .selection import SCHEDULES, Tuner
+from .server import PredictionBatcher
 from .model import BagOfWordsClassifier, RNNClassifier, ConvolutionNetClassifier, TextEmbeddingClassifier, \
-    load_embedding_model
+    SequentialTextEmbeddingClassifier, TrainingState, load_embedding_model
 
 TEXT_NAME = "text"
 LABEL_NAME = "label"
@@ -55,23 +57,93 @@ def main(model_specifications, description=None, demo=False, args=None):
                                            description="load a previously-trained model")
     load_parser.add_argument("--load-model", metavar="DIRECTORY", default=".",
                              help="directory from which to load a model (default current)")
+    continuation = load_parser.add_mutually_exclusive_group()
+    continuation.add_argument("--resume", action="store_true",
+                              help="resume interrupted training from the end of its last epoch, restoring the "
+                                   "optimizer, learning rate, epoch count and early stopping progress; --epochs is "
+                                   "the total number of epochs")
+    continuation.add_argument("--incremental", action="store_true",
+                              help="continue training on only the rows added to the training data files since the "
+                                   "model was trained; --epochs is the number of additional epochs")
     load_parser.set_defaults(
-        func=partial(train_command, parser, lambda _, args: load_embedding_model(args.load_model)))
+        func=partial(train_command, parser,
+                     lambda _, args: load_embedding_model(args.load_model, checkpoint=args.resume)))
+
+    # Tune subcommand
+    tune_parser = subparsers.add_parser("tune", description=textwrap.dedent("""
+        Search for the best hyper-parameters of a model. Each configuration is trained on the same data and ranked by
+        its best validation loss. The data is read and tokenized once and shared by the trials, which run in parallel
+        processes. Trials with the same embedder configuration share one encoding of the data."""))
+    tune_model_parsers = tune_parser.add_subparsers(title="Models")
+    for model_class, model_command_name, description in model_specifications:
+        model_parser = tune_model_parsers.add_parser(model_command_name, parents=[tuning_argument_groups()],
+                                                     description=description)
+        model_argument_group = model_parser.add_argument_group(
+            "model", description="Arguments for specifying the model configuration that is not searched over:")
+        model_class.command_line_arguments(model_argument_group)
+        model_parser.set_defaults(func=partial(tune_command, parser, model_class))
+
+    # Cross-validation subcommand
+    crossval_parser = subparsers.add_parser("crossval", description=textwrap.dedent("""
+        Estimate how well a model generalizes with k-fold cross-validation. The folds are trained and evaluated in
+        parallel processes on a single encoding of the data, and the mean and standard deviation of their metrics are
+        reported."""))
+    crossval_parser.add_argument("folds", metavar="K", type=int, help="number of folds")
+    crossval_model_parsers = crossval_parser.add_subparsers(title="Models")
+    for model_class, model_command_name, description in model_specifications:
+        model_parser = crossval_model_parsers.add_parser(model_command_name,
+                                                         parents=[cross_validation_argument_groups()],
+                                                         description=description)
+        model_argument_group = \
+            model_parser.add_argument_group("model", description="Arguments for specifying the model configuration:")
+        model_class.command_line_arguments(model_argument_group)
+        model_parser.set_defaults(func=partial(crossval_command, parser, model_class))
 
     # Predict subcommand
     predict_parser = subparsers.add_parser("predict", parents=[test_argument_groups("predict")],
                                            description=textwrap.dedent("""
         Use a model to predict labels. This prints the test data, adding columns containing predicted probabilities for 
         each category and the most probable category."""))
-    predict_parser.set_defaults(func=predict_command)
+    predict_parser.set_defaults(func=partial(predict_command, parser))
 
     # Evaluate subcommand
     evaluate_parser = subparsers.add_parser("evaluate", parents=[test_argument_groups("evaluate")],
                                             description=textwrap.dedent("""
         Evaluate the model's performance on a labeled data set. 
-        The test data is a comma- or tab-delimited file with columns of texts and labels.
+        The test data is a delimited text, Parquet, Feather or JSON Lines file with columns of texts and labels.
         This returns the classification accuracy and cross-entropy loss."""))
-    evaluate_parser.set_defaults(func=evaluate_command)
+    evaluate_parser.set_defaults(func=partial(evaluate_command, parser))
+
+    # Export subcommand
+    export_parser = subparsers.add_parser("export", description=textwrap.dedent("""
+        Export a trained model to a directory of weights and configuration that mycroft.inference.InferenceModel can
+        use to make predictions with NumPy alone, without Keras. The serve command also accepts exported models."""))
+    export_parser.add_argument("model", help="directory containing the trained model")
+    export_parser.add_argument("directory", help="directory in which to write the exported model")
+    export_parser.set_defaults(func=export_command)
+
+    # Serve subcommand
+    serve_parser = subparsers.add_parser("serve", description=textwrap.dedent("""
+        Load a trained or exported model once and serve predictions over HTTP.
+        POST a JSON object {"texts": [...]} to /predict to get predicted labels and label probabilities.
+        GET /stats returns latency and throughput statistics.
+        Concurrent requests are combined into batches."""))
+    serve_parser.add_argument("model", help="directory containing the trained or exported model")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address on which to listen (default 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8000, help="port on which to listen (default 8000)")
+    serve_parser.add_argument("--max-batch-size", metavar="SIZE", type=int, default=PredictionBatcher.MAX_BATCH_SIZE,
+                              help="maximum number of texts to predict at once (default %d)"
+                                   % PredictionBatcher.MAX_BATCH_SIZE)
+    serve_parser.add_argument("--max-wait", metavar="MILLISECONDS", type=float,
+                              default=1000 * PredictionBatcher.MAX_WAIT,
+                              help="maximum time to wait for more requests to add to a batch (default %0.1f)"
+                                   % (1000 * PredictionBatcher.MAX_WAIT))
+    serve_parser.add_argument("--batch-size", metavar="SIZE", type=int, default=TextEmbeddingClassifier.BATCH_SIZE,
+                              help="batch size (default %d)" % TextEmbeddingClassifier.BATCH_SIZE)
+    serve_parser.add_argument("--tokenize-workers", metavar="PROCESSES", type=int, default=1,
+                              help="number of processes to use for tokenization (default 1)")
+    serve_parser.add_argument("--verbose", action="store_true", help="log every request")
+    serve_parser.set_defaults(func=serve_command)
 
     # Demo subcommand
     if demo:
@@ -80,7 +152,16 @@ def main(model_specifications, description=None, demo=False, args=None):
         demo_parser.set_defaults(func=demo_command)
 
     parsed_args = parser.parse_args(args=args)
-    parsed_args.func(parsed_args)
+    if getattr(parsed_args, "profile", None):
+        profiler = Profiler()
+        try:
+            with profiler:
+                parsed_args.func(parsed_args)
+        finally:
+            # Write the stages that ran even if the command failed.
+            profiler.save(parsed_args.profile)
+    else:
+        parsed_args.func(parsed_args)
 
 
 def default_main(args=None):
@@ -107,7 +188,8 @@ def default_main(args=None):
     main(model_specifications, demo=True, description=textwrap.dedent("""
     Mycroft classifies text to categorical labels.
 
-    The training data is a comma- or tab-delimited file with column of text and a column of labels.
+    The training data is a delimited text, Parquet, Feather or JSON Lines file with column of text and a column of
+    labels.
     The test data is in the same format without the labels."""), args=args)
 
 
@@ -115,6 +197,91 @@ def training_argument_groups():
     arguments = argparse.ArgumentParser(add_help=False)
     data_group = arguments.add_argument_group("data",
                                               description="Arguments for specifying the training data:")
+    training_data_arguments(data_group)
+    data_group.add_argument("--chunk-size", metavar="ROWS", type=int,
+                            help="stream the data from disk, reading and encoding this many rows at a time " +
+                                 "(default read all the data into memory)")
+    encoding_arguments(data_group)
+
+    training_group = arguments.add_argument_group("training",
+                                                  description="Arguments for controlling the training procedure:")
+    training_procedure_arguments(training_group)
+    training_group.add_argument("--save-model", metavar="DIRECTORY",
+                                help="directory in which to save the model (default do not save the model)")
+    training_group.add_argument("--logging", choices=["none", "progress", "epoch"], default="epoch",
+                                help="no logging, a progress bar, one line per epoch (default per epoch)")
+    training_group.add_argument("--tensor-board", metavar="DIRECTORY",
+                                help="directory in which to create TensorBoard logs (default do not create them)")
+    training_group.add_argument("--workers", metavar="PROCESSES", type=int, default=1,
+                                help="train replicas of the model on this many processes, dividing the batches " +
+                                     "between them and averaging their weights (default 1)")
+    profile_argument(training_group)
+    return arguments
+
+
+def tuning_argument_groups():
+    arguments = argparse.ArgumentParser(add_help=False)
+    data_group = arguments.add_argument_group("data",
+                                              description="Arguments for specifying the training data:")
+    training_data_arguments(data_group)
+    encoding_arguments(data_group)
+
+    training_group = arguments.add_argument_group("training",
+                                                  description="Arguments for controlling the training procedure:")
+    training_procedure_arguments(training_group)
+
+    search_group = arguments.add_argument_group("search", description="Arguments for controlling the search:")
+    search_group.add_argument("--search", metavar=("NAME", "VALUE"), nargs="+", action="append", required=True,
+                              help="a model argument and the values to try, written as on the training command line, "
+                                   "or a single uniform:LOW:HIGH or log-uniform:LOW:HIGH distribution for a numeric "
+                                   "argument; repeat for each argument to search over")
+    search_group.add_argument("--schedule", choices=SCHEDULES, default="grid",
+                              help="try every combination of values, random configurations, or successive halving of "
+                                   "random configurations (default grid)")
+    search_group.add_argument("--trials", type=int, default=Tuner.TRIALS,
+                              help="number of random configurations to try (default %d)" % Tuner.TRIALS)
+    search_group.add_argument("--min-epochs", metavar="EPOCHS", type=int, default=Tuner.MIN_EPOCHS,
+                              help="number of epochs in the first round of successive halving (default %d)"
+                                   % Tuner.MIN_EPOCHS)
+    search_group.add_argument("--eta", metavar="FACTOR", type=int, default=Tuner.ETA,
+                              help="successive halving keeps the best 1/FACTOR of the configurations in each round and "
+                                   "trains them for FACTOR times as many epochs (default %d)" % Tuner.ETA)
+    search_group.add_argument("--seed", type=int, help="random seed (default none)")
+    search_group.add_argument("--workers", metavar="PROCESSES", type=int, default=1,
+                              help="number of trials to run at once (default 1)")
+    search_group.add_argument("--output", metavar="DIRECTORY", default=Tuner.DIRECTORY,
+                              help="directory in which to write the leaderboard and the history of each trial "
+                                   "(default %s)" % Tuner.DIRECTORY)
+    search_group.add_argument("--save-models", action="store_true",
+                              help="save the model trained in each trial in its directory")
+    return arguments
+
+
+def cross_validation_argument_groups():
+    arguments = argparse.ArgumentParser(add_help=False)
+    data_group = arguments.add_argument_group("data",
+                                              description="Arguments for specifying the data:")
+    training_data_arguments(data_group)
+    encoding_arguments(data_group)
+
+    training_group = arguments.add_argument_group("training",
+                                                  description="Arguments for controlling the training procedure:")
+    training_procedure_arguments(training_group)
+
+    folds_group = arguments.add_argument_group("cross-validation",
+                                               description="Arguments for controlling the cross-validation:")
+    folds_group.add_argument("--seed", type=int, help="random seed used to assign samples to folds (default none)")
+    folds_group.add_argument("--workers", metavar="PROCESSES", type=int, default=1,
+                             help="number of folds to run at once (default 1)")
+    folds_group.add_argument("--save-model", metavar="DIRECTORY",
+                             help="directory in which to save the model of the fold with the lowest test loss " +
+                                  "(default do not save a model)")
+    folds_group.add_argument("--output", metavar="FILE",
+                             help="JSON file in which to write the metrics of each fold (default do not write them)")
+    return arguments
+
+
+def training_data_arguments(data_group):
     data_group.add_argument("training_data", metavar="FILE", nargs="+", help="training data file")
     data_group.add_argument("--limit", type=int, help="only train on this many samples (default use all the data)")
     data_group.add_argument("--validation-fraction", metavar="FRACTION", type=float,
@@ -126,9 +293,18 @@ def training_argument_groups():
     data_group.add_argument("--label-name", metavar="NAME", default=LABEL_NAME,
                             help="name of the label column (default '%s')" % LABEL_NAME)
     data_group.add_argument("--omit-labels", metavar="LABEL", nargs="*", help="omit samples with these label values")
-
-    training_group = arguments.add_argument_group("training",
-                                                  description="Arguments for controlling the training procedure:")
+    sample = data_group.add_mutually_exclusive_group()
+    sample.add_argument("--sample-size", metavar="SAMPLES", type=int,
+                        help="train on a uniform random sample of this many samples (default use all the data)")
+    sample.add_argument("--sample-fraction", metavar="FRACTION", type=float,
+                        help="train on a random sample of this fraction of the samples (default use all the data)")
+    data_group.add_argument("--stratify", action="store_true",
+                            help="divide the sample size between labels in proportion to their frequency")
+    data_group.add_argument("--sample-seed", metavar="SEED", type=int,
+                            help="random seed used to sample the training data (default none)")
+
+
+def training_procedure_arguments(training_group):
     training_group.add_argument("--epochs", type=int, default=TextEmbeddingClassifier.EPOCHS,
                                 help="maximum number of training epochs (default %d)" % TextEmbeddingClassifier.EPOCHS)
     training_group.add_argument("--early-stop", metavar="EPOCHS", type=int,
@@ -139,13 +315,9 @@ def training_argument_groups():
                                      "(default %d)" % TextEmbeddingClassifier.REDUCE)
     training_group.add_argument("--batch-size", metavar="SIZE", type=int, default=TextEmbeddingClassifier.BATCH_SIZE,
                                 help="batch size (default %d)" % TextEmbeddingClassifier.BATCH_SIZE)
-    training_group.add_argument("--save-model", metavar="DIRECTORY",
-                                help="directory in which to save the model (default do not save the model)")
-    training_group.add_argument("--logging", choices=["none", "progress", "epoch"], default="epoch",
-                                help="no logging, a progress bar, one line per epoch (default per epoch)")
-    training_group.add_argument("--tensor-board", metavar="DIRECTORY",
-                                help="directory in which to create TensorBoard logs (default do not create them)")
-    return arguments
+    training_group.add_argument("--bucket", action="store_true",
+                                help="batch texts of similar length together and pad them only to the longest text " +
+                                     "in the batch (recurrent models only)")
 
 
 def test_argument_groups(test_command):
@@ -157,6 +329,9 @@ def test_argument_groups(test_command):
     data_group.add_argument("test_data", metavar="FILE", nargs="+", help="test data files")
     data_group.add_argument("--batch-size", metavar="SIZE", type=int, default=TextEmbeddingClassifier.BATCH_SIZE,
                             help="batch size (default %d)" % TextEmbeddingClassifier.BATCH_SIZE)
+    data_group.add_argument("--bucket", action="store_true",
+                            help="batch texts of similar length together and pad them only to the longest text in " +
+                                 "the batch (recurrent models only)")
     data_group.add_argument("--limit", type=int, help="only use this many samples (default use all the data)")
     data_group.add_argument("--text-name", metavar="NAME", default=TEXT_NAME,
                             help="name of the text column (default '%s')" % TEXT_NAME)
@@ -165,32 +340,165 @@ def test_argument_groups(test_command):
                                 help="name of the label column (default '%s')" % LABEL_NAME)
         data_group.add_argument("--omit-labels", metavar="LABEL", nargs="*",
                                 help="omit samples with these label values")
+        data_group.add_argument("--embedding-dtypes", metavar="DTYPE", nargs="+",
+                                choices=SequentialTextEmbeddingClassifier.EMBEDDING_DTYPES,
+                                help="also evaluate with the embeddings stored at these precisions and report the "
+                                     "difference (sequence models only)")
+    else:
+        data_group.add_argument("--chunk-size", metavar="ROWS", type=int,
+                                help="read, predict and write this many rows at a time (default all of them at once)")
+        data_group.add_argument("--output", metavar="FILE",
+                                help="file in which to write the predictions (default standard output)")
+    encoding_arguments(data_group)
+    profile_argument(data_group)
     return arguments
 
 
+def profile_argument(group):
+    group.add_argument("--profile", metavar="FILE",
+                       help="write the time and memory used by each stage of the command to this JSON file")
+
+
+def encoding_arguments(group):
+    group.add_argument("--tokenize-workers", metavar="PROCESSES", type=int, default=1,
+                       help="number of processes to use for tokenization (default 1)")
+    group.add_argument("--cache-dir", metavar="DIRECTORY", nargs="?", const=DEFAULT_CACHE_DIRECTORY,
+                       help="cache text encodings in this directory (default do not cache, %s if no directory is given)"
+                            % DEFAULT_CACHE_DIRECTORY)
+    default_size = EncodingCache.MAXIMUM_SIZE / 2 ** 30
+    group.add_argument("--cache-size", metavar="GIGABYTES", type=float, default=default_size,
+                       help="maximum size of the encoding cache (default %0.1f)" % default_size)
+
+
+def encoding_cache(args):
+    if args.cache_dir is None:
+        return None
+    return EncodingCache(args.cache_dir, int(args.cache_size * 2 ** 30))
+
+
+def configure_encoding(model, cache, args):
+    model.encoding_cache = cache
+    model.embedder.workers = args.tokenize_workers
+
+
+def check_tokenizer(model, texts, verbose, sample_size=1000):
+    """
+    Report how often a tokenizer other than the full spaCy pipeline agrees with it on a sample of the training texts.
+    """
+    if verbose and getattr(model.embedder, "tokenizer", "spacy") != "spacy":
+        from itertools import islice
+        from .text import tokenizer_agreement
+
+        sample = list(islice(texts, sample_size))
+        agreement = tokenizer_agreement(sample, model.embedder.tokenizer, model.embedder.language_model)
+        print("The %s tokenizer agrees with spaCy on %0.1f%% of %d training texts" % (
+            model.embedder.tokenizer, 100 * agreement, len(sample)))
+
+
+def report_vocabulary(model, data, validation_data, verbose):
+    """
+    Report the vocabulary size of a sequence embedder and how much of the training and validation data is out of its
+    vocabulary.
+    """
+    if verbose and hasattr(model.embedder, "oov_statistics"):
+        print("Vocabulary: %d words" % model.embedder.vocabulary_size)
+        for name, d in [("Training", data), ("Validation", validation_data)]:
+            if d is not None:
+                oov = model.embedder.oov_statistics(d.texts)
+                print("%s data out of vocabulary: %d of %d tokens (%0.1f%%), %d of %d types (%0.1f%%)" % (
+                    name, oov["oov_tokens"], oov["tokens"], 100 * oov["oov_token_rate"], oov["oov_types"],
+                    oov["types"], 100 * oov["oov_type_rate"]))
+
+
 def train_command(parser, model_factory, args):
     if args.validation_fraction and args.validation_data:
         parser.error("Cannot specify both a validation fraction and a validation set.")
-    # Preprocess training data.
-    texts, labels, label_names = preprocess_labeled_data(args.training_data, args.limit, args.omit_labels,
-                                                         args.text_name, args.label_name)
-    if args.validation_data:
-        validation_texts, validation_labels, _ = preprocess_labeled_data(args.validation_data, args.limit,
-                                                                         args.omit_labels,
-                                                                         args.text_name,
-                                                                         args.label_name)
-        validation_data = (validation_texts, validation_labels)
+    if args.validation_fraction and args.chunk_size:
+        parser.error("Cannot specify a validation fraction when streaming the training data.")
+    if args.bucket and args.chunk_size:
+        parser.error("Cannot bucket texts by length when streaming the training data.")
+    if args.workers > 1 and (args.chunk_size or args.bucket):
+        parser.error("Cannot stream the training data or bucket texts by length when training in parallel.")
+    bucketing_model_arguments(parser, args)
+    sampler = training_sampler(parser, args)
+    resume = getattr(args, "resume", False)
+    incremental = getattr(args, "incremental", False)
+    if resume or incremental:
+        training_state = TrainingState.load(args.load_model)
+        if training_state is None:
+            parser.error("There is no training state in %s to continue from." % args.load_model)
+        if resume and training_state.stopped:
+            print("Training stopped early after epoch %d." % training_state.epoch)
+            return
+        if resume and training_state.epoch >= args.epochs:
+            print("Training has already run %d epochs." % training_state.epoch)
+            return
+        if incremental:
+            training_state = training_state.restart()
+            args.epochs += training_state.epoch
+        # Continue saving the model where it was loaded from.
+        args.save_model = args.save_model or args.load_model
     else:
-        validation_data = None
-    # Train the model.
-    model = model_factory((texts, labels, label_names), args)
+        training_state = TrainingState()
+    # The number of rows read from each training data file, so that incremental training can skip them.
+    offsets = dict((name, training_state.rows.get(os.path.abspath(name), 0) if incremental else 0)
+                   for name in args.training_data)
+    from .data import LabeledDataStream
+    from .text import TokenizedTexts
+
+    cache = encoding_cache(args)
     verbose = {"none": 0, "progress": 1, "epoch": 2}[args.logging]
-    history = model.train(texts, labels, epochs=args.epochs, early_stop=args.early_stop, reduce=args.reduce,
-                          batch_size=args.batch_size, validation_fraction=args.validation_fraction,
-                          validation_data=validation_data, model_directory=args.save_model,
-                          tensor_board_directory=args.tensor_board, verbose=verbose)
+    if args.chunk_size:
+        # Read and encode the data a chunk at a time.
+        data = LabeledDataStream(args.training_data, args.chunk_size, args.text_name, args.label_name, args.limit,
+                                 args.omit_labels, sampler=sampler, offsets=offsets)
+        offsets = data.offsets
+        if args.validation_data:
+            validation_data = LabeledDataStream(args.validation_data, args.chunk_size, args.text_name,
+                                                args.label_name, args.limit, args.omit_labels, data.label_names)
+        else:
+            validation_data = None
+        if not report_new_data(data, incremental):
+            return
+        model = model_factory((data.texts, None, data.label_names), args)
+        check_bucketing(parser, model, args)
+        configure_encoding(model, cache, args)
+        check_tokenizer(model, data.texts, verbose)
+        record_rows(training_state, offsets)
+        history = model.train_streaming(data, epochs=args.epochs, early_stop=args.early_stop, reduce=args.reduce,
+                                        batch_size=args.batch_size, validation_data=validation_data,
+                                        model_directory=args.save_model, tensor_board_directory=args.tensor_board,
+                                        verbose=verbose, training_state=training_state)
+    else:
+        # Preprocess training data. The texts are parsed once and the tokens shared by all the steps that need them.
+        data = preprocess_labeled_data(args.training_data, args.limit, args.omit_labels, args.text_name,
+                                       args.label_name, sampler=sampler, offsets=offsets)
+        if not report_new_data(data, incremental):
+            return
+        data.texts = TokenizedTexts(data.texts, cache, args.tokenize_workers)
+        if args.validation_data:
+            validation_data = preprocess_labeled_data(args.validation_data, args.limit, args.omit_labels,
+                                                      args.text_name, args.label_name, data.label_names)
+            validation_data.texts = TokenizedTexts(validation_data.texts, cache, args.tokenize_workers)
+        else:
+            validation_data = None
+        # Train the model.
+        model = model_factory(data, args)
+        check_bucketing(parser, model, args)
+        configure_encoding(model, cache, args)
+        check_tokenizer(model, data.texts, verbose)
+        report_vocabulary(model, data, validation_data, verbose)
+        record_rows(training_state, offsets)
+        history = model.train(data, epochs=args.epochs, early_stop=args.early_stop, reduce=args.reduce,
+                              batch_size=args.batch_size, validation_fraction=args.validation_fraction,
+                              validation_data=validation_data, model_directory=args.save_model,
+                              tensor_board_directory=args.tensor_board, verbose=verbose, bucket=args.bucket,
+                              training_state=training_state, workers=args.workers)
     if verbose:
         print(model)
+    if args.bucket:
+        print("Padding waste: %0.1f%% with length buckets, %0.1f%% with fixed length" % (
+            100 * history.padding_waste["bucketed"], 100 * history.padding_waste["fixed"]))
     losses = history.history[history.monitor]
     best_loss = min(losses)
     best_epoch = losses.index(best_loss)
@@ -198,34 +506,219 @@ def train_command(parser, model_factory, args):
     print("Best epoch %d of %d: %s" % (best_epoch + 1, len(history.epoch), s))
 
 
+def report_new_data(data, incremental):
+    """
+    :return: whether there is data to train on
+    :rtype: bool
+    """
+    if incremental:
+        if not len(data):
+            print("No rows have been added to the training data.")
+            return False
+        print("Training on %d new samples." % len(data))
+    return True
+
+
+def record_rows(training_state, offsets):
+    training_state.rows.update((os.path.abspath(name), rows) for name, rows in offsets.items())
+
+
+def tune_command(parser, model_class, args):
+    if args.validation_fraction and args.validation_data:
+        parser.error("Cannot specify both a validation fraction and a validation set.")
+    if not (args.validation_fraction or args.validation_data):
+        parser.error("Tuning requires a validation fraction or a validation set.")
+    bucketing_model_arguments(parser, args)
+    from .selection import SearchSpace, format_result
+
+    try:
+        space = SearchSpace.from_command_line(model_class, args.search)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.schedule == "grid" and not space.is_grid:
+        parser.error("A grid search cannot sample from distributions, use the random or halving schedule.")
+    sampler = training_sampler(parser, args)
+    # Import the text processing libraries only once the arguments are known to be valid.
+    from .text import TokenizedTexts
+
+    cache = encoding_cache(args)
+    data = preprocess_labeled_data(args.training_data, args.limit, args.omit_labels, args.text_name, args.label_name,
+                                   sampler=sampler)
+    data.texts = TokenizedTexts(data.texts, cache, args.tokenize_workers)
+    if args.validation_data:
+        validation_data = preprocess_labeled_data(args.validation_data, args.limit, args.omit_labels, args.text_name,
+                                                  args.label_name, data.label_names)
+        validation_data.texts = TokenizedTexts(validation_data.texts, cache, args.tokenize_workers)
+    else:
+        validation_data = None
+    training = {"early_stop": args.early_stop, "reduce": args.reduce, "batch_size": args.batch_size,
+                "validation_fraction": args.validation_fraction, "validation_data": validation_data,
+                "bucket": args.bucket}
+    tuner = Tuner(model_class, vars(args), data, training, args.output, args.workers, args.save_models, cache,
+                  verbose=True)
+    if args.schedule == "grid":
+        leaderboard = tuner.grid_search(space, args.epochs)
+    elif args.schedule == "random":
+        leaderboard = tuner.random_search(space, args.trials, args.epochs, args.seed)
+    else:
+        leaderboard = tuner.successive_halving(space, args.trials, args.min_epochs, args.epochs, args.eta, args.seed)
+    print("\nLeaderboard")
+    for result in leaderboard:
+        print("%d. %s" % (result["rank"], format_result(result)))
+
+
+def crossval_command(parser, model_class, args):
+    if args.folds < 2:
+        parser.error("Cross-validation requires at least 2 folds.")
+    if args.validation_data:
+        parser.error("Cannot specify validation data for cross-validation, the held out fold is the test data.")
+    bucketing_model_arguments(parser, args)
+    sampler = training_sampler(parser, args)
+    from .selection import CrossValidator
+    from .text import TokenizedTexts
+
+    cache = encoding_cache(args)
+    data = preprocess_labeled_data(args.training_data, args.limit, args.omit_labels, args.text_name, args.label_name,
+                                   sampler=sampler)
+    data.texts = TokenizedTexts(data.texts, cache, args.tokenize_workers)
+    training = {"epochs": args.epochs, "early_stop": args.early_stop, "reduce": args.reduce,
+                "batch_size": args.batch_size, "validation_fraction": args.validation_fraction, "bucket": args.bucket}
+    cross_validator = CrossValidator(model_class, vars(args), data, args.folds, training, args.workers, args.seed,
+                                     cache, verbose=True)
+    results = cross_validator.run(args.save_model)
+    summary = cross_validator.summary()
+    completed = len(cross_validator.completed())
+    if completed < args.folds:
+        print("\n%d of %d folds failed" % (args.folds - completed, args.folds))
+    if completed:
+        print("\nMean (standard deviation) over %d folds: " % completed + " - ".join(
+            "%s: %0.5f (%0.5f)" % (name, mean, deviation) for name, (mean, deviation) in sorted(summary.items())))
+    if args.output:
+        with open(args.output, mode="w") as f:
+            json.dump({"folds": results, "summary": summary}, f, sort_keys=True, indent=4, separators=(",", ": "))
+
+
 # noinspection PyUnresolvedReferences,PyTypeChecker
-def predict_command(args):
+def predict_command(parser, args):
+    import pandas
+    from .data import iterate_data_files, read_data_files
+
     model = load_embedding_model(args.model)
-    data = read_data_files(args.test_data, args.limit)
-    label_probabilities, predicted_labels = model.predict(data[args.text_name], args.batch_size)
-    predictions = pandas.DataFrame(label_probabilities.reshape((len(data), model.num_labels)),
-                                   columns=model.label_names)
-    predictions["predicted label"] = predicted_labels
-    data = data.join(predictions)
-    print(data.to_csv(index=False))
+    check_bucketing(parser, model, args)
+    configure_encoding(model, encoding_cache(args), args)
+    if args.chunk_size:
+        chunks = iterate_data_files(args.test_data, args.chunk_size, args.limit)
+    else:
+        chunks = [read_data_files(args.test_data, args.limit)]
+    if args.output:
+        output = open(args.output, mode="w", newline="")
+    else:
+        output = sys.stdout
+    try:
+        for i, data in enumerate(chunks):
+            label_probabilities, predicted_labels = model.predict(data[args.text_name], args.batch_size, args.bucket)
+            predictions = pandas.DataFrame(label_probabilities.reshape((len(data), model.num_labels)),
+                                           columns=model.label_names)
+            predictions["predicted label"] = predicted_labels
+            data = pandas.concat([data.reset_index(drop=True), predictions], axis=1)
+            with span("write predictions"):
+                data.to_csv(output, header=(i == 0), index=False)
+    finally:
+        if args.output:
+            output.close()
+
+
+def export_command(args):
+    from .inference import export_model
 
+    export_model(load_embedding_model(args.model), args.directory)
 
-def evaluate_command(args):
+
+def serve_command(args):
+    from .inference import InferenceModel, is_exported_model
+    from .server import PredictionServer
+
+    if is_exported_model(args.model):
+        model = InferenceModel(args.model)
+    else:
+        model = load_embedding_model(args.model)
+        model.embedder.workers = args.tokenize_workers
+    batcher = PredictionBatcher(model, args.max_batch_size, args.max_wait / 1000, args.batch_size)
+    server = PredictionServer((args.host, args.port), batcher, args.verbose)
+    print("Serving %s on http://%s:%d" % (args.model, server.server_address[0], server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        print(json.dumps(batcher.statistics.as_dict(), sort_keys=True, indent=4))
+
+
+def evaluate_command(parser, args):
     from .model import load_embedding_model
 
     model = load_embedding_model(args.model)
-    texts, labels, _ = preprocess_labeled_data(args.test_data, args.limit, args.omit_labels, args.text_name,
-                                               args.label_name, model.label_names)
-    results = model.evaluate(texts, labels, args.batch_size)
+    check_bucketing(parser, model, args)
+    if args.embedding_dtypes and not model.has_embedding_layer:
+        parser.error("The %s does not have an embedding layer, so it cannot evaluate embedding precisions." %
+                     model.__class__.__name__)
+    configure_encoding(model, encoding_cache(args), args)
+    data = preprocess_labeled_data(args.test_data, args.limit, args.omit_labels, args.text_name, args.label_name,
+                                   model.label_names)
+    results = model.evaluate(data, batch_size=args.batch_size, bucket=args.bucket)
     print("\n" + " - ".join("%s: %0.5f" % (name, score) for name, score in results))
+    if args.embedding_dtypes:
+        for dtype, dtype_results in model.evaluate_embedding_dtypes(data, dtypes=args.embedding_dtypes,
+                                                                    batch_size=args.batch_size, bucket=args.bucket):
+            print("%s embeddings: " % dtype + " - ".join(
+                "%s: %0.5f (%+0.5f)" % (name, score, score - original)
+                for (name, score), (_, original) in zip(dtype_results, results)))
+
+
+def bucketing_model_arguments(parser, args):
+    """
+    Models that are trained on length-bucketed batches must accept variable-length input. Only models with a
+    variable_length option can be created to do so. Loaded models are checked by check_bucketing once they are loaded.
+    """
+    if args.bucket and not hasattr(args, "load_model"):
+        if not hasattr(args, "variable_length"):
+            parser.error("Only models with a --variable-length option can bucket texts by length.")
+        args.variable_length = True
+
+
+def check_bucketing(parser, model, args):
+    if args.bucket and not model.accepts_variable_length:
+        parser.error("The %s does not accept variable-length input, so it cannot bucket texts by length." %
+                     model.__class__.__name__)
+
+
+def training_sampler(parser, args):
+    """
+    :return: sampler of the training data specified on the command line, or None if it is not sampled
+    :rtype: mycroft.data.Sampler or None
+    """
+    if args.stratify and args.sample_size is None:
+        parser.error("Only a sample size may be stratified.")
+    if args.sample_size is None and args.sample_fraction is None:
+        return None
+    from .data import Sampler
+
+    try:
+        return Sampler(args.sample_size, args.sample_fraction, args.label_name if args.stratify else None,
+                       args.sample_seed)
+    except ValueError as e:
+        parser.error(str(e))
 
 
 # noinspection PyUnresolvedReferences
-def preprocess_labeled_data(data_filenames, limit, omit_labels, text_name, label_name, label_names=None):
+def preprocess_labeled_data(data_filenames, limit, omit_labels, text_name, label_name, label_names=None,
+                            sampler=None, offsets=None):
     """
-    Get text and label information from a CSV file.
+    Get text and label information from data files.
 
-    :param data_filenames: the name of the CSV file
+    :param data_filenames: the names of the data files
     :type data_filenames: list of str
     :param limit: use only this many lines, or if None use the whole file
     :type limit: int or None
@@ -237,24 +730,24 @@ def preprocess_labeled_data(data_filenames, limit, omit_labels, text_name, label
     :type label_name: str
     :param label_names: the set of label names, if None determine this from the data file
     :type label_names: list of str or None
-    :return: texts, labels, the set of labels
-    :rtype: (pandas.Series, numpy.array, list of str)
+    :param sampler: use a sample of the lines, or if None use all of them
+    :type sampler: mycroft.data.Sampler or None
+    :param offsets: number of lines already read from each file, which are skipped; updated as the files are read
+    :type offsets: dict of str to int or None
+    :return: texts with integer label codes and the set of labels
+    :rtype: mycroft.data.Dataset
     """
-    data = read_data_files(data_filenames, limit)
-    if omit_labels:
-        data = data[~data[label_name].isin(omit_labels)]
-    data[label_name] = pandas.Categorical(data[label_name].astype(str), categories=label_names)
-    labels = numpy.array(data[label_name])
-    label_names = list(data[label_name].cat.categories)
-    return data[text_name], labels, label_names
-
+    from .data import Dataset, label_filter, read_data_files
 
-def read_data_files(data_filenames, limit):
-    files = [pandas.read_csv(data_filename, sep=None, engine="python").dropna() for data_filename in data_filenames]
-    return pandas.concat(files)[:limit]
+    data = read_data_files(data_filenames, limit, [text_name, label_name], keep=label_filter(label_name, omit_labels),
+                           sampler=sampler, offsets=offsets)
+    return Dataset.from_labels(data[text_name], data[label_name].astype(str), label_names)
 
 
 def demo_command(args):
+    import pandas
+    from sklearn.datasets import fetch_20newsgroups
+
     def create_data_file(partition, filename, samples):
         data = pandas.DataFrame(
             {TEXT_NAME: partition.data,
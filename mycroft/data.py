@@ -0,0 +1,654 @@
+"""
+Data sets and data set input.
+"""
+import bz2
+import csv
+import gzip
+import json
+import lzma
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy
+import pandas
+
+from .profiling import span
+
+
+class Dataset:
+    """
+    Texts and their labels.
+
+    Labels are stored as integer codes into a list of label names. A data set may also hold encodings of its texts,
+    keyed by the configuration of the embedder that produced them, so that every stage that encodes it with the same
+    embedder reuses the same array.
+
+    Iterating over a data set yields its texts, labels and label names, so it may be used wherever a (texts, labels,
+    label names) tuple is expected.
+    """
+
+    def __init__(self, texts, label_codes=None, label_names=None):
+        """
+        :param texts: the texts
+        :type texts: sequence of str
+        :param label_codes: index into the label names of each text's label, or None if the data is unlabeled
+        :type label_codes: sequence of int or None
+        :param label_names: all the label names
+        :type label_names: list of str or None
+        """
+        if label_codes is not None:
+            label_codes = numpy.asarray(label_codes, dtype="int32")
+            if len(label_codes) != len(texts):
+                raise ValueError("%d texts but %d labels" % (len(texts), len(label_codes)))
+            if len(label_codes) and (label_codes.min() < 0 or label_codes.max() >= len(label_names)):
+                raise ValueError("Label codes out of range for label names %s" % label_names)
+        self.texts = texts
+        self.label_codes = label_codes
+        self.label_names = list(label_names) if label_names is not None else None
+        self.encodings = {}
+
+    @classmethod
+    def from_labels(cls, texts, labels, label_names=None):
+        """
+        Create a data set from label strings.
+
+        :param texts: the texts
+        :type texts: sequence of str
+        :param labels: the label of each text
+        :type labels: sequence of str
+        :param label_names: all the label names, if None use the sorted set of labels
+        :type label_names: list of str or None
+        :return: data set
+        :rtype: Dataset
+        """
+        if label_names is not None:
+            unknown_labels = set(labels).difference(label_names)
+            if unknown_labels:
+                raise ValueError("Labels %s not in label names %s" % (sorted(unknown_labels), label_names))
+        labels = pandas.Categorical(labels, categories=label_names)
+        return cls(texts, labels.codes, list(labels.categories))
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return iter((self.texts, self.labels, self.label_names))
+
+    def __repr__(self):
+        if self.label_names is None:
+            return "Data set: %d texts" % len(self)
+        return "Data set: %d texts, %d labels" % (len(self), len(self.label_names))
+
+    @property
+    def labels(self):
+        """
+        :return: the label of each text, or None if the data is unlabeled
+        :rtype: numpy.array of str or None
+        """
+        if self.label_codes is None:
+            return None
+        return numpy.array(self.label_names, dtype=object)[self.label_codes]
+
+    def encode(self, embedder, encode):
+        """
+        Get the encoding of the texts for an embedder, computing it the first time it is requested.
+
+        :param embedder: embedder whose configuration identifies the encoding
+        :type embedder: mycroft.text.Embedder
+        :param encode: function that encodes texts
+        :type encode: callable
+        :return: text encodings
+        :rtype: numpy.array
+        """
+        key = self.encoding_key(embedder)
+        if key not in self.encodings:
+            self.encodings[key] = encode(self.texts)
+        return self.encodings[key]
+
+    def add_encoding(self, embedder, encoding):
+        """
+        Store an encoding of the texts computed elsewhere, such as one memory-mapped from a file.
+
+        :param embedder: embedder that produced the encoding
+        :type embedder: mycroft.text.Embedder
+        :param encoding: text encodings
+        :type encoding: numpy.array
+        """
+        if len(encoding) != len(self):
+            raise ValueError("%d encodings for %d texts" % (len(encoding), len(self)))
+        self.encodings[self.encoding_key(embedder)] = encoding
+
+    @staticmethod
+    def encoding_key(embedder):
+        return json.dumps(embedder.configuration(), sort_keys=True)
+
+    def subset(self, indexes):
+        """
+        The samples at a set of indexes, with their labels and any encodings and tokens already computed for them.
+
+        Selecting samples by index copies them, so the subset's encodings are held in memory even if this data set's
+        encodings are memory-mapped.
+
+        :param indexes: indexes of the samples
+        :type indexes: sequence of int
+        :return: data set
+        :rtype: Dataset
+        """
+        from .text import TokenizedTexts
+
+        indexes = numpy.asarray(indexes, dtype="int64")
+        if isinstance(self.texts, TokenizedTexts):
+            texts = self.texts.subset(indexes)
+        else:
+            # Index by position, even if the texts are a pandas series with some other index.
+            texts = list(numpy.array(list(self.texts), dtype=object)[indexes])
+        label_codes = self.label_codes[indexes] if self.label_codes is not None else None
+        subset = Dataset(texts, label_codes, self.label_names)
+        subset.encodings = dict((key, encoding[indexes]) for key, encoding in self.encodings.items())
+        return subset
+
+
+# Formats of data files other than delimited text, and the file name extensions that identify them.
+FORMATS = OrderedDict([(".parquet", "parquet"), (".pq", "parquet"), (".feather", "feather"), (".jsonl", "jsonl"),
+                       (".ndjson", "jsonl")])
+# Characters that may delimit the columns of a delimited text file.
+DELIMITERS = ",\t;|"
+# Compressed file name extensions and the functions that open them.
+COMPRESSIONS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+# Number of rows to read at a time when data files are filtered, sampled or limited as they are read.
+CHUNK_SIZE = 2 ** 16
+
+
+def data_format(data_filename):
+    """
+    :param data_filename: name of a data file
+    :type data_filename: str
+    :return: "parquet", "feather" or "jsonl" if the file name has one of their extensions, otherwise "delimited"
+    :rtype: str
+    """
+    name = data_filename.lower()
+    root, extension = os.path.splitext(name)
+    if extension in COMPRESSIONS:
+        name = root
+    for extension, file_format in FORMATS.items():
+        if name.endswith(extension):
+            return file_format
+    return "delimited"
+
+
+def sniff_delimiter(data_filename, sample_size=2 ** 16):
+    """
+    Determine the delimiter of a text file from its header line.
+
+    :param data_filename: name of a delimited text file, which may be compressed with gzip, bzip2 or xz
+    :type data_filename: str
+    :param sample_size: maximum number of characters to read
+    :type sample_size: int
+    :return: one of DELIMITERS, or a comma if none of them can be detected
+    :rtype: str
+    """
+    opener = COMPRESSIONS.get(os.path.splitext(data_filename)[1].lower(), open)
+    with opener(data_filename, mode="rt", encoding="utf-8", errors="replace", newline="") as f:
+        header = f.readline(sample_size)
+    try:
+        return csv.Sniffer().sniff(header, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+
+
+def read_data_file(data_filename, columns=None, skip=0):
+    """
+    Read a data file.
+
+    Delimited text files are parsed with pandas' C engine using the delimiter found by sniff_delimiter. Parquet and
+    Feather files require pyarrow.
+
+    :param data_filename: name of a delimited text, Parquet, Feather or JSON Lines file
+    :type data_filename: str
+    :param columns: read only these columns, or if None read all of them
+    :type columns: list of str or None
+    :param skip: number of rows at the start of the file to skip
+    :type skip: int
+    :return: the data
+    :rtype: pandas.DataFrame
+    """
+    file_format = data_format(data_filename)
+    if file_format == "parquet":
+        return pandas.read_parquet(data_filename, columns=columns)[skip:]
+    if file_format == "feather":
+        return pandas.read_feather(data_filename, columns=columns)[skip:]
+    if file_format == "jsonl":
+        return project(pandas.read_json(data_filename, lines=True), columns)[skip:]
+    return pandas.read_csv(data_filename, sep=sniff_delimiter(data_filename), usecols=columns,
+                           skiprows=range(1, skip + 1))
+
+
+def iterate_data_file(data_filename, chunk_size, columns=None, skip=0):
+    """
+    Read a data file a chunk at a time. A Feather file is read all at once and then divided into chunks.
+
+    :param data_filename: name of a delimited text, Parquet, Feather or JSON Lines file
+    :type data_filename: str
+    :param chunk_size: maximum number of rows to read at a time
+    :type chunk_size: int
+    :param columns: read only these columns, or if None read all of them
+    :type columns: list of str or None
+    :param skip: number of rows at the start of the file to skip
+    :type skip: int
+    :return: chunks of the data
+    :rtype: iterator of pandas.DataFrame
+    """
+    file_format = data_format(data_filename)
+    if file_format == "parquet":
+        import pyarrow.parquet
+
+        batches = pyarrow.parquet.ParquetFile(data_filename).iter_batches(batch_size=chunk_size, columns=columns)
+        yield from skip_rows((batch.to_pandas() for batch in batches), skip)
+    elif file_format == "feather":
+        data = pandas.read_feather(data_filename, columns=columns)
+        for i in range(skip, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+    elif file_format == "jsonl":
+        with pandas.read_json(data_filename, lines=True, chunksize=chunk_size) as chunks:
+            yield from skip_rows((project(chunk, columns) for chunk in chunks), skip)
+    else:
+        with pandas.read_csv(data_filename, sep=sniff_delimiter(data_filename), chunksize=chunk_size,
+                             usecols=columns, skiprows=range(1, skip + 1)) as chunks:
+            yield from chunks
+
+
+def skip_rows(chunks, skip):
+    for chunk in chunks:
+        if skip >= len(chunk):
+            skip -= len(chunk)
+        else:
+            yield chunk[skip:]
+            skip = 0
+
+
+def project(data, columns):
+    if columns is None:
+        return data
+    missing = [column for column in columns if column not in data.columns]
+    if missing:
+        raise ValueError("Columns %s are not in the data" % missing)
+    return data[columns]
+
+
+def read_data_files(data_filenames, limit=None, columns=None, workers=None, keep=None, sampler=None, offsets=None):
+    """
+    Read data files into a single data frame.
+
+    The files are read at the same time in a pool of threads. If there is a limit or a sampler, the files are instead
+    read a chunk at a time, so that only the rows that are kept are held in memory. Rows with missing values are
+    dropped.
+
+    Offsets make it possible to read only the rows that have been added to files since they were last read. The rows
+    before a file's offset are skipped, and once the file has been read to the end its offset is set to the number of
+    rows in it.
+
+    :param data_filenames: names of delimited text, Parquet, Feather or JSON Lines files
+    :type data_filenames: list of str
+    :param limit: read only this many rows, or if None read all of them
+    :type limit: int or None
+    :param columns: read only these columns, or if None read all of them
+    :type columns: list of str or None
+    :param workers: maximum number of files to read at once, if None one per processor
+    :type workers: int or None
+    :param keep: function that returns a boolean series selecting the rows of a data frame to keep, or None to keep
+        all of them
+    :type keep: callable or None
+    :param sampler: sample the rows that are kept, or if None use all of them
+    :type sampler: Sampler or None
+    :param offsets: number of rows already read from each file, updated as files are read to the end
+    :type offsets: dict of str to int or None
+    :return: the data
+    :rtype: pandas.DataFrame
+    """
+    with span("read data"):
+        if limit is not None or sampler is not None:
+            chunk_size = CHUNK_SIZE if limit is None else max(1, min(limit, CHUNK_SIZE))
+            files = list(iterate_data_files(data_filenames, chunk_size, limit, columns, keep, sampler, offsets))
+        else:
+            skips = [offsets.get(data_filename, 0) if offsets is not None else 0 for data_filename in data_filenames]
+            with ThreadPoolExecutor(min(len(data_filenames), workers or os.cpu_count() or 1)) as executor:
+                files = []
+                for data_filename, skip, (data, rows) in zip(
+                        data_filenames, skips,
+                        executor.map(partial(read_kept_rows, columns=columns, keep=keep), data_filenames, skips)):
+                    files.append(data)
+                    if offsets is not None:
+                        offsets[data_filename] = skip + rows
+        if not files:
+            return pandas.DataFrame(columns=columns)
+        return pandas.concat(files)
+
+
+def read_kept_rows(data_filename, skip=0, columns=None, keep=None):
+    data = read_data_file(data_filename, columns, skip)
+    return select_rows(data, keep), len(data)
+
+
+def select_rows(data, keep=None):
+    """
+    :param data: the data
+    :type data: pandas.DataFrame
+    :param keep: function that returns a boolean series selecting the rows to keep, or None to keep all of them
+    :type keep: callable or None
+    :return: the rows with no missing values that are selected by keep
+    :rtype: pandas.DataFrame
+    """
+    data = data.dropna()
+    if keep is not None and len(data):
+        selected = keep(data)
+        if not selected.all():
+            data = data[selected]
+    return data
+
+
+def iterate_data_files(data_filenames, chunk_size, limit=None, columns=None, keep=None, sampler=None, offsets=None):
+    """
+    Read data files a chunk at a time.
+
+    Rows with missing values and rows not selected by keep are dropped as each chunk is read, then the remaining rows
+    are sampled, then the limit is applied, so reading stops as soon as it has produced enough rows. Offsets are used
+    as by read_data_files. The offset of a file is not updated if the limit stops reading before its end.
+
+    :param data_filenames: names of delimited text, Parquet, Feather or JSON Lines files
+    :type data_filenames: list of str
+    :param chunk_size: maximum number of rows to read at a time
+    :type chunk_size: int
+    :param limit: produce only this many rows, or if None produce all of them
+    :type limit: int or None
+    :param columns: read only these columns, or if None read all of them
+    :type columns: list of str or None
+    :param keep: function that returns a boolean series selecting the rows of a data frame to keep, or None to keep
+        all of them
+    :type keep: callable or None
+    :param sampler: sample the rows that are kept, or if None use all of them
+    :type sampler: Sampler or None
+    :param offsets: number of rows already read from each file, updated as files are read to the end
+    :type offsets: dict of str to int or None
+    :return: chunks of the data
+    :rtype: iterator of pandas.DataFrame
+    """
+    if limit == 0:
+        return
+    chunks = (select_rows(chunk, keep) for chunk in read_chunks(data_filenames, chunk_size, columns, offsets))
+    if sampler is not None:
+        chunks = sampler.sample(chunks, chunk_size)
+    remaining = limit
+    for chunk in chunks:
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        if len(chunk):
+            yield chunk
+        if remaining == 0:
+            return
+
+
+def read_chunks(data_filenames, chunk_size, columns, offsets):
+    for data_filename in data_filenames:
+        skip = offsets.get(data_filename, 0) if offsets is not None else 0
+        rows = 0
+        for chunk in iterate_data_file(data_filename, chunk_size, columns, skip):
+            rows += len(chunk)
+            yield chunk
+        if offsets is not None:
+            offsets[data_filename] = skip + rows
+
+
+def label_filter(label_name, omit_labels=None, label_names=None):
+    """
+    Select rows by the values in their label column.
+
+    :param label_name: the name of the column containing the labels
+    :type label_name: str
+    :param omit_labels: omit rows that have one of these as a label
+    :type omit_labels: list of str or None
+    :param label_names: omit rows whose label is not one of these, or if None do not
+    :type label_names: list of str or None
+    :return: function that returns a boolean series selecting the rows of a data frame to keep, or None if every row
+        is kept
+    :rtype: callable or None
+    """
+    omit_labels = set(omit_labels or [])
+    if not omit_labels and label_names is None:
+        return None
+
+    def keep(data):
+        labels = data[label_name].astype(str)
+        selected = ~labels.isin(omit_labels)
+        if label_names is not None:
+            selected &= labels.isin(label_names)
+        return selected
+
+    return keep
+
+
+class Sampler:
+    """
+    A random sample of the rows of a stream of data frames.
+
+    A sample fraction keeps each row independently with that probability, so rows are produced as they are read. A
+    sample size draws a uniform sample of that many rows without replacement by giving every row a random key and
+    keeping the rows with the smallest keys, so at most twice the sample size is held in memory. With a stratification
+    column, the rows with the smallest keys are kept for each of its values, and the sample size is divided between
+    them in proportion to their frequency. How many rows each value gets is only known once all the data has been
+    read, so up to twice the sample size is held in memory for every value, and memory grows with the number of
+    distinct values in the column.
+
+    Sampled rows are produced in the order they were read. The random seed is fixed when the sampler is created, so
+    every pass over the same data produces the same sample.
+    """
+
+    def __init__(self, size=None, fraction=None, stratify=None, seed=None):
+        """
+        :param size: number of rows to sample
+        :type size: int or None
+        :param fraction: probability with which to sample each row
+        :type fraction: float or None
+        :param stratify: name of the column to stratify a sample size by, or None to sample all rows together
+        :type stratify: str or None
+        :param seed: random number generator seed, if None choose one at random
+        :type seed: int or None
+        """
+        if (size is None) == (fraction is None):
+            raise ValueError("Specify either a sample size or a sample fraction")
+        if size is not None and size < 1:
+            raise ValueError("Invalid sample size %d" % size)
+        if fraction is not None and not 0 < fraction <= 1:
+            raise ValueError("Invalid sample fraction %s" % fraction)
+        if stratify is not None and size is None:
+            raise ValueError("Only a sample size may be stratified")
+        self.size = size
+        self.fraction = fraction
+        self.stratify = stratify
+        self.seed = seed if seed is not None else numpy.random.randint(2 ** 31 - 1)
+
+    def __repr__(self):
+        if self.size is None:
+            sample = "fraction %s" % self.fraction
+        else:
+            sample = "size %d" % self.size
+        if self.stratify is not None:
+            sample += " stratified by %s" % self.stratify
+        return "Sampler: %s, seed %d" % (sample, self.seed)
+
+    def sample(self, chunks, chunk_size):
+        """
+        :param chunks: chunks of data
+        :type chunks: iterator of pandas.DataFrame
+        :param chunk_size: maximum number of rows in each chunk of a sample size
+        :type chunk_size: int
+        :return: chunks of the sampled rows
+        :rtype: iterator of pandas.DataFrame
+        """
+        generator = numpy.random.RandomState(self.seed)
+        if self.fraction is not None:
+            for chunk in chunks:
+                yield chunk[generator.random_sample(len(chunk)) < self.fraction]
+        else:
+            sample = self.reservoir_sample(chunks, generator)
+            for i in range(0, len(sample), chunk_size):
+                yield sample[i:i + chunk_size]
+
+    def reservoir_sample(self, chunks, generator):
+        # Rows are indexed by their position in the stream so that the sample can be put back in reading order.
+        strata = OrderedDict()
+        position = 0
+        for chunk in chunks:
+            chunk = chunk.set_axis(pandas.RangeIndex(position, position + len(chunk)))
+            position += len(chunk)
+            keys = generator.random_sample(len(chunk))
+            if self.stratify is None:
+                groups = [(None, numpy.arange(len(chunk)))]
+            else:
+                groups = pandas.Series(numpy.arange(len(chunk))).groupby(chunk[self.stratify].values, sort=False)
+            for value, rows in groups:
+                rows = numpy.asarray(rows)
+                stratum = strata.setdefault(value, {"count": 0, "rows": [], "keys": [], "buffered": 0})
+                stratum["count"] += len(rows)
+                stratum["rows"].append(chunk.iloc[rows])
+                stratum["keys"].append(keys[rows])
+                stratum["buffered"] += len(rows)
+                if stratum["buffered"] >= 2 * self.size:
+                    self.compact(stratum, self.size)
+        allocation = allocate(self.size, OrderedDict((value, stratum["count"]) for value, stratum in strata.items()))
+        sample = []
+        for value, stratum in strata.items():
+            self.compact(stratum, allocation[value])
+            sample.extend(stratum["rows"])
+        if not sample:
+            return pandas.DataFrame()
+        return pandas.concat(sample).sort_index()
+
+    @staticmethod
+    def compact(stratum, size):
+        """
+        Keep only the rows of a stratum with the smallest keys.
+        """
+        rows = pandas.concat(stratum["rows"]) if stratum["rows"] else pandas.DataFrame()
+        keys = numpy.concatenate(stratum["keys"]) if stratum["keys"] else numpy.empty(0)
+        if len(keys) > size:
+            smallest = numpy.argpartition(keys, size - 1)[:size] if size else numpy.empty(0, dtype="int64")
+            rows, keys = rows.iloc[smallest], keys[smallest]
+        stratum["rows"], stratum["keys"], stratum["buffered"] = [rows], [keys], len(keys)
+
+
+def allocate(size, counts):
+    """
+    Divide a sample size between strata in proportion to their sizes, rounding by largest remainder.
+
+    :param size: sample size
+    :type size: int
+    :param counts: number of rows in each stratum
+    :type counts: OrderedDict
+    :return: number of rows to sample from each stratum
+    :rtype: dict
+    """
+    total = sum(counts.values())
+    if total <= size:
+        return dict(counts)
+    quotas = dict((value, size * count / total) for value, count in counts.items())
+    allocation = dict((value, int(quota)) for value, quota in quotas.items())
+    shortfall = size - sum(allocation.values())
+    for value in sorted(counts, key=lambda value: quotas[value] - allocation[value], reverse=True)[:shortfall]:
+        allocation[value] += 1
+    return allocation
+
+
+class LabeledDataStream:
+    """
+    Labeled data that is read from disk a chunk at a time every time it is iterated over, so that it may be larger than
+    memory.
+
+    A first pass over the label column determines the label names and the number of samples.
+    """
+
+    def __init__(self, data_filenames, chunk_size, text_name, label_name, limit=None, omit_labels=None,
+                 label_names=None, sampler=None, offsets=None):
+        """
+        :param data_filenames: names of delimited text, Parquet, Feather or JSON Lines files
+        :type data_filenames: list of str
+        :param chunk_size: maximum number of rows to read at a time
+        :type chunk_size: int
+        :param text_name: the name of the column containing the text
+        :type text_name: str
+        :param label_name: the name of the column containing the labels
+        :type label_name: str
+        :param limit: use only this many rows, or if None use all of them
+        :type limit: int or None
+        :param omit_labels: omit rows that have one of these as a label
+        :type omit_labels: list of str or None
+        :param label_names: the set of label names, if None determine this from the data; rows with other labels are
+            omitted
+        :type label_names: list of str or None
+        :param sampler: use a sample of the rows, or if None use all of them
+        :type sampler: Sampler or None
+        :param offsets: number of rows at the start of each file to skip; the first pass over the data records the
+            number of rows in each file in the offsets attribute
+        :type offsets: dict of str to int or None
+        """
+        self.data_filenames = data_filenames
+        self.chunk_size = chunk_size
+        self.text_name = text_name
+        self.label_name = label_name
+        self.limit = limit
+        self.omit_labels = set(omit_labels or [])
+        self.label_names = label_names
+        self.sampler = sampler
+        self.skip = dict(offsets or {})
+        self.offsets = dict(self.skip)
+        observed_labels = set()
+        self.size = 0
+        for _, labels in self.chunks(self.offsets):
+            observed_labels.update(labels)
+            self.size += len(labels)
+        if self.label_names is None:
+            self.label_names = sorted(observed_labels)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "Labeled data stream: %s, %d samples, %d labels, chunk size %d" % (
+            self.data_filenames, len(self), len(self.label_names), self.chunk_size)
+
+    def chunks(self, offsets=None):
+        """
+        :param offsets: number of rows at the start of each file to skip, updated as files are read to the end; if
+            None skip the rows given to the constructor
+        :type offsets: dict of str to int or None
+        :return: chunks of texts and their labels
+        :rtype: iterator of (pandas.Series, numpy.array)
+        """
+        if offsets is None:
+            offsets = dict(self.skip)
+        keep = label_filter(self.label_name, self.omit_labels, self.label_names)
+        for chunk in iterate_data_files(self.data_filenames, self.chunk_size, self.limit,
+                                        [self.text_name, self.label_name], keep, self.sampler, offsets):
+            yield chunk[self.text_name], numpy.array(chunk[self.label_name].astype(str))
+
+    @property
+    def texts(self):
+        """
+        :return: an object that iterates over all the texts a chunk at a time
+        :rtype: iterable of str
+        """
+        return StreamTexts(self)
+
+
+class StreamTexts:
+    def __init__(self, data):
+        self.data = data
+
+    def __iter__(self):
+        for texts, _ in self.data.chunks():
+            yield from texts
+
+    def __len__(self):
+        return len(self.data)
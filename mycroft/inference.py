@@ -0,0 +1,460 @@
+"""
+Prediction with exported models in NumPy, without Keras.
+
+A trained model is exported to a directory containing its layer configurations and label names in a JSON file, its
+weights in a NumPy .npz file and, for sequence models, its vocabulary. An InferenceModel loads that directory and runs
+the forward pass in NumPy, so scoring processes need neither Keras nor a deep learning backend.
+
+Texts are still tokenized with spaCy unless the model uses the regex tokenizer, and bag of words models use spaCy's word
+vectors.
+"""
+import json
+import os
+
+import numpy
+
+from .profiling import span
+
+# Version 2 stores the embedding matrices of models with reduced-precision embeddings at that precision. Other models
+# are still exported as version 1 so that earlier versions can read them.
+FORMAT_VERSION = 2
+
+metadata_name = "model.json"
+weights_name = "weights.npz"
+vocabulary_name = "vocabulary.json"
+
+
+def export_model(model, directory):
+    """
+    Export a trained model.
+
+    :param model: the model
+    :type model: mycroft.model.TextEmbeddingClassifier
+    :param directory: directory in which to write the exported model
+    :type directory: str
+    """
+    from .text import quantize_embeddings
+
+    embedder = model.embedder
+    embedding_dtype = getattr(embedder, "embedding_dtype", "float32")
+    layers = []
+    weights = {}
+    for i, layer in enumerate(model.model.layers):
+        class_name = layer.__class__.__name__
+        if class_name not in LAYERS:
+            raise ValueError("Cannot export %s layer %s" % (class_name, layer.name))
+        check_recurrent_options(class_name, layer)
+        layer_weights = layer.get_weights()
+        if class_name == "Embedding" and embedding_dtype != "float32":
+            # Store the embeddings at the embedder's precision, followed by the row scales of an int8 matrix.
+            matrix, scales = quantize_embeddings(layer_weights[0], embedding_dtype)
+            layer_weights = [matrix] if scales is None else [matrix, scales]
+        names = []
+        for j, array in enumerate(layer_weights):
+            name = "%d.%d" % (i, j)
+            weights[name] = array
+            names.append(name)
+        layers.append({"class_name": class_name, "name": layer.name, "config": layer.get_config(), "weights": names})
+    metadata = {"format_version": 1 if embedding_dtype == "float32" else FORMAT_VERSION,
+                "model": model.__class__.__name__, "label_names": model.label_names,
+                "language_model": embedder.language_model, "tokenizer": getattr(embedder, "tokenizer", "spacy"),
+                "layers": layers}
+    if hasattr(embedder, "vocabulary"):
+        metadata["embedder"] = "sequence"
+        metadata["sequence_length"] = embedder.sequence_length
+    else:
+        metadata["embedder"] = "bag_of_words"
+    os.makedirs(directory, exist_ok=True)
+    if metadata["embedder"] == "sequence":
+        words = [None] * (len(embedder.vocabulary) + 1)
+        for word, index in embedder.vocabulary.items():
+            words[index] = word
+        with open(os.path.join(directory, vocabulary_name), mode="w", encoding="utf-8") as f:
+            json.dump(words[1:], f)
+    with open(os.path.join(directory, weights_name), mode="wb") as f:
+        numpy.savez(f, **weights)
+    with open(os.path.join(directory, metadata_name), mode="w") as f:
+        # Keras configurations may contain values like tuples of numpy integers that JSON does not support directly.
+        json.dump(metadata, f, indent=4, separators=(",", ": "), default=lambda value: value.item())
+
+
+def check_recurrent_options(class_name, layer):
+    """
+    Raise an error for a recurrent layer with an option that the NumPy layers do not implement.
+
+    :param class_name: name of the layer's class
+    :type class_name: str
+    :param layer: Keras layer
+    :type layer: keras.layers.Layer
+    """
+    config = layer.get_config()
+    if class_name == "Bidirectional":
+        class_name, config = config["layer"]["class_name"], config["layer"]["config"]
+    if class_name in RECURRENT_LAYERS:
+        for option in UNSUPPORTED_RECURRENT_OPTIONS:
+            if config.get(option):
+                raise ValueError("Cannot export %s layer %s with %s" % (class_name, layer.name, option))
+
+
+def is_exported_model(directory):
+    return os.path.isfile(os.path.join(directory, metadata_name))
+
+
+class InferenceModel:
+    """
+    A model exported by export_model.
+
+    This has the same predict method and label_names attribute as mycroft.model.TextEmbeddingClassifier, so it may be
+    used in its place for prediction.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: directory containing the exported model
+        :type directory: str
+        """
+        with open(os.path.join(directory, metadata_name)) as f:
+            metadata = json.load(f)
+        if metadata["format_version"] > FORMAT_VERSION:
+            raise ValueError("Exported model format version %d is newer than the supported version %d" % (
+                metadata["format_version"], FORMAT_VERSION))
+        with numpy.load(os.path.join(directory, weights_name)) as weights:
+            self.layers = [LAYERS[layer["class_name"]](layer["config"], [weights[name] for name in layer["weights"]])
+                           for layer in metadata["layers"]]
+        self.model_name = metadata["model"]
+        self.label_names = metadata["label_names"]
+        self.language_model = metadata["language_model"]
+        self.tokenizer = metadata["tokenizer"]
+        self.embedder = metadata["embedder"]
+        if self.embedder == "sequence":
+            self.sequence_length = metadata["sequence_length"]
+            with open(os.path.join(directory, vocabulary_name), encoding="utf-8") as f:
+                self.vocabulary = dict((word, index) for index, word in enumerate(json.load(f), 1))
+
+    def __repr__(self):
+        return "Exported %s: %d labels, %d layers, %s tokenizer" % (
+            self.model_name, self.num_labels, len(self.layers), self.tokenizer)
+
+    @property
+    def num_labels(self):
+        return len(self.label_names)
+
+    def predict(self, texts, batch_size=256):
+        """
+        :param texts: texts to classify
+        :type texts: sequence of str
+        :param batch_size: number of texts to run through the network at once
+        :type batch_size: int
+        :return: label probabilities and predicted labels
+        :rtype: (numpy.array, list of str)
+        """
+        texts = list(texts)
+        with span("encode"):
+            encodings = self.encode(texts)
+        with span("predict"):
+            label_probabilities = numpy.zeros((len(texts), self.num_labels), dtype="float32")
+            for i in range(0, len(texts), batch_size):
+                label_probabilities[i:i + batch_size] = self.forward(self.batch(encodings[i:i + batch_size]))
+        predicted_labels = label_probabilities.argmax(axis=1)
+        return label_probabilities, [self.label_names[label_index] for label_index in predicted_labels]
+
+    def encode(self, texts):
+        """
+        :param texts: texts to encode
+        :type texts: list of str
+        :return: document vectors for a bag of words model, vocabulary index sequences for a sequence model
+        :rtype: numpy.array or list of numpy.array
+        """
+        from .text import document_vectors, token_strings
+
+        if self.embedder == "bag_of_words":
+            return document_vectors(self.language_model, texts, self.tokenizer)
+        return [numpy.array([self.vocabulary.get(token, 0)
+                             for token in tokens[max(len(tokens) - self.sequence_length, 0):]], dtype="int32")
+                for tokens in token_strings(self.language_model, texts, self.tokenizer)]
+
+    def batch(self, encodings):
+        """
+        Pad a batch of sequences at the front like Keras. Models with a fixed input length are padded to the sequence
+        length, and those without one to the longest sequence in the batch.
+        """
+        if self.embedder == "bag_of_words":
+            return encodings
+        length = self.layers[0].input_length or max(max(len(sequence) for sequence in encodings), 1)
+        x = numpy.zeros((len(encodings), length), dtype="int32")
+        for i, sequence in enumerate(encodings):
+            if len(sequence):
+                x[i, -len(sequence):] = sequence
+        return x
+
+    def forward(self, x):
+        """
+        :param x: a batch of model inputs
+        :type x: numpy.array
+        :return: the output of the final layer
+        :rtype: numpy.array
+        """
+        mask = None
+        for layer in self.layers:
+            x, mask = layer(x, mask)
+        return x
+
+
+def hard_sigmoid(x):
+    return numpy.clip(0.2 * x + 0.5, 0, 1)
+
+
+def sigmoid(x):
+    return 1 / (1 + numpy.exp(-x))
+
+
+def softmax(x):
+    e = numpy.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: numpy.maximum(x, 0),
+    "tanh": numpy.tanh,
+    "sigmoid": sigmoid,
+    "hard_sigmoid": hard_sigmoid,
+    "softmax": softmax
+}
+
+
+def activation(name):
+    try:
+        return ACTIVATIONS[name]
+    except KeyError:
+        raise ValueError("Unsupported activation %s" % name)
+
+
+def first(value):
+    """
+    Keras stores one-dimensional sizes like kernel_size as either an integer or a list of one integer.
+    """
+    if isinstance(value, (list, tuple)):
+        return value[0]
+    return value
+
+
+class Layer:
+    """
+    The forward pass of a Keras layer. Layers take a batch of inputs and an optional mask of the valid time steps and
+    return a batch of outputs and the mask to pass to the next layer.
+    """
+
+    def __init__(self, config, weights):
+        self.config = config
+        self.weights = weights
+
+    def __call__(self, x, mask):
+        raise NotImplementedError()
+
+
+class Embedding(Layer):
+    """
+    The embedding matrix may be stored at reduced precision, in which case the rows are converted to float32 as they
+    are looked up. An int8 matrix is followed by the scale of each row.
+    """
+
+    def __init__(self, config, weights):
+        super().__init__(config, weights)
+        self.input_length = config.get("input_length")
+
+    def __call__(self, x, mask):
+        embeddings = self.weights[0][x]
+        if len(self.weights) > 1:
+            embeddings = embeddings.astype("float32") * self.weights[1][x][..., numpy.newaxis]
+        elif embeddings.dtype == numpy.float16:
+            embeddings = embeddings.astype("float32")
+        if self.config.get("mask_zero"):
+            return embeddings, x != 0
+        return embeddings, None
+
+
+class Dropout(Layer):
+    def __call__(self, x, mask):
+        return x, mask
+
+
+class Flatten(Layer):
+    def __call__(self, x, mask):
+        return x.reshape((x.shape[0], -1)), None
+
+
+class Dense(Layer):
+    def __call__(self, x, mask):
+        y = x.dot(self.weights[0])
+        if self.config.get("use_bias", True):
+            y += self.weights[1]
+        return activation(self.config["activation"])(y), None
+
+
+class Conv1D(Layer):
+    def __call__(self, x, mask):
+        kernel = self.weights[0]
+        kernel_size = kernel.shape[0]
+        stride = first(self.config.get("strides", 1))
+        dilation = first(self.config.get("dilation_rate", 1))
+        span_size = (kernel_size - 1) * dilation + 1
+        padding = self.config.get("padding", "valid")
+        if padding == "same":
+            total = max((-(-x.shape[1] // stride) - 1) * stride + span_size - x.shape[1], 0)
+            x = numpy.pad(x, ((0, 0), (total // 2, total - total // 2), (0, 0)), mode="constant")
+        elif padding == "causal":
+            x = numpy.pad(x, ((0, 0), (span_size - 1, 0), (0, 0)), mode="constant")
+        length = (x.shape[1] - span_size) // stride + 1
+        y = numpy.zeros((x.shape[0], length, kernel.shape[2]), dtype=x.dtype)
+        for k in range(kernel_size):
+            start = k * dilation
+            y += x[:, start:start + (length - 1) * stride + 1:stride].dot(kernel[k])
+        if self.config.get("use_bias", True):
+            y += self.weights[1]
+        return activation(self.config["activation"])(y), None
+
+
+class MaxPooling1D(Layer):
+    def __call__(self, x, mask):
+        pool_size = first(self.config["pool_size"])
+        stride = first(self.config.get("strides") or pool_size)
+        if self.config.get("padding", "valid") == "same":
+            length = -(-x.shape[1] // stride)
+            total = max((length - 1) * stride + pool_size - x.shape[1], 0)
+            x = numpy.pad(x, ((0, 0), (total // 2, total - total // 2), (0, 0)), mode="constant",
+                          constant_values=-numpy.inf)
+        length = (x.shape[1] - pool_size) // stride + 1
+        return numpy.max([x[:, k:k + (length - 1) * stride + 1:stride] for k in range(pool_size)], axis=0), None
+
+
+class Recurrent(Layer):
+    """
+    A recurrent layer. The input projections of all the time steps are computed at once, and then the time steps are
+    run in order. At masked time steps the previous state is carried forward unchanged, as in Keras.
+    """
+    gates = None
+
+    def __init__(self, config, weights):
+        super().__init__(config, weights)
+        self.units = config["units"]
+        self.activation = activation(config.get("activation", "tanh"))
+        self.recurrent_activation = activation(config.get("recurrent_activation", "hard_sigmoid"))
+
+    def __call__(self, x, mask, go_backwards=None):
+        if go_backwards is None:
+            go_backwards = self.config.get("go_backwards", False)
+        kernel, recurrent_kernel = self.weights[:2]
+        projections = x.dot(kernel)
+        if self.config.get("use_bias", True):
+            projections += self.input_bias
+        if mask is None:
+            mask = numpy.ones(x.shape[:2], dtype=bool)
+        steps = range(x.shape[1])
+        if go_backwards:
+            steps = reversed(steps)
+        states = [numpy.zeros((x.shape[0], self.units), dtype=projections.dtype) for _ in range(self.state_count)]
+        outputs = []
+        for t in steps:
+            new_states = self.step(projections[:, t], states, recurrent_kernel)
+            valid = mask[:, t, numpy.newaxis]
+            states = [numpy.where(valid, new, old) for new, old in zip(new_states, states)]
+            outputs.append(states[0])
+        if self.config.get("return_sequences"):
+            return numpy.stack(outputs, axis=1), mask
+        return states[0], None
+
+    @property
+    def input_bias(self):
+        return self.weights[2]
+
+    @property
+    def state_count(self):
+        raise NotImplementedError()
+
+    def step(self, projection, states, recurrent_kernel):
+        raise NotImplementedError()
+
+
+class GRU(Recurrent):
+    """
+    A GRU layer. With the reset_after option the reset gate is applied after the recurrent projection instead of
+    before it, and the bias has separate input and recurrent rows.
+    """
+    state_count = 1
+
+    def __init__(self, config, weights):
+        super().__init__(config, weights)
+        self.reset_after = config.get("reset_after", False)
+
+    @property
+    def input_bias(self):
+        if self.reset_after:
+            return self.weights[2][0]
+        return self.weights[2]
+
+    def step(self, projection, states, recurrent_kernel):
+        h = states[0]
+        u = self.units
+        x_z, x_r, x_h = projection[:, :u], projection[:, u:2 * u], projection[:, 2 * u:]
+        if self.reset_after:
+            inner = h.dot(recurrent_kernel)
+            if self.config.get("use_bias", True):
+                inner += self.weights[2][1]
+            z = self.recurrent_activation(x_z + inner[:, :u])
+            r = self.recurrent_activation(x_r + inner[:, u:2 * u])
+            hh = self.activation(x_h + r * inner[:, 2 * u:])
+        else:
+            z = self.recurrent_activation(x_z + h.dot(recurrent_kernel[:, :u]))
+            r = self.recurrent_activation(x_r + h.dot(recurrent_kernel[:, u:2 * u]))
+            hh = self.activation(x_h + (r * h).dot(recurrent_kernel[:, 2 * u:]))
+        return [z * h + (1 - z) * hh]
+
+
+class LSTM(Recurrent):
+    state_count = 2
+
+    def step(self, projection, states, recurrent_kernel):
+        h, c = states
+        z = projection + h.dot(recurrent_kernel)
+        u = self.units
+        i = self.recurrent_activation(z[:, :u])
+        f = self.recurrent_activation(z[:, u:2 * u])
+        c = f * c + i * self.activation(z[:, 2 * u:3 * u])
+        o = self.recurrent_activation(z[:, 3 * u:])
+        return [o * self.activation(c), c]
+
+
+class Bidirectional(Layer):
+    def __init__(self, config, weights):
+        super().__init__(config, weights)
+        layer = config["layer"]
+        recurrent_class = RECURRENT_LAYERS[layer["class_name"]]
+        n = len(weights) // 2
+        self.forward_layer = recurrent_class(layer["config"], weights[:n])
+        self.backward_layer = recurrent_class(layer["config"], weights[n:])
+        self.merge_mode = config.get("merge_mode", "concat")
+
+    def __call__(self, x, mask):
+        y, output_mask = self.forward_layer(x, mask, go_backwards=False)
+        y_reverse, _ = self.backward_layer(x, mask, go_backwards=True)
+        if self.forward_layer.config.get("return_sequences"):
+            y_reverse = y_reverse[:, ::-1]
+        if self.merge_mode == "concat":
+            return numpy.concatenate([y, y_reverse], axis=-1), output_mask
+        if self.merge_mode == "sum":
+            return y + y_reverse, output_mask
+        if self.merge_mode == "ave":
+            return (y + y_reverse) / 2, output_mask
+        if self.merge_mode == "mul":
+            return y * y_reverse, output_mask
+        raise ValueError("Unsupported merge mode %s" % self.merge_mode)
+
+
+RECURRENT_LAYERS = {"GRU": GRU, "LSTM": LSTM}
+
+# Options of Keras recurrent layers that change their outputs and are not implemented by the NumPy layers.
+UNSUPPORTED_RECURRENT_OPTIONS = ["return_state", "stateful"]
+
+LAYERS = {"Embedding": Embedding, "Dropout": Dropout, "Flatten": Flatten, "Dense": Dense, "Conv1D": Conv1D,
+          "MaxPooling1D": MaxPooling1D, "Bidirectional": Bidirectional, **RECURRENT_LAYERS}
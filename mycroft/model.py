@@ -1,39 +1,358 @@
 """Machine learning components"""
 import inspect
 import json
+import math
 import os
 import pickle
 import sys
 import textwrap
+import threading
+from collections import OrderedDict
 from io import StringIO
 
 import mycroft
-from .text import TextSequenceEmbedder, maximum_text_length
+from .options import EMBEDDING_DTYPES, TOKENIZERS
+from .profiling import epoch_callback, span
 
 
-def load_embedding_model(model_directory):
+def load_embedding_model(model_directory, checkpoint=False):
     """
     Load a trained model.
 
     :param model_directory: directory in which the model was saved
     :type model_directory: str
+    :param checkpoint: load the weights and optimizer state at the end of the last training epoch instead of those of
+        the best epoch
+    :type checkpoint: bool
     :return: the model
     :rtype: TextEmbeddingClassifier
     """
-    with open(os.path.join(model_directory, TextEmbeddingClassifier.classifier_name), mode="rb") as f:
-        model = pickle.load(f)
-    model.load_model(model_directory)
+    with span("load model"):
+        with open(os.path.join(model_directory, TextEmbeddingClassifier.classifier_name), mode="rb") as f:
+            model = pickle.load(f)
+        model.load_model(model_directory, checkpoint)
     return model
 
 
+def save_history(history, filename):
+    """
+    Write a training history to a JSON file.
+
+    :param history: training history returned by TextEmbeddingClassifier.train, with its monitor attribute set
+    :type history: keras.callbacks.History
+    :param filename: name of the file
+    :type filename: str
+    """
+    with open(filename, mode="w") as f:
+        h = {"epoch": history.epoch, "history": history.history, "monitor": history.monitor,
+             "params": history.params}
+        # JSON requires float, not numpy.float32.
+        if "lr" in h["history"]:
+            # noinspection PyTypeChecker
+            h["history"]["lr"] = [float(x) for x in h["history"]["lr"]]
+        json.dump(h, f, sort_keys=True, indent=4, separators=(",", ": "))
+
+
+class TrainingState:
+    """
+    The progress of training, saved in the model directory at the end of every epoch so that training can be resumed.
+
+    This records the number of epochs run, the training history, the learning rate, the progress of the early stopping,
+    learning rate reduction and model checkpoint callbacks, and whether training was stopped early. The weights and
+    optimizer state at the end of the epoch are saved alongside it in a checkpoint model file.
+
+    It also records the number of rows read from each training data file, so that incremental training can train on
+    only the rows added since.
+    """
+    file_name = "training_state.json"
+    # Attributes of the Keras callbacks that hold their progress.
+    PROGRESS = {"EarlyStopping": ["wait", "best", "stopped_epoch"],
+                "ReduceLROnPlateau": ["wait", "best", "cooldown_counter"],
+                "ModelCheckpoint": ["best"]}
+
+    def __init__(self, epoch=0, monitor=None, history=None, learning_rate=None, progress=None, stopped=False,
+                 rows=None):
+        """
+        :param epoch: number of epochs run
+        :type epoch: int
+        :param monitor: the training metric used to choose the best epoch
+        :type monitor: str or None
+        :param history: the training metrics of every epoch
+        :type history: dict of str to list of float or None
+        :param learning_rate: the learning rate at the end of the last epoch
+        :type learning_rate: float or None
+        :param progress: the progress attributes of each callback, by callback class name
+        :type progress: dict or None
+        :param stopped: whether training was stopped early
+        :type stopped: bool
+        :param rows: number of rows read from each training data file, by absolute file name
+        :type rows: dict of str to int or None
+        """
+        self.epoch = epoch
+        self.monitor = monitor
+        self.history = history or {}
+        self.learning_rate = learning_rate
+        self.progress = progress or {}
+        self.stopped = stopped
+        self.rows = rows or {}
+
+    def __repr__(self):
+        return "Training state: %d epochs%s" % (self.epoch, ", stopped early" if self.stopped else "")
+
+    @classmethod
+    def load(cls, model_directory):
+        """
+        :param model_directory: directory in which a model was trained
+        :type model_directory: str
+        :return: the state saved in the directory, or None if there is none
+        :rtype: TrainingState or None
+        """
+        try:
+            with open(os.path.join(model_directory, cls.file_name)) as f:
+                return cls(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, model_directory):
+        filename = os.path.join(model_directory, self.file_name)
+        # Write a whole new file so that an interruption does not leave a partial one.
+        with open(filename + ".tmp", mode="w") as f:
+            json.dump(self.__dict__, f, sort_keys=True, indent=4, separators=(",", ": "))
+        os.replace(filename + ".tmp", filename)
+
+    def restart(self):
+        """
+        The state with which to continue training on new data: the epoch count, history and learning rate carry on,
+        but early stopping, learning rate reduction and model checkpointing start afresh.
+
+        :return: training state
+        :rtype: TrainingState
+        """
+        return TrainingState(self.epoch, self.monitor, self.history, self.learning_rate, rows=self.rows)
+
+    def callback(self, callbacks, monitor, model_directory):
+        """
+        Create a callback that restores the progress of the other training callbacks at the start of training and
+        updates and saves this state at the end of every epoch.
+
+        It must come after the other callbacks, which reset their progress at the start of training and update it at
+        the end of every epoch.
+
+        :param callbacks: the other training callbacks
+        :type callbacks: list of keras.callbacks.Callback
+        :param monitor: the training metric used to choose the best epoch
+        :type monitor: str
+        :param model_directory: directory in which to save the state and a checkpoint model, if None do not save them
+        :type model_directory: str or None
+        :return: callback
+        :rtype: keras.callbacks.Callback
+        """
+        from keras import backend
+        from keras.callbacks import Callback
+
+        if self.epoch and self.monitor != monitor:
+            raise ValueError("Training monitored %s, so it cannot be continued monitoring %s" % (self.monitor, monitor))
+        self.monitor = monitor
+        state = self
+        tracked = [(callback, self.PROGRESS[type(callback).__name__]) for callback in callbacks
+                   if type(callback).__name__ in self.PROGRESS]
+
+        class TrainingStateCallback(Callback):
+            def on_train_begin(self, logs=None):
+                for callback, attributes in tracked:
+                    for attribute, value in state.progress.get(type(callback).__name__, {}).items():
+                        setattr(callback, attribute, value)
+                if state.learning_rate is not None:
+                    backend.set_value(self.model.optimizer.lr, state.learning_rate)
+
+            def on_epoch_end(self, epoch, logs=None):
+                state.epoch = epoch + 1
+                for name, value in (logs or {}).items():
+                    # JSON requires float, not numpy.float32.
+                    state.history.setdefault(name, []).append(float(value))
+                state.learning_rate = float(backend.get_value(self.model.optimizer.lr))
+                state.progress = dict((type(callback).__name__,
+                                       dict((attribute, json_value(getattr(callback, attribute)))
+                                            for attribute in attributes))
+                                      for callback, attributes in tracked)
+                state.stopped = bool(self.model.stop_training)
+                if model_directory is not None:
+                    checkpoint = os.path.join(model_directory, TextEmbeddingClassifier.checkpoint_name)
+                    self.model.save(checkpoint + ".tmp")
+                    os.replace(checkpoint + ".tmp", checkpoint)
+                    state.save(model_directory)
+
+        return TrainingStateCallback()
+
+
+def json_value(value):
+    # Convert numpy scalars to the Python numbers that JSON can represent.
+    return value.item() if hasattr(value, "item") else value
+
+
+class ModelRegistry:
+    """
+    Thread-safe cache of loaded models keyed by model directory.
+
+    A model is reloaded if any file in its directory has been modified since it was loaded. When more than the maximum
+    number of models are loaded, or their estimated total size exceeds the maximum number of bytes, the least recently
+    used models are evicted. Concurrent requests for the same model directory load it only once.
+    """
+    MAX_MODELS = 16
+
+    def __init__(self, max_models=MAX_MODELS, max_bytes=None, loader=load_embedding_model):
+        """
+        :param max_models: maximum number of models to keep loaded
+        :type max_models: int
+        :param max_bytes: maximum estimated total size of the loaded models, or None for no limit
+        :type max_bytes: int or None
+        :param loader: function that loads a model from a directory
+        :type loader: callable
+        """
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        # Model directory -> (directory signature, model, size)
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        # Model directory -> [lock held while loading it, number of threads using the lock]
+        self.loading_locks = {}
+
+    def __repr__(self):
+        return "Model registry: %d models, %d bytes, %d hits, %d misses" % (len(self), self.size, self.hits,
+                                                                          self.misses)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.models)
+
+    def __contains__(self, model_directory):
+        with self.lock:
+            return os.path.realpath(model_directory) in self.models
+
+    def get(self, model_directory):
+        """
+        Get a model, loading it if it is not in the registry or has changed on disk.
+
+        :param model_directory: directory in which the model was saved
+        :type model_directory: str
+        :return: the model
+        :rtype: TextEmbeddingClassifier
+        """
+        key = os.path.realpath(model_directory)
+        signature = self.directory_signature(key)
+        model = self.lookup(key, signature)
+        if model is not None:
+            return model
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(key, [threading.Lock(), 0])
+            loading_lock[1] += 1
+        try:
+            with loading_lock[0]:
+                # Another thread may have loaded the model while this one was waiting.
+                model = self.lookup(key, signature)
+                if model is None:
+                    model = self.loader(model_directory)
+                    size = self.model_size(model)
+                    with self.lock:
+                        self.misses += 1
+                        self.models[key] = (signature, model, size)
+                        self.evict()
+        finally:
+            # Drop the lock once no thread is loading the model.
+            with self.lock:
+                loading_lock[1] -= 1
+                if not loading_lock[1]:
+                    del self.loading_locks[key]
+        return model
+
+    def lookup(self, key, signature):
+        with self.lock:
+            entry = self.models.get(key)
+            if entry is None or entry[0] != signature:
+                return None
+            self.models.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def remove(self, model_directory):
+        with self.lock:
+            self.models.pop(os.path.realpath(model_directory), None)
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+    @property
+    def size(self):
+        with self.lock:
+            return sum(entry[2] for entry in self.models.values())
+
+    def evict(self):
+        # The most recently loaded model is always kept, even if it alone exceeds the limits.
+        while len(self.models) > 1 and \
+                (len(self.models) > self.max_models or
+                 (self.max_bytes is not None and sum(entry[2] for entry in self.models.values()) > self.max_bytes)):
+            self.models.popitem(last=False)
+
+    @staticmethod
+    def directory_signature(model_directory):
+        """
+        The names, modification times and sizes of the files in a model directory.
+
+        Saves write temporary files and rename them into place, so temporary files, and files that disappear while the
+        directory is being read, are left out.
+
+        :param model_directory: model directory
+        :type model_directory: str
+        :return: signature that changes when a file in the directory changes
+        :rtype: tuple
+        """
+        signature = []
+        for entry in os.scandir(model_directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(signature))
+
+    @staticmethod
+    def model_size(model):
+        """
+        Estimated memory used by a model: 4 bytes per Keras parameter plus the embedder's embedding matrix unless it
+        is memory-mapped, in which case it is shared with other processes, or has not been built yet. Measuring the
+        size does not build embeddings that are created lazily.
+
+        :param model: the model
+        :type model: TextEmbeddingClassifier
+        :return: estimated size in bytes
+        :rtype: int
+        """
+        import numpy
+
+        size = 4 * model.model.count_params()
+        embedding_matrix = getattr(model.embedder, "_embedding_matrix", None)
+        if embedding_matrix is not None and not isinstance(embedding_matrix, numpy.memmap):
+            size += embedding_matrix.nbytes
+        return size
+
+
 class TextEmbeddingClassifier:
     """
     Base class for models that can do text classification using text vector embeddings.
 
     Derived classes must define a constructor that takes a training data argument followed by model hyper-parameters.
-    The training data argument is a 3-ple (texts, labels, label names). The label names must be passed up to this
-    constructor. The texts and labels are present in case they are needed to determine hyper-parameters. (See
-    the constructors of ConvolutionNetClassifier and RNNClassifier for examples of this.
+    The training data argument is a 3-ple (texts, labels, label names), which may also be a mycroft.data.Dataset. The
+    label names must be passed up to this constructor. The texts and labels are present in case they are needed to
+    determine hyper-parameters. (See the constructors of ConvolutionNetClassifier and RNNClassifier for examples of
+    this.
 
     When one of these classes is passed a part of the model_specification argument to mycroft.console.main, Mycroft will
     create command line arguments for all the hyper-parameter arguments in its constructor. Positional constructor
@@ -45,13 +364,19 @@ class TextEmbeddingClassifier:
     EARLY_STOP = 10
     REDUCE = 5
     BATCH_SIZE = 32
+    TOKENIZER = "spacy"
+    TOKENIZERS = TOKENIZERS
 
     # Names of files created in the model directory.
     model_name = "model.hd5"
+    checkpoint_name = "checkpoint.hd5"
     classifier_name = "classifier.pk"
     description_name = "description.txt"
     history_name = "history.json"
 
+    # Optional mycroft.cache.EncodingCache used by encode. This is not saved with the model.
+    encoding_cache = None
+
     def __init__(self, model, embedder, label_names):
         """
         Derived classes instantiate an embedder and compile a model, which are passed up to here.
@@ -81,35 +406,192 @@ class TextEmbeddingClassifier:
     def __getstate__(self):
         d = self.__dict__.copy()
         del d["model"]
+        d.pop("encoding_cache", None)
         return d
 
-    def train(self, texts, labels, epochs=EPOCHS, early_stop=EARLY_STOP, reduce=REDUCE, batch_size=BATCH_SIZE,
+    def train(self, texts, labels=None, epochs=EPOCHS, early_stop=EARLY_STOP, reduce=REDUCE, batch_size=BATCH_SIZE,
               validation_fraction=None, validation_data=None, model_directory=None, tensor_board_directory=None,
-              verbose=1):
-        from keras.callbacks import EarlyStopping, ReduceLROnPlateau, TensorBoard
+              verbose=1, bucket=False, training_state=None, workers=1):
+        """
+        Train the model.
 
-        def model_filename():
-            return os.path.join(model_directory, TextEmbeddingClassifier.model_name)
+        The training data may be either texts and labels or a mycroft.data.Dataset passed as the texts argument, in
+        which case the labels argument is ignored. Validation data may likewise be a (texts, labels) pair or a data set.
 
-        def classifier_filename():
-            return os.path.join(model_directory, TextEmbeddingClassifier.classifier_name)
+        If bucket is True, texts of similar length are grouped into batches that are padded only to the length of their
+        longest text. This requires a model that accepts variable-length input. The fraction of the training batches
+        taken up by padding with and without bucketing is stored in the padding_waste attribute of the returned history.
 
-        def description_filename():
-            return os.path.join(model_directory, TextEmbeddingClassifier.description_name)
+        To continue earlier training, pass its training state. Training resumes after the last epoch it ran and stops
+        after the given number of epochs in all, and the returned history includes the earlier epochs. The state is
+        updated as training proceeds and saved with a checkpoint of the model in the model directory at the end of
+        every epoch.
 
-        def history_filename():
-            return os.path.join(model_directory, TextEmbeddingClassifier.history_name)
+        With more than one worker, each epoch's batches are divided between that many processes that train replicas of
+        the model and periodically average their weights. See mycroft.parallel.ParallelTrainer.
 
-        def create_directory(directory):
-            os.makedirs(directory, exist_ok=True)
+        :return: training history
+        :rtype: keras.callbacks.History
+        """
+        from .data import Dataset
 
         assert not (
             validation_fraction and validation_data), "Both validation fraction and validation data are specified"
+        if bucket and workers > 1:
+            raise ValueError("Cannot bucket texts by length when training in parallel")
         doing_validation = validation_fraction or validation_data
+        if bucket:
+            encode = self.encode_sequences
+        else:
+            encode = self.encode
+        with span("encode"):
+            if isinstance(validation_data, Dataset):
+                validation_data = (encode(validation_data), self.label_indexes(validation_data))
+            elif validation_data:
+                validation_data = (encode(validation_data[0]), self.label_indexes(validation_data[1]))
+            training_vectors = encode(texts)
+            labels = self.label_indexes(texts if isinstance(texts, Dataset) else labels)
+        training_state = training_state or TrainingState()
+        initial_epoch = training_state.epoch
+        callbacks, monitor = self.training_callbacks(doing_validation, early_stop, reduce, model_directory,
+                                                     tensor_board_directory, verbose, training_state)
+        with span("fit"):
+            if bucket:
+                history = self.fit_buckets(training_vectors, labels, epochs, batch_size, validation_fraction,
+                                           validation_data, callbacks, verbose, initial_epoch)
+            elif workers > 1:
+                from .parallel import ParallelTrainer
+
+                history = ParallelTrainer(self.model, workers).fit(training_vectors, labels, epochs, batch_size,
+                                                                   validation_fraction, validation_data, callbacks,
+                                                                   verbose, initial_epoch)
+            else:
+                history = self.model.fit(training_vectors, labels, epochs=epochs, batch_size=batch_size,
+                                         validation_split=validation_fraction, validation_data=validation_data,
+                                         verbose=verbose, callbacks=callbacks, initial_epoch=initial_epoch)
+        self.continue_history(history, training_state)
+        with span("save"):
+            self.save(model_directory, history, monitor)
+        return history
+
+    def fit_buckets(self, sequences, labels, epochs, batch_size, validation_fraction, validation_data, callbacks,
+                    verbose, initial_epoch=0):
+        from .text import LengthBuckets
+
+        if validation_fraction:
+            # Like Keras, hold out the end of the training data.
+            split = int(len(sequences) * (1 - validation_fraction))
+            validation_data = (sequences[split:], labels[split:])
+            sequences, labels = sequences[:split], labels[:split]
+        training_buckets = LengthBuckets(sequences, labels, batch_size)
+        if validation_data:
+            validation_buckets = LengthBuckets(validation_data[0], validation_data[1], batch_size)
+            validation_generator = validation_buckets.generate()
+            validation_steps = len(validation_buckets)
+        else:
+            validation_generator = validation_steps = None
+        history = self.model.fit_generator(training_buckets.generate(shuffle=True),
+                                           steps_per_epoch=len(training_buckets), epochs=epochs,
+                                           validation_data=validation_generator, validation_steps=validation_steps,
+                                           verbose=verbose, callbacks=callbacks, initial_epoch=initial_epoch)
+        history.padding_waste = {"bucketed": training_buckets.padding_waste(),
+                                 "fixed": training_buckets.padding_waste(self.embedder.sequence_length)}
+        return history
+
+    def train_streaming(self, data, epochs=EPOCHS, early_stop=EARLY_STOP, reduce=REDUCE, batch_size=BATCH_SIZE,
+                        validation_data=None, model_directory=None, tensor_board_directory=None, verbose=1,
+                        training_state=None):
+        """
+        Train on data that is read from disk and encoded a chunk at a time, so that memory use does not depend on the
+        size of the data set.
+
+        :param data: training data
+        :type data: mycroft.data.LabeledDataStream
+        :param validation_data: optional validation data
+        :type validation_data: mycroft.data.LabeledDataStream or None
+        :param training_state: state of earlier training to continue, as in train
+        :type training_state: TrainingState or None
+        :return: training history
+        :rtype: keras.callbacks.History
+        """
+        training_state = training_state or TrainingState()
+        initial_epoch = training_state.epoch
+        callbacks, monitor = self.training_callbacks(validation_data is not None, early_stop, reduce, model_directory,
+                                                     tensor_board_directory, verbose, training_state)
+        if validation_data is not None:
+            validation_steps = math.ceil(len(validation_data) / batch_size)
+            validation_data = self.encoded_batches(validation_data, batch_size)
+        else:
+            validation_steps = None
+        with span("fit"):
+            history = self.model.fit_generator(self.encoded_batches(data, batch_size, shuffle=True),
+                                               steps_per_epoch=math.ceil(len(data) / batch_size), epochs=epochs,
+                                               validation_data=validation_data, validation_steps=validation_steps,
+                                               verbose=verbose, callbacks=callbacks, initial_epoch=initial_epoch)
+        self.continue_history(history, training_state)
+        with span("save"):
+            self.save(model_directory, history, monitor)
+        return history
+
+    def encoded_batches(self, data, batch_size, shuffle=False):
+        """
+        Endlessly iterate over a data stream, yielding batches of encoded texts and label indexes. Each pass over the
+        data yields ceil(len(data) / batch_size) batches.
+
+        The data files are read in order, so shuffling can only mix samples within a chunk. The samples left over from
+        the end of one chunk are shuffled in with the next, so batches do not always break at the same samples.
+
+        :param data: labeled data
+        :type data: mycroft.data.LabeledDataStream
+        :param batch_size: number of samples in a batch
+        :type batch_size: int
+        :param shuffle: shuffle the samples in each chunk differently on every pass?
+        :type shuffle: bool
+        :return: batches of encoded texts and label indexes
+        :rtype: iterator of (numpy.array, numpy.array)
+        """
+        import numpy
+
+        while True:
+            vectors = labels = None
+            for texts, chunk_labels in data.chunks():
+                with span("encode"):
+                    chunk_vectors = self.encode(texts)
+                    chunk_labels = self.label_indexes(chunk_labels)
+                if vectors is not None:
+                    # Prepend the samples left over from the previous chunk.
+                    chunk_vectors = numpy.concatenate([vectors, chunk_vectors])
+                    chunk_labels = numpy.concatenate([labels, chunk_labels])
+                if shuffle:
+                    order = numpy.random.permutation(len(chunk_vectors))
+                    chunk_vectors, chunk_labels = chunk_vectors[order], chunk_labels[order]
+                n = len(chunk_vectors) // batch_size * batch_size
+                for i in range(0, n, batch_size):
+                    yield chunk_vectors[i:i + batch_size], chunk_labels[i:i + batch_size]
+                vectors, labels = chunk_vectors[n:], chunk_labels[n:]
+            if vectors is not None and len(vectors):
+                yield vectors, labels
+
+    @staticmethod
+    def continue_history(history, training_state):
+        """
+        Replace the history of the epochs just run with that of all the epochs in the training state.
+        """
+        history.epoch = list(range(training_state.epoch))
+        history.history = dict((name, list(values)) for name, values in training_state.history.items())
+
+    def training_callbacks(self, doing_validation, early_stop, reduce, model_directory, tensor_board_directory,
+                           verbose, training_state=None):
+        from keras.callbacks import EarlyStopping, ReduceLROnPlateau, TensorBoard
+
+        def description_filename():
+            return os.path.join(model_directory, TextEmbeddingClassifier.description_name)
+
+        def create_directory(directory):
+            os.makedirs(directory, exist_ok=True)
+
         if doing_validation:
             monitor = "val_loss"
-            if validation_data:
-                validation_data = (self.embedder.encode(validation_data[0]), self.label_indexes(validation_data[1]))
         else:
             monitor = "loss"
         callbacks = []
@@ -117,6 +599,10 @@ class TextEmbeddingClassifier:
             callback_verbosity = 0
         else:
             callback_verbosity = 1
+        # The profiler callback goes first so that the epoch it times starts before the other callbacks run.
+        profiler_callback = epoch_callback()
+        if profiler_callback is not None:
+            callbacks.append(profiler_callback)
         if tensor_board_directory:
             callbacks.append(TensorBoard(log_dir=tensor_board_directory))
         if early_stop:
@@ -133,48 +619,208 @@ class TextEmbeddingClassifier:
                                     monitor=monitor, save_best_only=True, verbose=verbose))
             with open(description_filename(), mode="w") as f:
                 f.write("%s" % self)
+        if training_state is not None:
+            callbacks.append(training_state.callback(callbacks, monitor, model_directory))
+        return callbacks, monitor
 
-        training_vectors = self.embedder.encode(texts)
-        labels = self.label_indexes(labels)
-        history = self.model.fit(training_vectors, labels, epochs=epochs, batch_size=batch_size,
-                                 validation_split=validation_fraction, validation_data=validation_data,
-                                 verbose=verbose, callbacks=callbacks)
-        history.monitor = monitor
+    def save(self, model_directory, history, monitor):
+        def model_filename():
+            return os.path.join(model_directory, TextEmbeddingClassifier.model_name)
+
+        def classifier_filename():
+            return os.path.join(model_directory, TextEmbeddingClassifier.classifier_name)
+
+        def history_filename():
+            return os.path.join(model_directory, TextEmbeddingClassifier.history_name)
 
+        history.monitor = monitor
         if model_directory is not None:
-            if not os.path.isfile(model_filename()):
+            # With validation the model checkpoint callback saves the best model. Without it the last model is best.
+            if monitor == "loss" or not os.path.isfile(model_filename()):
                 self.model.save(model_filename())
             with open(classifier_filename(), mode="wb") as f:
                 pickle.dump(self, f)
-            with open(history_filename(), mode="w") as f:
-                h = {"epoch": history.epoch, "history": history.history, "monitor": history.monitor,
-                     "params": history.params}
-                # JSON requires float, not numpy.float32.
-                if "lr" in h["history"]:
-                    # noinspection PyTypeChecker
-                    h["history"]["lr"] = [float(x) for x in h["history"]["lr"]]
-                json.dump(h, f, sort_keys=True, indent=4, separators=(",", ": "))
-
-        return history
+            self.embedder.save(model_directory)
+            save_history(history, history_filename())
 
-    def predict(self, texts, batch_size=32):
-        embeddings = self.embedder.encode(texts)
-        label_probabilities = self.model.predict(embeddings, batch_size=batch_size, verbose=0)
+    def predict(self, texts, batch_size=32, bucket=False):
+        """
+        :param texts: texts to classify
+        :type texts: sequence of str or mycroft.data.Dataset
+        :param batch_size: prediction batch size
+        :type batch_size: int
+        :param bucket: group texts of similar length into batches padded to their longest text?
+        :type bucket: bool
+        :return: label probabilities and predicted labels
+        :rtype: (numpy.array, list of str)
+        """
+        if bucket:
+            import numpy
+            from .text import LengthBuckets
+
+            with span("encode"):
+                buckets = LengthBuckets(self.encode_sequences(texts), batch_size=batch_size)
+            label_probabilities = numpy.zeros((len(buckets.sequences), self.num_labels), dtype="float32")
+            # Predict in order of length and put the predictions back in the order of the texts.
+            with span("predict"):
+                for indexes in buckets.batch_indexes():
+                    label_probabilities[indexes] = self.model.predict_on_batch(buckets.batch(indexes)[0])
+        else:
+            with span("encode"):
+                embeddings = self.encode(texts)
+            with span("predict"):
+                label_probabilities = self.model.predict(embeddings, batch_size=batch_size, verbose=0)
         predicted_labels = label_probabilities.argmax(axis=1)
         return label_probabilities, [self.label_names[label_index] for label_index in predicted_labels]
 
-    def evaluate(self, texts, labels, batch_size=32):
-        embeddings = self.embedder.encode(texts)
-        labels = self.label_indexes(labels)
-        metrics = self.model.evaluate(embeddings, labels, batch_size=batch_size, verbose=0)
+    def evaluate(self, texts, labels=None, batch_size=32, bucket=False):
+        """
+        :param texts: texts, or a mycroft.data.Dataset in which case the labels argument is ignored
+        :type texts: sequence of str or mycroft.data.Dataset
+        :param labels: the label of each text
+        :type labels: sequence of str or None
+        :param batch_size: evaluation batch size
+        :type batch_size: int
+        :param bucket: group texts of similar length into batches padded to their longest text?
+        :type bucket: bool
+        :return: names and values of the model's metrics
+        :rtype: list of (str, float)
+        """
+        from .data import Dataset
+        from .text import LengthBuckets
+
+        labels = self.label_indexes(texts if isinstance(texts, Dataset) else labels)
+        if bucket:
+            with span("encode"):
+                buckets = LengthBuckets(self.encode_sequences(texts), labels, batch_size)
+            with span("evaluate"):
+                metrics = self.model.evaluate_generator(buckets.generate(), steps=len(buckets))
+        else:
+            with span("encode"):
+                embeddings = self.encode(texts)
+            with span("evaluate"):
+                metrics = self.model.evaluate(embeddings, labels, batch_size=batch_size, verbose=0)
         return list(zip(self.model.metrics_names, metrics))
 
-    def label_indexes(self, labels):
-        return [self.label_names.index(label) for label in labels]
+    @property
+    def has_embedding_layer(self):
+        """
+        :return: does this model have a layer named "embedding", as evaluate_embedding_dtypes requires?
+        :rtype: bool
+        """
+        return any(layer.name == "embedding" for layer in self.model.layers)
+
+    def evaluate_embedding_dtypes(self, texts, labels=None, dtypes=("float16", "int8"), batch_size=32, bucket=False):
+        """
+        Evaluate the model with the weights of its embedding layer stored at other precisions, to show how much
+        accuracy each precision costs.
+
+        The weights are restored afterwards. Models without a layer named "embedding" cannot be evaluated this way.
+
+        :param texts: texts, or a mycroft.data.Dataset in which case the labels argument is ignored
+        :type texts: sequence of str or mycroft.data.Dataset
+        :param labels: the label of each text
+        :type labels: sequence of str or None
+        :param dtypes: precisions, each one of mycroft.options.EMBEDDING_DTYPES
+        :type dtypes: sequence of str
+        :param batch_size: evaluation batch size
+        :type batch_size: int
+        :param bucket: group texts of similar length into batches padded to their longest text?
+        :type bucket: bool
+        :return: the names and values of the model's metrics for each precision
+        :rtype: list of (str, list of (str, float))
+        """
+        from .text import dequantize_embeddings, quantize_embeddings
+
+        if not self.has_embedding_layer:
+            raise ValueError("%s does not have an embedding layer" % self.__class__.__name__)
+        layer = self.model.get_layer("embedding")
+        weights = layer.get_weights()
+        results = []
+        try:
+            for dtype in dtypes:
+                layer.set_weights([dequantize_embeddings(*quantize_embeddings(weights[0], dtype))])
+                results.append((dtype, self.evaluate(texts, labels, batch_size, bucket)))
+        finally:
+            layer.set_weights(weights)
+        return results
+
+    def encode(self, texts):
+        """
+        Encode texts with this model's embedder, using the encoding cache if there is one. The encodings of a data set
+        are stored in the data set and reused by later calls.
+
+        :param texts: texts to encode
+        :type texts: sequence of str or mycroft.data.Dataset
+        :return: text encodings
+        :rtype: numpy.array
+        """
+        from .data import Dataset
+
+        if isinstance(texts, Dataset):
+            return texts.encode(self.embedder, self.encode)
+        if self.encoding_cache is None:
+            return self.embedder.encode(texts)
+        return self.encoding_cache.encode(self.embedder, texts)
+
+    @property
+    def accepts_variable_length(self):
+        """
+        :return: does this model accept variable-length input, as length-bucketed batches require?
+        :rtype: bool
+        """
+        return hasattr(self.embedder, "encode_sequences") and self.model.input_shape[1] is None
+
+    def encode_sequences(self, texts):
+        """
+        Encode texts as unpadded vocabulary index sequences for length-bucketed batches.
+
+        The sequences are views of the rows of the fixed-length encoding with the leading zeros removed, so they share
+        its memoization and cache. Out of vocabulary words are encoded as zero like the padding, and models that accept
+        variable-length input mask zeros, so removing those at the start of a text does not change its prediction.
 
-    def load_model(self, model_directory):
+        :param texts: texts to encode
+        :type texts: sequence of str or mycroft.data.Dataset
+        :return: vocabulary index sequences
+        :rtype: list of numpy.array
+        """
+        import numpy
+
+        if not self.accepts_variable_length:
+            raise ValueError("%s does not accept variable-length input" % self.__class__.__name__)
+        encoding = self.encode(texts)
+        nonzero = encoding != 0
+        starts = numpy.where(nonzero.any(axis=1), nonzero.argmax(axis=1), encoding.shape[1])
+        return [row[start:] for row, start in zip(encoding, starts)]
+
+    def label_indexes(self, labels):
+        """
+        :param labels: label strings, or a data set whose label codes are mapped to this model's label names
+        :type labels: sequence of str or mycroft.data.Dataset
+        :return: index into this model's label names of each label
+        :rtype: numpy.array
+        """
+        import numpy
+        from .data import Dataset
+
+        index = dict((name, i) for i, name in enumerate(self.label_names))
+        try:
+            if isinstance(labels, Dataset):
+                if labels.label_names == self.label_names:
+                    return labels.label_codes
+                return numpy.array([index[name] for name in labels.label_names], dtype="int32")[labels.label_codes]
+            return numpy.array([index[label] for label in labels], dtype="int32")
+        except KeyError as e:
+            raise ValueError("Label %s is not in the model's labels %s" % (e, self.label_names))
+
+    def load_model(self, model_directory, checkpoint=False):
         from keras.models import load_model
-        self.model = load_model(os.path.join(model_directory, TextEmbeddingClassifier.model_name))
+
+        model_filename = os.path.join(model_directory, TextEmbeddingClassifier.model_name)
+        if checkpoint and os.path.isfile(os.path.join(model_directory, TextEmbeddingClassifier.checkpoint_name)):
+            model_filename = os.path.join(model_directory, TextEmbeddingClassifier.checkpoint_name)
+        self.model = load_model(model_filename)
+        self.embedder.load(model_directory)
 
     @property
     def num_labels(self):
@@ -184,6 +830,12 @@ class TextEmbeddingClassifier:
     def custom_command_line_options(cls):
         return {}
 
+    @classmethod
+    def tokenizer_command_line_option(cls):
+        return {"tokenizer": {"choices": cls.TOKENIZERS,
+                              "help": "spacy runs the full spaCy pipeline, spacy-tokenizer only its tokenizer, regex a "
+                                      "faster approximation of it (default %s)" % cls.TOKENIZER}}
+
     @classmethod
     def create_from_command_line_arguments(cls, training, command_line_arguments):
         args = command_line_arguments.__dict__
@@ -249,6 +901,10 @@ class SequentialTextEmbeddingMixin:
     from the training data.
     """
     TRAIN_EMBEDDINGS = False
+    CORPUS_VOCABULARY = False
+    MIN_FREQUENCY = 1
+    EMBEDDING_DTYPE = "float32"
+    EMBEDDING_DTYPES = EMBEDDING_DTYPES
 
     @classmethod
     def custom_command_line_options(cls):
@@ -258,16 +914,35 @@ class SequentialTextEmbeddingMixin:
             "vocabulary_size": {
                 "help": "number of words in the vocabulary (default use all types for which we have embeddings)",
                 "type": int, "metavar": "SIZE"},
-            "train_embeddings": {"help": "train word embeddings? (default %s)" % cls.TRAIN_EMBEDDINGS}
+            "train_embeddings": {"help": "train word embeddings? (default %s)" % cls.TRAIN_EMBEDDINGS},
+            "corpus_vocabulary": {
+                "help": "build the vocabulary from the words in the training data instead of the language model " +
+                        "(default %s)" % cls.CORPUS_VOCABULARY},
+            "min_frequency": {"help": "minimum number of times a word must appear in the training data to be in a " +
+                                      "corpus vocabulary (default %d)" % cls.MIN_FREQUENCY, "metavar": "COUNT"},
+            "embedding_dtype": {"choices": cls.EMBEDDING_DTYPES,
+                                "help": "precision at which to store the word embeddings (default %s)"
+                                        % cls.EMBEDDING_DTYPE}
         }
 
     @staticmethod
-    def parameters_from_training(sequence_length, vocabulary_size, training, language_model):
+    def parameters_from_training(sequence_length, vocabulary_size, training, language_model, tokenizer="spacy"):
+        from .text import maximum_text_length
+
         label_names = training[2]
         if sequence_length is None:
-            sequence_length = maximum_text_length(training[0], language_model)
+            sequence_length = maximum_text_length(training[0], language_model, tokenizer)
         return label_names, sequence_length, vocabulary_size
 
+    @staticmethod
+    def sequence_embedder(vocabulary_size, sequence_length, language_model, tokenizer, training, corpus_vocabulary,
+                          min_frequency, embedding_dtype="float32"):
+        from .text import TextSequenceEmbedder
+
+        texts = training[0] if corpus_vocabulary else None
+        return TextSequenceEmbedder(vocabulary_size, sequence_length, language_model, tokenizer, texts, min_frequency,
+                                    embedding_dtype)
+
     @staticmethod
     def embedding_layer(embedder, sequence_length, train_embeddings, **kwargs):
         return embedder.embedding_layer_factory()(input_length=sequence_length, trainable=train_embeddings, **kwargs)
@@ -289,6 +964,7 @@ class RNNClassifier(SequentialTextEmbeddingClassifier):
     DROPOUT = 0.5
     LEARNING_RATE = 0.001
     LANGUAGE_MODEL = "en"
+    VARIABLE_LENGTH = False
 
     @classmethod
     def custom_command_line_options(cls):
@@ -301,23 +977,34 @@ class RNNClassifier(SequentialTextEmbeddingClassifier):
             "dropout": {"help": "dropout rate (default %0.2f)" % cls.DROPOUT},
             "learning_rate": {"metavar": "RATE", "help": "learning rate (default %0.5f)" % cls.LEARNING_RATE},
             "language_model": {"help": "The spaCy language model to use (default '%s')" % cls.LANGUAGE_MODEL,
-                               "metavar": "NAME"}
+                               "metavar": "NAME"},
+            "variable_length": {"help": "accept sequences of any length, which --bucket requires and implies "
+                                        "(default %s)" % cls.VARIABLE_LENGTH},
+            **cls.tokenizer_command_line_option()
         }}
 
     def __init__(self, training, sequence_length=None, vocabulary_size=None,
                  train_embeddings=SequentialTextEmbeddingClassifier.TRAIN_EMBEDDINGS,
                  language_model=LANGUAGE_MODEL, rnn_type=RNN_TYPE, rnn_units=RNN_UNITS, bidirectional=BIDIRECTIONAL,
-                 dropout=DROPOUT, learning_rate=LEARNING_RATE):
+                 dropout=DROPOUT, learning_rate=LEARNING_RATE, tokenizer=TextEmbeddingClassifier.TOKENIZER,
+                 corpus_vocabulary=SequentialTextEmbeddingClassifier.CORPUS_VOCABULARY,
+                 min_frequency=SequentialTextEmbeddingClassifier.MIN_FREQUENCY,
+                 embedding_dtype=SequentialTextEmbeddingClassifier.EMBEDDING_DTYPE, variable_length=VARIABLE_LENGTH):
         from keras.models import Sequential
         from keras.layers import Bidirectional, Dense, Dropout, GRU, LSTM
         from keras.optimizers import Adam
 
         label_names, sequence_length, vocabulary_size = self.parameters_from_training(sequence_length, vocabulary_size,
-                                                                                      training, language_model)
-        embedder = TextSequenceEmbedder(vocabulary_size, sequence_length, language_model)
+                                                                                      training, language_model,
+                                                                                      tokenizer)
+        embedder = self.sequence_embedder(vocabulary_size, sequence_length, language_model, tokenizer, training,
+                                          corpus_vocabulary, min_frequency, embedding_dtype)
 
         model = Sequential()
-        model.add(self.embedding_layer(embedder, sequence_length, train_embeddings, mask_zero=True, name="embedding"))
+        # Recurrent layers accept sequences of any length, so a variable-length model leaves the input length
+        # unspecified. This allows training and prediction on length-bucketed batches.
+        input_length = None if variable_length else sequence_length
+        model.add(self.embedding_layer(embedder, input_length, train_embeddings, mask_zero=True, name="embedding"))
         rnn_class = {"lstm": LSTM, "gru": GRU}[rnn_type]
         for i, units in enumerate(rnn_units, 1):
             name = "rnn-%d" % i
@@ -367,20 +1054,26 @@ class ConvolutionNetClassifier(SequentialTextEmbeddingClassifier):
             "kernel_size": {"help": "Size of kernel (default %d)" % cls.KERNEL_SIZE, "metavar": "SIZE"},
             "pool_factor": {"help": "Pooling downscale factor (default %d)" % cls.POOL_FACTOR, "metavar": "FACTOR"},
             "learning_rate": {"metavar": "RATE", "help": "learning rate (default %0.5f)" % cls.LEARNING_RATE},
-            "language_model": {"help": "Language model (default %s)" % cls.LANGUAGE_MODEL, "metavar": "MODEL"}
+            "language_model": {"help": "Language model (default %s)" % cls.LANGUAGE_MODEL, "metavar": "MODEL"},
+            **cls.tokenizer_command_line_option()
         }}
 
     def __init__(self, training, sequence_length=None, vocabulary_size=None,
                  train_embeddings=SequentialTextEmbeddingClassifier.TRAIN_EMBEDDINGS, dropout=DROPOUT, filters=FILTERS,
                  kernel_size=KERNEL_SIZE, pool_factor=POOL_FACTOR, learning_rate=LEARNING_RATE,
-                 language_model=LANGUAGE_MODEL):
+                 language_model=LANGUAGE_MODEL, tokenizer=TextEmbeddingClassifier.TOKENIZER,
+                 corpus_vocabulary=SequentialTextEmbeddingClassifier.CORPUS_VOCABULARY,
+                 min_frequency=SequentialTextEmbeddingClassifier.MIN_FREQUENCY,
+                 embedding_dtype=SequentialTextEmbeddingClassifier.EMBEDDING_DTYPE):
         from keras.layers import Dropout, Conv1D, Flatten, MaxPooling1D, Dense
         from keras.models import Sequential
         from keras.optimizers import Adam
 
         label_names, sequence_length, vocabulary_size = self.parameters_from_training(sequence_length, vocabulary_size,
-                                                                                      training, language_model)
-        embedder = TextSequenceEmbedder(vocabulary_size, sequence_length, language_model)
+                                                                                      training, language_model,
+                                                                                      tokenizer)
+        embedder = self.sequence_embedder(vocabulary_size, sequence_length, language_model, tokenizer, training,
+                                          corpus_vocabulary, min_frequency, embedding_dtype)
 
         model = Sequential()
         model.add(self.embedding_layer(embedder, sequence_length, train_embeddings, name="embedding"))
@@ -416,17 +1109,19 @@ class BagOfWordsClassifier(TextEmbeddingClassifier):
         return {
             "learning_rate": {"metavar": "RATE", "help": "learning rate (default %0.5f)" % cls.LEARNING_RATE},
             "language_model": {"help": "the spaCy language model to use (default '%s')" % cls.LANGUAGE_MODEL,
-                               "metavar": "NAME"}
+                               "metavar": "NAME"},
+            **cls.tokenizer_command_line_option()
         }
 
-    def __init__(self, training, learning_rate=LEARNING_RATE, language_model=LANGUAGE_MODEL):
+    def __init__(self, training, learning_rate=LEARNING_RATE, language_model=LANGUAGE_MODEL,
+                 tokenizer=TextEmbeddingClassifier.TOKENIZER):
         from keras.layers import Dense
         from keras.models import Sequential
         from keras.optimizers import Adam
         from .text import BagOfWordsEmbedder
 
         label_names = training[2]
-        embedder = BagOfWordsEmbedder(language_model)
+        embedder = BagOfWordsEmbedder(language_model, tokenizer)
         model = Sequential()
         model.add(Dense(len(label_names), input_shape=(embedder.embedding_size,), activation="softmax", name="softmax"))
         optimizer = Adam(lr=learning_rate)
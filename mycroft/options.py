@@ -0,0 +1,18 @@
+"""
+Choices of text processing options shared by the embedders, the models and the command line.
+
+This module has no dependencies, so that the command line can offer these choices without importing the numerical and
+natural language processing libraries.
+"""
+
+# Ways of splitting text into tokens.
+#
+# spacy: run the full spaCy pipeline
+# spacy-tokenizer: run only the spaCy tokenizer, which produces the same tokens without tagging, parsing or entity
+#     recognition
+# regex: split with a regular expression that approximates spaCy's English tokenization without creating spaCy
+#     documents
+TOKENIZERS = ["spacy", "spacy-tokenizer", "regex"]
+
+# Precisions in which an embedding matrix may be stored. An int8 matrix has a float32 scale for each row.
+EMBEDDING_DTYPES = ["float32", "float16", "int8"]
@@ -0,0 +1,198 @@
+"""
+Data-parallel training in local worker processes.
+
+Each worker process holds a replica of the Keras model. The batches of every epoch are divided between the workers,
+which train their replicas on them independently for a number of steps. The replicas' trainable weights are then
+averaged, weighted by the number of samples each one trained on, and every replica continues from the average. With
+plain gradient descent, averaging after every step is the same as averaging the gradients; averaging less often
+trades some of that equivalence for less communication.
+
+The optimizer state, such as Adam's moment estimates, stays local to each worker.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+# Number of batches each worker trains on between weight averages.
+SYNC_STEPS = 10
+
+
+class ParallelTrainer:
+    """
+    Train a compiled Keras model on encoded data in a pool of worker processes.
+
+    The training data is written once to a temporary file that the workers memory-map, so each step only sends the
+    indexes of its batches. Workers are started with the spawn method because the parent process has already
+    initialized TensorFlow, which is not safe to fork. Each worker limits TensorFlow to its share of the processors.
+    """
+
+    def __init__(self, model, workers, sync_steps=SYNC_STEPS, seed=None):
+        """
+        :param model: compiled Keras model, which holds the averaged weights
+        :type model: keras.models.Model
+        :param workers: number of worker processes
+        :type workers: int
+        :param sync_steps: number of batches each worker trains on between weight averages
+        :type sync_steps: int
+        :param seed: random number generator seed used to shuffle the batches, if None shuffle them differently every
+            time
+        :type seed: int or None
+        """
+        if workers < 2:
+            raise ValueError("Data-parallel training requires at least 2 workers, not %d" % workers)
+        if sync_steps < 1:
+            raise ValueError("Invalid number of steps between weight averages %d" % sync_steps)
+        self.model = model
+        self.workers = workers
+        self.sync_steps = sync_steps
+        self.seed = seed
+
+    def __repr__(self):
+        return "Parallel trainer: %d workers, average every %d steps" % (self.workers, self.sync_steps)
+
+    def fit(self, vectors, labels, epochs, batch_size, validation_fraction=None, validation_data=None, callbacks=None,
+            verbose=1, initial_epoch=0):
+        """
+        Train the model. The arguments are the same as those of the Keras model's fit method.
+
+        :return: training history
+        :rtype: keras.callbacks.History
+        """
+        import numpy
+        from keras.callbacks import CallbackList, History
+
+        if validation_fraction:
+            # Like Keras, hold out the end of the training data.
+            split = int(len(vectors) * (1 - validation_fraction))
+            validation_data = (vectors[split:], labels[split:])
+            vectors, labels = vectors[:split], labels[:split]
+        history = History()
+        callbacks = CallbackList((callbacks or []) + [history])
+        callbacks.set_model(self.model)
+        metrics = list(self.model.metrics_names)
+        callbacks.set_params({"epochs": epochs, "samples": len(vectors), "batch_size": batch_size, "verbose": verbose,
+                              "do_validation": bool(validation_data),
+                              "metrics": metrics + ["val_" + name for name in metrics] if validation_data else metrics})
+        generator = numpy.random.RandomState(self.seed)
+        directory = tempfile.mkdtemp()
+        try:
+            model_filename = os.path.join(directory, "model.hd5")
+            vectors_filename = os.path.join(directory, "vectors.npy")
+            labels_filename = os.path.join(directory, "labels.npy")
+            self.model.save(model_filename)
+            numpy.save(vectors_filename, numpy.asarray(vectors))
+            numpy.save(labels_filename, numpy.asarray(labels))
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(self.workers, initializer=initialize_worker,
+                              initargs=(model_filename, vectors_filename, labels_filename, threads)) as pool:
+                self.model.stop_training = False
+                callbacks.on_train_begin()
+                for epoch in range(initial_epoch, epochs):
+                    callbacks.on_epoch_begin(epoch)
+                    start = time.perf_counter()
+                    logs = self.run_epoch(pool, generator.permutation(len(vectors)), batch_size, metrics, callbacks)
+                    if validation_data:
+                        scores = self.model.evaluate(validation_data[0], validation_data[1], batch_size=batch_size,
+                                                     verbose=0)
+                        logs.update(("val_" + name, float(score))
+                                    for name, score in zip(metrics, numpy.atleast_1d(scores)))
+                    if verbose:
+                        print("Epoch %d/%d - %ds - %s" % (epoch + 1, epochs, time.perf_counter() - start, " - ".join(
+                            "%s: %0.4f" % (name, value) for name, value in logs.items())))
+                    callbacks.on_epoch_end(epoch, logs)
+                    if self.model.stop_training:
+                        break
+                callbacks.on_train_end()
+        finally:
+            shutil.rmtree(directory)
+        return history
+
+    def run_epoch(self, pool, order, batch_size, metrics, callbacks):
+        """
+        Train on every batch once.
+
+        :param pool: worker processes
+        :type pool: multiprocessing.Pool
+        :param order: order in which to take the samples
+        :type order: numpy.array of int
+        :param batch_size: number of samples in a batch
+        :type batch_size: int
+        :param metrics: names of the model's metrics
+        :type metrics: list of str
+        :param callbacks: training callbacks, which are called at the end of every round of steps
+        :type callbacks: keras.callbacks.CallbackList
+        :return: mean of each metric over the samples
+        :rtype: dict of str to float
+        """
+        from keras import backend
+
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        round_size = self.workers * self.sync_steps
+        totals = [0.0] * len(metrics)
+        samples = 0
+        for i, round_start in enumerate(range(0, len(batches), round_size)):
+            round_batches = batches[round_start:round_start + round_size]
+            # Deal the batches out so that every worker gets the same number, give or take one.
+            shards = [round_batches[worker::self.workers] for worker in range(min(self.workers, len(round_batches)))]
+            weights = backend.batch_get_value(self.model.trainable_weights)
+            learning_rate = float(backend.get_value(self.model.optimizer.lr))
+            results = pool.map(train_shard, [(weights, learning_rate, shard) for shard in shards], chunksize=1)
+            round_samples = sum(shard_samples for _, _, shard_samples in results)
+            averages = [sum(shard_weights[j] * (shard_samples / round_samples)
+                            for shard_weights, _, shard_samples in results) for j in range(len(weights))]
+            backend.batch_set_value(list(zip(self.model.trainable_weights, averages)))
+            round_totals = [sum(shard_totals[j] for _, shard_totals, _ in results) for j in range(len(metrics))]
+            callbacks.on_batch_end(i, dict(zip(metrics, [total / round_samples for total in round_totals]),
+                                           size=round_samples))
+            totals = [total + round_total for total, round_total in zip(totals, round_totals)]
+            samples += round_samples
+        return dict((name, total / samples) for name, total in zip(metrics, totals))
+
+
+# The model replica and memory-mapped training data of a worker process.
+worker_state = None
+
+
+def initialize_worker(model_filename, vectors_filename, labels_filename, threads):
+    import numpy
+    from keras import backend
+    from keras.models import load_model
+
+    global worker_state
+    if backend.backend() == "tensorflow":
+        import tensorflow
+
+        backend.set_session(tensorflow.Session(config=tensorflow.ConfigProto(
+            intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)))
+    worker_state = (load_model(model_filename), numpy.load(vectors_filename, mmap_mode="r"),
+                    numpy.load(labels_filename, mmap_mode="r"))
+
+
+def train_shard(task):
+    """
+    Train the worker's replica, starting from the averaged weights, on a sequence of batches.
+
+    :param task: trainable weights, learning rate and the sample indexes of each batch
+    :type task: (list of numpy.array, float, list of numpy.array)
+    :return: the trained weights, the sum over samples of each metric, and the number of samples
+    :rtype: (list of numpy.array, list of float, int)
+    """
+    import numpy
+    from keras import backend
+
+    weights, learning_rate, batches = task
+    model, vectors, labels = worker_state
+    backend.batch_set_value(list(zip(model.trainable_weights, weights)))
+    backend.set_value(model.optimizer.lr, learning_rate)
+    totals = None
+    samples = 0
+    for batch in batches:
+        # Reading the memory map in index order is faster, and the order of samples within a batch does not matter.
+        batch = numpy.sort(batch)
+        scores = numpy.atleast_1d(model.train_on_batch(vectors[batch], labels[batch]))
+        totals = scores * len(batch) if totals is None else totals + scores * len(batch)
+        samples += len(batch)
+    return backend.batch_get_value(model.trainable_weights), [float(total) for total in totals], samples
@@ -0,0 +1,264 @@
+"""
+Per-stage profiling of Mycroft pipelines.
+
+Code marks the stages of a pipeline with spans.
+
+    from mycroft.profiling import span
+
+    with span("my stage"):
+        ...
+
+When a profiler is active, each span records its wall time, CPU time and how much it raised the process's peak
+resident set size. Spans nest, and are named by the path of the spans that enclose them, e.g. "train/encode/tokenize".
+When no profiler is active a span does nothing, so classifiers, including custom subclasses of
+mycroft.model.TextEmbeddingClassifier, may mark their stages unconditionally.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The profiler to which spans are reported, or None if profiling is not active.
+active_profiler = None
+
+
+@contextmanager
+def span(name):
+    """
+    Mark a stage of the pipeline. This records its performance with the active profiler, if there is one.
+
+    :param name: name of the stage
+    :type name: str
+    """
+    profiler = active_profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.span(name):
+            yield
+
+
+def add_worker_cpu_time(seconds):
+    """
+    Charge CPU time spent in worker processes that this process never waits for, such as the persistent tokenization
+    pool, to the active profiler, if there is one.
+
+    :param seconds: CPU time of the workers
+    :type seconds: float
+    """
+    profiler = active_profiler
+    if profiler is not None:
+        profiler.add_worker_cpu(seconds)
+
+
+def process_cpu_time():
+    """
+    :return: user and system CPU time of this process alone, for workers to measure the CPU time of their tasks
+    :rtype: float
+    """
+    return sum(os.times()[:2])
+
+
+def epoch_callback():
+    """
+    :return: Keras callback that records training throughput with the active profiler, or None if there is none
+    :rtype: keras.callbacks.Callback or None
+    """
+    if active_profiler is None:
+        return None
+    return active_profiler.epoch_callback()
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of this process in bytes, or None if it is not available on this platform
+    :rtype: int or None
+    """
+    if resource is None:
+        return None
+    maximum = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform == "darwin":
+        return maximum
+    return maximum * 1024
+
+
+def cpu_time():
+    """
+    :return: user and system CPU time of this process and the child processes it has waited for. This does not
+        include processes that are still running, such as the persistent tokenization pool, whose CPU time is reported
+        with add_worker_cpu_time.
+    :rtype: float
+    """
+    return sum(os.times()[:4])
+
+
+class Profiler:
+    """
+    Accumulate the performance of spans and the throughput of training epochs.
+
+    A span that is entered more than once, for instance once per chunk of data, accumulates the time of every call.
+    Time spent in a span includes the time spent in the spans nested inside it. The CPU time of a span includes the CPU
+    time that worker processes report with add_worker_cpu_time while it runs on the same thread.
+
+    Use a profiler as a context manager to make it the active profiler.
+    """
+
+    def __init__(self):
+        self.spans = OrderedDict()
+        self.epochs = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.worker_cpu = 0.0
+        self.start = None
+        self.end = None
+        self.previous = None
+
+    def __repr__(self):
+        return "Profiler: %d spans, %d epochs" % (len(self.spans), len(self.epochs))
+
+    def __enter__(self):
+        global active_profiler
+        self.previous = active_profiler
+        active_profiler = self
+        self.start = (time.perf_counter(), self.total_cpu_time())
+        return self
+
+    def __exit__(self, *_):
+        global active_profiler
+        self.end = (time.perf_counter(), self.total_cpu_time())
+        active_profiler = self.previous
+
+    def add_worker_cpu(self, seconds):
+        """
+        :param seconds: CPU time of worker processes, charged to the spans open on the current thread
+        :type seconds: float
+        """
+        with self.lock:
+            self.worker_cpu += seconds
+        self.local.worker_cpu = getattr(self.local, "worker_cpu", 0.0) + seconds
+
+    def total_cpu_time(self):
+        with self.lock:
+            return cpu_time() + self.worker_cpu
+
+    def thread_cpu_time(self):
+        return cpu_time() + getattr(self.local, "worker_cpu", 0.0)
+
+    @contextmanager
+    def span(self, name):
+        """
+        Record the performance of a stage.
+
+        :param name: name of the stage
+        :type name: str
+        """
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(name)
+        path = "/".join(stack)
+        wall, cpu, rss = time.perf_counter(), self.thread_cpu_time(), peak_rss()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, self.thread_cpu_time() - cpu
+            rss = peak_rss() - rss if rss is not None else None
+            stack.pop()
+            self.add(path, wall, cpu, rss)
+
+    def add(self, path, wall, cpu, rss_growth):
+        """
+        :param path: name of the span, including the names of the spans that enclose it
+        :type path: str
+        :param wall: wall time of the span
+        :type wall: float
+        :param cpu: CPU time of the span
+        :type cpu: float
+        :param rss_growth: how many bytes the process's peak resident set size grew during the span, or None if it is
+            not available
+        :type rss_growth: int or None
+        """
+        with self.lock:
+            if path not in self.spans:
+                # The peak resident set size is a high-water mark for the whole process, so a span can only be charged
+                # with raising it. A stage that allocates no more than an earlier one did shows no growth.
+                self.spans[path] = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_growth_bytes": None}
+            s = self.spans[path]
+            s["calls"] += 1
+            s["wall_seconds"] += wall
+            s["cpu_seconds"] += cpu
+            if rss_growth is not None:
+                s["peak_rss_growth_bytes"] = (s["peak_rss_growth_bytes"] or 0) + rss_growth
+
+    def add_epoch(self, epoch, samples, seconds):
+        """
+        :param epoch: epoch number, starting from 1
+        :type epoch: int
+        :param samples: number of samples trained on in the epoch
+        :type samples: int
+        :param seconds: wall time of the epoch
+        :type seconds: float
+        """
+        with self.lock:
+            self.epochs.append({"epoch": epoch, "samples": samples, "seconds": seconds,
+                                "samples_per_second": samples / seconds if seconds else 0.0})
+
+    def epoch_callback(self):
+        """
+        The epoch's time runs from its start to the end of its last batch, so it does not include validation or the
+        callbacks that run at the end of the epoch. Put this callback first so that its epoch start precedes the
+        others'.
+
+        :return: Keras callback that records the number of samples and the training wall time of each epoch
+        :rtype: keras.callbacks.Callback
+        """
+        from keras.callbacks import Callback
+
+        profiler = self
+
+        class EpochThroughput(Callback):
+            def __init__(self):
+                super().__init__()
+                self.start = None
+                self.end = None
+                self.samples = 0
+
+            def on_epoch_begin(self, epoch, logs=None):
+                self.start = self.end = time.perf_counter()
+                self.samples = 0
+
+            def on_batch_end(self, batch, logs=None):
+                self.samples += (logs or {}).get("size", 0)
+                self.end = time.perf_counter()
+
+            def on_epoch_end(self, epoch, logs=None):
+                profiler.add_epoch(epoch + 1, self.samples, self.end - self.start)
+
+        return EpochThroughput()
+
+    def report(self):
+        """
+        :return: JSON-serializable report of the spans and epochs
+        :rtype: dict
+        """
+        with self.lock:
+            d = {"spans": [dict(name=name, **s) for name, s in self.spans.items()], "epochs": list(self.epochs),
+                 "peak_rss_bytes": peak_rss()}
+        if self.start is not None:
+            end = self.end or (time.perf_counter(), self.total_cpu_time())
+            d["wall_seconds"] = end[0] - self.start[0]
+            d["cpu_seconds"] = end[1] - self.start[1]
+        return d
+
+    def save(self, filename):
+        with open(filename, mode="w") as f:
+            json.dump(self.report(), f, indent=4, separators=(",", ": "))
@@ -0,0 +1,816 @@
+"""
+Model selection: hyper-parameter search and cross-validation.
+"""
+import argparse
+import hashlib
+import inspect
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import product
+
+# Ways of choosing the configurations to try.
+#
+# grid: every combination of the listed values
+# random: a number of configurations sampled from the listed values and distributions
+# halving: successive halving, which trains a number of random configurations for a few epochs, then repeatedly trains
+#     the best of them for more epochs until one remains or the maximum number of epochs is reached
+SCHEDULES = ["grid", "random", "halving"]
+
+
+class Distribution:
+    """
+    A range of numeric values from which a hyper-parameter is sampled, either uniformly or uniformly in its logarithm.
+    """
+    KINDS = ["uniform", "log-uniform"]
+
+    def __init__(self, kind, low, high, value_type=float):
+        """
+        :param kind: one of KINDS
+        :type kind: str
+        :param low: smallest value
+        :type low: float
+        :param high: largest value
+        :type high: float
+        :param value_type: type of the sampled values, int or float
+        :type value_type: type
+        """
+        if kind not in self.KINDS:
+            raise ValueError("Invalid distribution %s, must be one of %s" % (kind, self.KINDS))
+        if low > high:
+            raise ValueError("The low value %s of a distribution is greater than the high value %s" % (low, high))
+        if kind == "log-uniform" and low <= 0:
+            raise ValueError("A log-uniform distribution must have positive values")
+        self.kind = kind
+        self.low = low
+        self.high = high
+        self.value_type = value_type
+
+    def __repr__(self):
+        return "%s:%s:%s" % (self.kind, self.low, self.high)
+
+    def __eq__(self, other):
+        return isinstance(other, Distribution) and \
+               (self.kind, self.low, self.high, self.value_type) == \
+               (other.kind, other.low, other.high, other.value_type)
+
+    def sample(self, generator):
+        """
+        :param generator: random number generator
+        :type generator: random.Random
+        :return: a value from the distribution
+        :rtype: int or float
+        """
+        if self.kind == "uniform":
+            value = generator.uniform(self.low, self.high)
+        else:
+            value = math.exp(generator.uniform(math.log(self.low), math.log(self.high)))
+        if self.value_type == int:
+            return int(round(value))
+        return self.value_type(value)
+
+
+class SearchSpace:
+    """
+    The values of a model's constructor arguments to search over.
+
+    Each dimension is a constructor argument with either a list of values or a Distribution. A grid search requires
+    every dimension to be a list of values. A random search picks from the lists and samples from the distributions.
+    """
+
+    def __init__(self, dimensions):
+        """
+        :param dimensions: constructor argument names and their values
+        :type dimensions: sequence of (str, list or Distribution) or dict
+        """
+        self.dimensions = OrderedDict(dimensions)
+
+    def __repr__(self):
+        return "Search space: %s" % ", ".join("%s %s" % item for item in self.dimensions.items())
+
+    @classmethod
+    def from_command_line(cls, model_class, specifications):
+        """
+        Create a search space from command line specifications, each of which is a constructor argument name followed
+        by its values written as they would be on the model's training command line. The values of a boolean argument
+        are true and false, and each value of a tuple argument is a space-separated string. Instead of a list of values,
+        a numeric argument may have a single distribution written as uniform:LOW:HIGH or log-uniform:LOW:HIGH.
+
+        :param model_class: the model whose constructor arguments are searched over
+        :type model_class: type
+        :param specifications: an argument name followed by its values for each dimension
+        :type specifications: list of list of str
+        :return: search space
+        :rtype: SearchSpace
+        """
+        parser = argparse.ArgumentParser(add_help=False)
+        model_class.command_line_arguments(parser)
+        actions = dict((action.dest, action) for action in parser._actions)
+        dimensions = []
+        for specification in specifications:
+            name, values = specification[0].lstrip("-").replace("-", "_"), specification[1:]
+            if name not in actions:
+                raise ValueError("%s is not an argument of %s" % (name, model_class.__name__))
+            if not values:
+                raise ValueError("No values specified for %s" % name)
+            action = actions[name]
+            if len(values) == 1 and values[0].split(":")[0] in Distribution.KINDS:
+                dimensions.append((name, cls.parse_distribution(action, values[0])))
+            else:
+                dimensions.append((name, [cls.parse_value(action, value) for value in values]))
+        return cls(dimensions)
+
+    @staticmethod
+    def parse_value(action, value):
+        if action.nargs == 0:
+            # Boolean arguments are flags on the command line.
+            booleans = {"true": True, "false": False}
+            if value.lower() not in booleans:
+                raise ValueError("Invalid value %s for %s, must be true or false" % (value, action.dest))
+            return booleans[value.lower()]
+        try:
+            if action.nargs == "+":
+                parsed = tuple(action.type(x) for x in value.split())
+            elif action.type is None:
+                parsed = value
+            else:
+                parsed = action.type(value)
+        except ValueError:
+            raise ValueError("Invalid value %s for %s" % (value, action.dest))
+        if action.choices is not None and parsed not in action.choices:
+            raise ValueError("Invalid value %s for %s, must be one of %s" % (value, action.dest, action.choices))
+        return parsed
+
+    @staticmethod
+    def parse_distribution(action, value):
+        if action.nargs is not None or action.type not in [int, float]:
+            raise ValueError("%s is not numeric, so it cannot have a distribution" % action.dest)
+        try:
+            kind, low, high = value.split(":")
+            return Distribution(kind, float(low), float(high), action.type)
+        except ValueError as e:
+            raise ValueError("Invalid distribution %s for %s: %s" % (value, action.dest, e))
+
+    @property
+    def is_grid(self):
+        return not any(isinstance(values, Distribution) for values in self.dimensions.values())
+
+    def grid(self):
+        """
+        :return: every combination of the values of the dimensions
+        :rtype: list of OrderedDict
+        """
+        if not self.is_grid:
+            raise ValueError("A grid search requires lists of values, not distributions")
+        names = list(self.dimensions.keys())
+        return [OrderedDict(zip(names, values)) for values in product(*self.dimensions.values())]
+
+    def sample(self, n, generator=None):
+        """
+        :param n: number of configurations
+        :type n: int
+        :param generator: random number generator
+        :type generator: random.Random or None
+        :return: randomly chosen configurations
+        :rtype: list of OrderedDict
+        """
+        generator = generator or random.Random()
+        configurations = []
+        for _ in range(n):
+            configuration = OrderedDict()
+            for name, values in self.dimensions.items():
+                if isinstance(values, Distribution):
+                    configuration[name] = values.sample(generator)
+                else:
+                    configuration[name] = generator.choice(values)
+            configurations.append(configuration)
+        return configurations
+
+
+class Tuner:
+    """
+    Train a model with each of a set of hyper-parameter configurations and rank them by their best validation loss.
+
+    The data is read and tokenized once in this process. The trials run in a pool of worker processes, each of which
+    receives the tokenized data once when it starts and keeps it for all the trials it runs, so no trial reads or
+    tokenizes it again. The first trial with a given embedder configuration encodes the data and writes the encodings
+    to a temporary directory, and every other trial with that configuration memory-maps them. Each trial clears the
+    Keras session first, so that Keras state does not accumulate from one trial to the next.
+
+    Each trial's training history is written to a subdirectory of the output directory and the ranked results to
+    leaderboard.json.
+    """
+    TRIALS = 10
+    MIN_EPOCHS = 1
+    ETA = 3
+    DIRECTORY = "tuning"
+
+    leaderboard_name = "leaderboard.json"
+
+    def __init__(self, model_class, arguments, data, training=None, directory=None, workers=1, save_models=False,
+                 encoding_cache=None, verbose=False):
+        """
+        :param model_class: the model to tune
+        :type model_class: type
+        :param arguments: values of constructor arguments that are not searched over, other arguments have their
+            default values
+        :type arguments: dict
+        :param data: training data
+        :type data: mycroft.data.Dataset
+        :param training: keyword arguments of TextEmbeddingClassifier.train other than the number of epochs, which must
+            include either validation data or a validation fraction
+        :type training: dict or None
+        :param directory: directory in which to write the results, or None to not write them
+        :type directory: str or None
+        :param workers: number of trials to run at once
+        :type workers: int
+        :param save_models: save the model trained in each trial in its directory?
+        :type save_models: bool
+        :param encoding_cache: optional cache of text encodings shared by the trials
+        :type encoding_cache: mycroft.cache.EncodingCache or None
+        :param verbose: print the result of each trial as it finishes?
+        :type verbose: bool
+        """
+        training = dict(training or {})
+        if not (training.get("validation_data") or training.get("validation_fraction")):
+            raise ValueError("Tuning requires validation data or a validation fraction")
+        defaults = constructor_defaults(model_class)
+        self.model_class = model_class
+        self.arguments = dict((name, arguments.get(name, default)) for name, default in defaults.items())
+        self.data = data
+        self.training = training
+        self.directory = directory
+        self.workers = workers
+        self.save_models = save_models
+        self.encoding_cache = encoding_cache
+        self.verbose = verbose
+        self.results = []
+        self.encoding_directory = None
+
+    def __repr__(self):
+        return "Tuner: %s, %d trials run, %d workers" % (self.model_class.__name__, len(self.results), self.workers)
+
+    def grid_search(self, space, epochs):
+        """
+        :param space: search space containing only lists of values
+        :type space: SearchSpace
+        :param epochs: maximum number of epochs to train each configuration
+        :type epochs: int
+        :return: leaderboard
+        :rtype: list of dict
+        """
+        return self.search(space.grid(), epochs)
+
+    def random_search(self, space, trials, epochs, seed=None):
+        """
+        :param space: search space
+        :type space: SearchSpace
+        :param trials: number of configurations to try
+        :type trials: int
+        :param epochs: maximum number of epochs to train each configuration
+        :type epochs: int
+        :param seed: random seed
+        :type seed: int or None
+        :return: leaderboard
+        :rtype: list of dict
+        """
+        return self.search(space.sample(trials, random.Random(seed)), epochs)
+
+    def search(self, configurations, epochs):
+        self.prepare(configurations)
+        with self.shared_encodings():
+            self.results = self.run_trials([self.trial(i, configuration, epochs)
+                                            for i, configuration in enumerate(configurations, 1)])
+        return self.save_leaderboard()
+
+    def successive_halving(self, space, trials, min_epochs, max_epochs, eta=ETA, seed=None):
+        """
+        Train randomly chosen configurations for the minimum number of epochs, then repeatedly keep the best 1 / eta of
+        them and train those from scratch for eta times as many epochs, until one configuration is left or the maximum
+        number of epochs is reached. Each round is a rung, and the trials of each rung are written to their own
+        subdirectory.
+
+        :param space: search space
+        :type space: SearchSpace
+        :param trials: number of configurations to start with
+        :type trials: int
+        :param min_epochs: number of epochs in the first rung
+        :type min_epochs: int
+        :param max_epochs: maximum number of epochs
+        :type max_epochs: int
+        :param eta: factor by which the number of configurations is reduced and the number of epochs increased
+        :type eta: int
+        :param seed: random seed
+        :type seed: int or None
+        :return: leaderboard
+        :rtype: list of dict
+        """
+        if eta < 2:
+            raise ValueError("The reduction factor must be at least 2")
+        configurations = space.sample(trials, random.Random(seed))
+        self.prepare(configurations)
+        survivors = list(enumerate(configurations, 1))
+        epochs = min(min_epochs, max_epochs)
+        rung = 1
+        self.results = []
+        with self.shared_encodings():
+            while True:
+                results = self.run_trials([self.trial(i, configuration, epochs, rung)
+                                           for i, configuration in survivors])
+                self.results.extend(results)
+                if len(survivors) == 1 or epochs >= max_epochs:
+                    break
+                keep = set(result["trial"] for result in results[:math.ceil(len(results) / eta)]
+                           if result["error"] is None)
+                survivors = [(i, configuration) for i, configuration in survivors if i in keep]
+                if not survivors:
+                    break
+                epochs = min(epochs * eta, max_epochs)
+                rung += 1
+        return self.save_leaderboard()
+
+    @staticmethod
+    def trial(number, configuration, epochs, rung=None):
+        name = "trial-%03d" % number
+        if rung is not None:
+            name = os.path.join("rung-%d" % rung, name)
+        return {"trial": number, "rung": rung or 1, "name": name, "parameters": dict(configuration), "epochs": epochs}
+
+    def prepare(self, configurations):
+        tokenize_data([self.data, self.training.get("validation_data")],
+                      [{**self.arguments, **configuration} for configuration in configurations])
+
+    @contextmanager
+    def shared_encodings(self):
+        """
+        Create a temporary directory for the encodings that the trials share, and delete it afterwards. Length-bucketed
+        training encodes variable-length sequences from the shared tokens instead.
+        """
+        if self.training.get("bucket"):
+            yield
+            return
+        self.encoding_directory = tempfile.mkdtemp()
+        try:
+            yield
+        finally:
+            shutil.rmtree(self.encoding_directory)
+            self.encoding_directory = None
+
+    def run_trials(self, trials):
+        """
+        Run trials in a pool of worker processes.
+
+        :param trials: trials created by the trial method
+        :type trials: list of dict
+        :return: results of the trials from best to worst
+        :rtype: list of dict
+        """
+        state = (self.model_class, self.arguments, self.data, self.training, self.directory, self.save_models,
+                 self.encoding_cache, self.encoding_directory)
+        results = []
+        with worker_pool(min(self.workers, len(trials)), state) as pool:
+            for result in pool.imap_unordered(run_trial, trials):
+                if self.verbose:
+                    print(format_result(result))
+                results.append(result)
+        return sorted(results, key=rank_key)
+
+    def leaderboard(self):
+        """
+        The last result of every trial, from best to worst. Trials that reached a later rung of successive halving rank
+        above those that were eliminated.
+
+        :return: trial results with their ranks
+        :rtype: list of dict
+        """
+        last = {}
+        for result in self.results:
+            if result["trial"] not in last or result["rung"] > last[result["trial"]]["rung"]:
+                last[result["trial"]] = result
+        return [dict(result, rank=rank)
+                for rank, result in enumerate(sorted(last.values(), key=rank_key), 1)]
+
+    def save_leaderboard(self):
+        leaderboard = self.leaderboard()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, self.leaderboard_name), mode="w") as f:
+                json.dump(leaderboard, f, sort_keys=True, indent=4, separators=(",", ": "))
+        return leaderboard
+
+
+class CrossValidator:
+    """
+    Estimate how well a model configuration generalizes with k-fold cross-validation.
+
+    The data is divided into folds with the same proportions of labels. For each fold a model is trained on the other
+    folds and evaluated on it. The folds run at the same time in a pool of worker processes, each of which receives the
+    data once when it starts and keeps it for all the folds it runs.
+
+    The model's data-dependent parameters, such as the sequence length or a corpus vocabulary, are determined from all
+    the data, so that every fold uses the same embedder. The data is encoded once in a worker process and written to a
+    temporary file, which every fold memory-maps to get the encodings of its training and test samples. Keras trains on
+    arrays in memory, so each fold copies the encodings of its samples out of the file. The folds that run at once
+    therefore hold about one copy of the encodings each, but none of them encodes the data.
+    """
+    FOLDS = 5
+
+    def __init__(self, model_class, arguments, data, folds=FOLDS, training=None, workers=1, seed=None,
+                 encoding_cache=None, verbose=False):
+        """
+        :param model_class: the model to cross-validate
+        :type model_class: type
+        :param arguments: values of constructor arguments, other arguments have their default values
+        :type arguments: dict
+        :param data: the data
+        :type data: mycroft.data.Dataset
+        :param folds: number of folds
+        :type folds: int
+        :param training: keyword arguments of TextEmbeddingClassifier.train other than the training and validation data
+            and the model directory
+        :type training: dict or None
+        :param workers: number of folds to run at once
+        :type workers: int
+        :param seed: random seed used to assign samples to folds
+        :type seed: int or None
+        :param encoding_cache: optional cache of text encodings
+        :type encoding_cache: mycroft.cache.EncodingCache or None
+        :param verbose: print the result of each fold as it finishes?
+        :type verbose: bool
+        """
+        if folds < 2:
+            raise ValueError("Cross-validation requires at least 2 folds")
+        defaults = constructor_defaults(model_class)
+        self.model_class = model_class
+        self.arguments = dict((name, arguments.get(name, default)) for name, default in defaults.items())
+        self.data = data
+        self.folds = folds
+        self.training = dict(training or {})
+        self.workers = workers
+        self.seed = seed
+        self.encoding_cache = encoding_cache
+        self.verbose = verbose
+        self.results = []
+
+    def __repr__(self):
+        return "Cross-validator: %s, %d folds, %d workers" % (self.model_class.__name__, self.folds, self.workers)
+
+    def fold_indexes(self):
+        """
+        :return: the indexes of the training and test samples of each fold
+        :rtype: list of (numpy.array, numpy.array)
+        """
+        from sklearn.model_selection import StratifiedKFold
+
+        folds = StratifiedKFold(n_splits=self.folds, shuffle=True, random_state=self.seed)
+        return list(folds.split(self.data.label_codes, self.data.label_codes))
+
+    def run(self, model_directory=None):
+        """
+        Train and evaluate a model on each fold.
+
+        :param model_directory: directory in which to save the model of the fold with the lowest test loss, or None to
+            not save it
+        :type model_directory: str or None
+        :return: the fold number, sizes, number of epochs run, training time and test metrics of each fold, or an error
+            message if the fold's model could not be trained
+        :rtype: list of dict
+        """
+        folds = [{"fold": fold, "train": train, "test": test}
+                 for fold, (train, test) in enumerate(self.fold_indexes(), 1)]
+        tokenize_data([self.data], [self.arguments])
+        directory = tempfile.mkdtemp()
+        try:
+            # Length-bucketed training encodes variable-length sequences from the shared tokens instead.
+            if self.training.get("bucket"):
+                encoding_filename = None
+            else:
+                encoding_filename = os.path.join(directory, "encoding.npy")
+            state = (self.model_class, self.arguments, self.data, self.training, encoding_filename,
+                     directory if model_directory is not None else None, self.encoding_cache)
+            results = []
+            with worker_pool(min(self.workers, self.folds), state) as pool:
+                if encoding_filename is not None:
+                    pool.apply(encode_folds)
+                for result in pool.imap_unordered(run_fold, folds):
+                    if self.verbose:
+                        print(format_fold(result))
+                    results.append(result)
+            self.results = sorted(results, key=lambda result: result["fold"])
+            completed = self.completed()
+            if model_directory is not None and completed:
+                best = min(completed, key=lambda result: result["metrics"]["loss"])
+                os.makedirs(model_directory, exist_ok=True)
+                fold_directory = os.path.join(directory, "fold-%d" % best["fold"])
+                for name in os.listdir(fold_directory):
+                    shutil.move(os.path.join(fold_directory, name), os.path.join(model_directory, name))
+        finally:
+            shutil.rmtree(directory)
+        return self.results
+
+    def completed(self):
+        """
+        :return: the results of the folds that did not fail
+        :rtype: list of dict
+        """
+        return [result for result in self.results if result["error"] is None]
+
+    def summary(self):
+        """
+        :return: the mean and standard deviation of each metric across the folds that did not fail, with a deviation of
+            0 if only one fold did not fail
+        :rtype: dict of str to (float, float)
+        """
+        completed = self.completed()
+        names = completed[0]["metrics"].keys() if completed else []
+        return dict((name, (statistics.mean(result["metrics"][name] for result in completed),
+                            statistics.stdev(result["metrics"][name] for result in completed)
+                            if len(completed) > 1 else 0.0))
+                    for name in names)
+
+
+def tokenize_data(datasets, configurations):
+    """
+    Tokenize data sets with every language model and tokenizer used by a set of model configurations, so that worker
+    processes receive the tokens instead of tokenizing the data themselves.
+
+    :param datasets: data sets, which are only tokenized if their texts are TokenizedTexts
+    :type datasets: list of mycroft.data.Dataset or None
+    :param configurations: model constructor arguments
+    :type configurations: list of dict
+    """
+    from .text import TokenizedTexts
+
+    tokenizations = set()
+    for arguments in configurations:
+        if "language_model" in arguments:
+            tokenizations.add((arguments["language_model"], arguments.get("tokenizer", "spacy")))
+    for data in datasets:
+        if data is not None and isinstance(data.texts, TokenizedTexts):
+            for language_model, tokenizer in sorted(tokenizations):
+                data.texts.tokens(language_model, tokenizer)
+
+
+def constructor_defaults(model_class):
+    """
+    :param model_class: a TextEmbeddingClassifier
+    :type model_class: type
+    :return: the model's constructor keyword arguments and their default values
+    :rtype: dict
+    """
+    spec = inspect.getfullargspec(model_class.__init__)
+    return dict(zip(spec.args[-len(spec.defaults):], spec.defaults))
+
+
+def rank_key(result):
+    # Later rungs first, then lowest loss, with failed trials last.
+    return -result["rung"], result["loss"] is None, result["loss"] or 0, result["trial"]
+
+
+def format_metrics(metrics):
+    return " - ".join("%s: %0.5f" % item for item in sorted(metrics.items()))
+
+
+def format_fold(result):
+    """
+    :param result: fold result
+    :type result: dict
+    :return: one line description of the result
+    :rtype: str
+    """
+    if result["error"] is not None:
+        return "Fold %d: failed, %s" % (result["fold"], result["error"])
+    return "Fold %d: %s" % (result["fold"], format_metrics(result["metrics"]))
+
+
+def format_result(result):
+    """
+    :param result: trial result
+    :type result: dict
+    :return: one line description of the result
+    :rtype: str
+    """
+    parameters = ", ".join("%s %s" % item for item in sorted(result["parameters"].items()))
+    if result["error"] is not None:
+        return "Trial %d (%s): failed, %s" % (result["trial"], parameters, result["error"])
+    return "Trial %d (%s): best epoch %d of %d, %s, %0.1f seconds" % (
+        result["trial"], parameters, result["best_epoch"], result["epochs_run"], format_metrics(result["metrics"]),
+        result["seconds"])
+
+
+# The model, data and training options shared by the trials or folds run in a worker process.
+worker_state = None
+
+# Number of seconds a worker waits for another worker to write a shared encoding.
+CLAIM_TIMEOUT = 3600
+
+
+def worker_pool(workers, state):
+    """
+    A pool of processes that run trials or folds.
+
+    The processes are started with the spawn method, because this process has already imported Keras, which is not
+    safe to fork. Each process receives the shared state once when it starts and reuses it for every trial or fold it
+    runs, rather than receiving a copy of the data for each one.
+
+    :param workers: number of processes
+    :type workers: int
+    :param state: model, data and training options shared by the trials or folds
+    :type state: tuple
+    :return: process pool
+    :rtype: multiprocessing.pool.Pool
+    """
+    return multiprocessing.get_context("spawn").Pool(workers, initializer=initialize_worker, initargs=(state,))
+
+
+def initialize_worker(state):
+    global worker_state
+    worker_state = state
+
+
+def clear_keras_session():
+    """
+    Discard the models that earlier trials or folds built in this worker process.
+    """
+    from keras import backend
+
+    backend.clear_session()
+
+
+def run_trial(trial):
+    """
+    Train a model with one configuration.
+
+    :param trial: trial created by Tuner.trial
+    :type trial: dict
+    :return: the trial with the number of epochs run, the best epoch, its validation loss and metrics, and the training
+        time, or an error message if the model could not be trained
+    :rtype: dict
+    """
+    from .model import TextEmbeddingClassifier, save_history
+
+    model_class, arguments, data, training, directory, save_models, cache, encoding_directory = worker_state
+    result = dict(trial, error=None, loss=None)
+    trial_directory = os.path.join(directory, trial["name"]) if directory is not None else None
+    start = time.perf_counter()
+    try:
+        clear_keras_session()
+        model = model_class.create_from_command_line_arguments(
+            data, argparse.Namespace(**{**arguments, **trial["parameters"]}))
+        model.encoding_cache = cache
+        if encoding_directory is not None:
+            add_shared_encoding(model, data, encoding_directory, "training")
+            if training.get("validation_data") is not None:
+                add_shared_encoding(model, training["validation_data"], encoding_directory, "validation")
+        history = model.train(data, epochs=trial["epochs"], model_directory=trial_directory if save_models else None,
+                              verbose=0, **training)
+    except Exception as e:
+        result["error"] = "%s: %s" % (e.__class__.__name__, e)
+        return result
+    losses = history.history[history.monitor]
+    best_epoch = losses.index(min(losses))
+    result.update(loss=float(losses[best_epoch]), best_epoch=best_epoch + 1, epochs_run=len(history.epoch),
+                  metrics=dict((name, float(values[best_epoch])) for name, values in history.history.items()
+                               if name != "lr"),
+                  seconds=time.perf_counter() - start, directory=trial_directory)
+    if trial_directory is not None and not save_models:
+        os.makedirs(trial_directory, exist_ok=True)
+        save_history(history, os.path.join(trial_directory, TextEmbeddingClassifier.history_name))
+    return result
+
+
+def add_shared_encoding(model, data, directory, name, timeout=CLAIM_TIMEOUT):
+    """
+    Add the encoding of a data set by a model's embedder to the data set, memory-mapped from a file in a directory
+    shared by worker processes.
+
+    The first process that needs an encoding claims it by creating a marker file that contains its process id, computes
+    the encoding and writes it. Other processes that need the same encoding wait for the file to appear. If the
+    claiming process fails or dies, another one takes over the claim. Each process writes to its own temporary file
+    and renames it into place, so if two processes take over the same stale claim they merely both encode the data.
+
+    :param model: the model
+    :type model: mycroft.model.TextEmbeddingClassifier
+    :param data: data set to encode
+    :type data: mycroft.data.Dataset
+    :param directory: directory of shared encodings
+    :type directory: str
+    :param name: name that distinguishes this data set from others encoded in the same directory
+    :type name: str
+    :param timeout: number of seconds to wait for another process to write the encoding before giving up
+    :type timeout: float
+    """
+    import numpy
+    from .data import Dataset
+
+    key = "%s-%s" % (name, hashlib.sha256(Dataset.encoding_key(model.embedder).encode("utf-8")).hexdigest())
+    filename = os.path.join(directory, key + ".npy")
+    claim = os.path.join(directory, key + ".claim")
+    deadline = time.monotonic() + timeout
+    while not os.path.isfile(filename):
+        try:
+            descriptor = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not claim_is_live(claim):
+                remove_file(claim)
+            elif time.monotonic() > deadline:
+                raise TimeoutError("Waited %d seconds for another process to write the %s encoding" % (timeout, name))
+            else:
+                time.sleep(0.1)
+            continue
+        temporary = "%s.%d.tmp" % (filename, os.getpid())
+        try:
+            with os.fdopen(descriptor, mode="w") as f:
+                f.write(str(os.getpid()))
+            with open(temporary, mode="wb") as f:
+                numpy.save(f, model.encode(data))
+            os.replace(temporary, filename)
+        except BaseException:
+            remove_file(temporary)
+            remove_file(claim)
+            raise
+    data.add_encoding(model.embedder, numpy.load(filename, mmap_mode="r"))
+
+
+def claim_is_live(claim):
+    """
+    :param claim: marker file created by add_shared_encoding
+    :type claim: str
+    :return: is the process that created the claim still running? A claim whose process id has not been written yet
+        is live.
+    :rtype: bool
+    """
+    try:
+        with open(claim) as f:
+            pid = f.read()
+    except FileNotFoundError:
+        return True
+    if not pid:
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_file(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def encode_folds():
+    """
+    Encode all the data with the embedder every fold uses and save it to the shared encoding file.
+    """
+    import numpy
+
+    model_class, arguments, data, _, encoding_filename, _, cache = worker_state
+    model = model_class.create_from_command_line_arguments(data, argparse.Namespace(**arguments))
+    model.encoding_cache = cache
+    numpy.save(encoding_filename, model.encode(data))
+
+
+def run_fold(fold):
+    """
+    Train a model on the training samples of a fold and evaluate it on the test samples.
+
+    :param fold: fold number and the indexes of its training and test samples
+    :type fold: dict
+    :return: the fold number, sizes, number of epochs run, training time and test metrics, or an error message if the
+        model could not be trained
+    :rtype: dict
+    """
+    import numpy
+
+    model_class, arguments, data, training, encoding_filename, directory, _ = worker_state
+    result = {"fold": fold["fold"], "train_size": len(fold["train"]), "test_size": len(fold["test"]), "error": None}
+    start = time.perf_counter()
+    try:
+        clear_keras_session()
+        model = model_class.create_from_command_line_arguments(data, argparse.Namespace(**arguments))
+        if encoding_filename is not None:
+            data.add_encoding(model.embedder, numpy.load(encoding_filename, mmap_mode="r"))
+        training_data, test_data = data.subset(fold["train"]), data.subset(fold["test"])
+        model_directory = os.path.join(directory, "fold-%d" % fold["fold"]) if directory is not None else None
+        history = model.train(training_data, model_directory=model_directory, verbose=0, **training)
+        metrics = model.evaluate(test_data, batch_size=training.get("batch_size", model_class.BATCH_SIZE),
+                                 bucket=training.get("bucket", False))
+    except Exception as e:
+        result["error"] = "%s: %s" % (e.__class__.__name__, e)
+        return result
+    result.update(epochs_run=len(history.epoch), seconds=time.perf_counter() - start,
+                  metrics=dict((name, float(value)) for name, value in metrics))
+    return result
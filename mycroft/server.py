@@ -0,0 +1,269 @@
+"""
+Long-running prediction server.
+"""
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class PredictionBatcher:
+    """
+    Coalesce concurrent prediction requests into batches.
+
+    Each request is a list of texts. Requests are queued, and a worker thread repeatedly takes as many of them as it can
+    without exceeding the maximum batch size, waiting no longer than the maximum wait time after the first one arrives,
+    and passes all their texts to the model's predict method in a single call. A request larger than the maximum batch
+    size is predicted on its own. If the model fails on a batch, its requests are retried one at a time so that the
+    error is only returned to the requests that cause it.
+    """
+    MAX_BATCH_SIZE = 256
+    MAX_WAIT = 0.005
+
+    def __init__(self, model, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT, batch_size=32):
+        """
+        :param model: the model
+        :type model: mycroft.model.TextEmbeddingClassifier
+        :param max_batch_size: maximum number of texts to predict in a single call
+        :type max_batch_size: int
+        :param max_wait: maximum number of seconds to wait for more requests after the first one in a batch arrives
+        :type max_wait: float
+        :param batch_size: batch size passed to the model's predict method
+        :type batch_size: int
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.statistics = BatchStatistics()
+        self.requests = queue.Queue()
+        # Requests may not be submitted once the batcher is closed, because the worker thread has stopped.
+        self.closed = False
+        self.closing_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="prediction-batcher", daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return "Prediction batcher: maximum batch size %d, maximum wait %0.3fs" % (self.max_batch_size, self.max_wait)
+
+    def submit(self, texts):
+        """
+        Queue texts for prediction.
+
+        :param texts: texts to classify
+        :type texts: sequence of str
+        :return: future whose result is the label probabilities and predicted labels of the texts
+        :rtype: concurrent.futures.Future
+        :raises RuntimeError: if the batcher has been closed
+        """
+        future = Future()
+        with self.closing_lock:
+            if self.closed:
+                raise RuntimeError("Cannot submit texts to a closed prediction batcher")
+            self.requests.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def predict(self, texts, timeout=None):
+        """
+        Classify texts, blocking until they have been predicted as part of a batch.
+
+        :param texts: texts to classify
+        :type texts: sequence of str
+        :param timeout: maximum number of seconds to wait, or None to wait indefinitely
+        :type timeout: float or None
+        :return: label probabilities and predicted labels
+        :rtype: (numpy.array, list of str)
+        """
+        return self.submit(texts).result(timeout)
+
+    @property
+    def queue_depth(self):
+        return self.requests.qsize()
+
+    def close(self):
+        """
+        Predict all the requests that have been queued and stop the worker thread. Texts may not be submitted
+        afterwards.
+        """
+        with self.closing_lock:
+            if not self.closed:
+                self.closed = True
+                self.requests.put(None)
+        self.thread.join()
+
+    def run(self):
+        carry = None
+        stopping = False
+        while not stopping:
+            request = carry or self.requests.get()
+            carry = None
+            if request is None:
+                break
+            batch = [request]
+            size = len(request[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if size + len(request[0]) > self.max_batch_size:
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self.predict_batch(batch)
+
+    def predict_batch(self, batch):
+        texts = [text for request in batch for text in request[0]]
+        try:
+            label_probabilities, predicted_labels = self.model.predict(texts, self.batch_size)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # Predict the requests one at a time so that a bad request does not fail the others in its batch.
+                for request in batch:
+                    self.predict_batch([request])
+            return
+        end = time.perf_counter()
+        i = 0
+        for request_texts, future, start in batch:
+            j = i + len(request_texts)
+            future.set_result((label_probabilities[i:j], predicted_labels[i:j]))
+            self.statistics.add_request(len(request_texts), end - start)
+            i = j
+        self.statistics.add_batch(len(texts))
+
+
+class BatchStatistics:
+    """
+    Latency and throughput statistics of a prediction batcher.
+    """
+    RECENT = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.maximum_batch = 0
+        self.latencies = deque(maxlen=self.RECENT)
+
+    def add_request(self, texts, latency):
+        with self.lock:
+            self.requests += 1
+            self.texts += texts
+            self.latencies.append(latency)
+
+    def add_batch(self, texts):
+        with self.lock:
+            self.batches += 1
+            self.maximum_batch = max(self.maximum_batch, texts)
+
+    def as_dict(self):
+        """
+        Latencies are in milliseconds and percentiles are computed over the most recent requests.
+
+        :return: statistics
+        :rtype: dict
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            elapsed = time.perf_counter() - self.start
+            d = {"requests": self.requests, "texts": self.texts, "batches": self.batches,
+                 "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+                 "maximum_batch_size": self.maximum_batch,
+                 "texts_per_second": self.texts / elapsed if elapsed else 0.0}
+        for name, q in [("latency_mean_ms", None), ("latency_p50_ms", 0.5), ("latency_p99_ms", 0.99)]:
+            if not latencies:
+                d[name] = 0.0
+            elif q is None:
+                d[name] = 1000 * sum(latencies) / len(latencies)
+            else:
+                d[name] = 1000 * latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+        return d
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with a JSON object {"texts": [...]} returns the predicted labels and label probabilities of the texts.
+    GET /stats returns the batcher statistics.
+    """
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.server.batcher.statistics.as_dict())
+        else:
+            self.send_json(404, {"error": "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": "Unknown path %s" % self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length).decode("utf-8"))["texts"]
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("texts must be a list of strings")
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": "Invalid request: %s" % e})
+            return
+        if not texts:
+            self.send_json(200, {"labels": [], "label_names": list(self.server.batcher.model.label_names),
+                                 "probabilities": []})
+            return
+        try:
+            label_probabilities, predicted_labels = self.server.batcher.predict(texts)
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, {"labels": list(predicted_labels),
+                             "label_names": list(self.server.batcher.model.label_names),
+                             "probabilities": [[float(p) for p in row] for row in label_probabilities]})
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server that handles each request on its own thread and sends the texts to a shared prediction batcher.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, batcher, verbose=False):
+        """
+        :param address: host and port on which to listen; port 0 chooses a free port
+        :type address: (str, int)
+        :param batcher: batcher that makes the predictions
+        :type batcher: PredictionBatcher
+        :param verbose: log each request?
+        :type verbose: bool
+        """
+        super().__init__(address, PredictionRequestHandler)
+        self.batcher = batcher
+        self.verbose = verbose
+
+    def __repr__(self):
+        return "Prediction server: http://%s:%d" % self.server_address[:2]
@@ -1,27 +1,404 @@
 """
 Natural language processing components.
 """
+import hashlib
+import json
+import math
+import multiprocessing
 import operator
+import os
+import re
+import threading
+from collections import Counter
+from collections.abc import Sequence
 from functools import partial
+from itertools import chain, islice
 
 import numpy
 
+from .options import EMBEDDING_DTYPES, TOKENIZERS
+from .profiling import add_worker_cpu_time, process_cpu_time, span
 
-def maximum_text_length(texts, language_model="en"):
+# Words followed by the contraction n't, the contraction n't, clitics like 's, numbers with decimal points or thousands
+# separators, words, and single punctuation characters.
+token_pattern = re.compile(r"[^\W\d_]+(?=n't\b)|n't\b|'(?:s|re|ve|ll|m|d)\b|\d+(?:[.,]\d+)*|\w+|[^\w\s]",
+                           re.IGNORECASE)
+
+
+def quantize_embeddings(embedding_matrix, dtype="float32"):
+    """
+    Store an embedding matrix at a reduced precision.
+
+    A float32 or float16 matrix is simply cast. An int8 matrix maps each row linearly onto the range -127 to 127, so
+    it is returned along with the scale of each row.
+
+    :param embedding_matrix: embedding matrix
+    :type embedding_matrix: numpy.array
+    :param dtype: one of EMBEDDING_DTYPES
+    :type dtype: str
+    :return: the matrix at the new precision and the scales of its rows, or None if it is not int8
+    :rtype: (numpy.array, numpy.array or None)
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError("Invalid embedding type %s, must be one of %s" % (dtype, EMBEDDING_DTYPES))
+    if dtype != "int8":
+        return numpy.asarray(embedding_matrix, dtype=dtype), None
+    scales = (numpy.abs(embedding_matrix).max(axis=1) / 127).astype("float32")
+    # Rows of zeros, such as the padding row, have a scale of zero, so divide them by 1 instead.
+    divisors = numpy.where(scales > 0, scales, 1)[:, numpy.newaxis]
+    return numpy.rint(embedding_matrix / divisors).astype("int8"), scales
+
+
+def dequantize_embeddings(embedding_matrix, scales=None):
+    """
+    :param embedding_matrix: embedding matrix returned by quantize_embeddings
+    :type embedding_matrix: numpy.array
+    :param scales: row scales returned by quantize_embeddings
+    :type scales: numpy.array or None
+    :return: float32 embedding matrix
+    :rtype: numpy.array
+    """
+    if scales is None:
+        return numpy.asarray(embedding_matrix, dtype="float32")
+    return embedding_matrix.astype("float32") * scales[:, numpy.newaxis]
+
+
+def maximum_text_length(texts, language_model="en", tokenizer="spacy"):
     """
     The number of tokens in the longest text in a set of texts.
 
     :param texts: texts in training data
-    :type texts: sequence of str
+    :type texts: sequence of str or TokenizedTexts
     :param language_model: spaCy language model name
     :type language_model: str
+    :param tokenizer: one of TOKENIZERS
+    :type tokenizer: str
     :return: size of the longest text in the data
     :rtype: int
     """
-    longest_text = 0
-    for document in text_parser(language_model).pipe(texts):
-        longest_text = max(len(document), longest_text)
-    return longest_text
+    if isinstance(texts, TokenizedTexts):
+        return int(max(texts.lengths(language_model, tokenizer), default=0))
+    # Stream the texts so that only the running maximum is held in memory.
+    if tokenizer == "regex":
+        lengths = (len(regex_tokens(text)) for text in texts)
+    else:
+        lengths = (len(document) for document in parse(language_model, texts, tokenizer))
+    return max(lengths, default=0)
+
+
+def tokenize(texts, language_model="en", workers=1, tokenizer="spacy"):
+    """
+    Split texts into tokens.
+
+    :param texts: texts to tokenize
+    :type texts: sequence of str
+    :param language_model: spaCy language model name
+    :type language_model: str
+    :param workers: number of processes to use
+    :type workers: int
+    :param tokenizer: one of TOKENIZERS
+    :type tokenizer: str
+    :return: the token strings in each text
+    :rtype: list of list of str
+    """
+    with span("tokenize"):
+        return list(chain.from_iterable(
+            parallel_apply(partial(token_strings, language_model, tokenizer=tokenizer), texts, workers)))
+
+
+def tokenizer_agreement(texts, tokenizer, language_model="en"):
+    """
+    The fraction of texts that a tokenizer splits into the same tokens as the full spaCy pipeline.
+
+    :param texts: texts to tokenize
+    :type texts: sequence of str
+    :param tokenizer: one of TOKENIZERS
+    :type tokenizer: str
+    :param language_model: spaCy language model name
+    :type language_model: str
+    :return: fraction of the texts on which the tokenizer agrees with spaCy
+    :rtype: float
+    """
+    texts = list(texts)
+    if not texts:
+        return 1.0
+    agree = sum(a == b for a, b in
+                zip(token_strings(language_model, texts), token_strings(language_model, texts, tokenizer)))
+    return agree / len(texts)
+
+
+def parse(language_model, texts, tokenizer="spacy"):
+    """
+    :param language_model: spaCy language model name
+    :type language_model: str
+    :param texts: texts to parse
+    :type texts: sequence of str
+    :param tokenizer: "spacy" to run the full pipeline or "spacy-tokenizer" to only tokenize
+    :type tokenizer: str
+    :return: spaCy documents
+    :rtype: iterator of spacy.tokens.Doc
+    """
+    if tokenizer == "spacy-tokenizer":
+        return text_parser(language_model).tokenizer.pipe(texts)
+    return text_parser(language_model).pipe(texts)
+
+
+def regex_tokens(text):
+    return token_pattern.findall(text)
+
+
+def token_strings(language_model, texts, tokenizer="spacy"):
+    if tokenizer == "regex":
+        return [regex_tokens(text) for text in texts]
+    return [[token.orth_ for token in document] for document in parse(language_model, texts, tokenizer)]
+
+
+def document_vectors(language_model, texts, tokenizer="spacy"):
+    return vector_table(language_model).document_vectors(token_strings(language_model, texts, tokenizer))
+
+
+def parallel_apply(function, texts, workers=1, shards_per_worker=4):
+    """
+    Apply a function to contiguous shards of a sequence of texts in a pool of processes.
+
+    Each process loads its own copy of any spaCy pipeline the function uses, once, because the pool is reused by later
+    calls. The texts are split into several shards per process so that the work stays balanced when texts differ in
+    length. The processes report the CPU time they spend to the active profiler.
+
+    :param function: function that takes a list of texts
+    :type function: callable
+    :param texts: texts to process
+    :type texts: sequence of str
+    :param workers: number of processes to use, if 1 apply the function to all the texts in this process
+    :type workers: int
+    :param shards_per_worker: number of shards to create for each process
+    :type shards_per_worker: int
+    :return: the function's results for each shard in the order of the texts
+    :rtype: list
+    """
+    texts = list(texts)
+    if workers <= 1 or len(texts) < workers:
+        return [function(texts)]
+    shard_size = math.ceil(len(texts) / (workers * shards_per_worker))
+    shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+    results = process_pool(workers).map(partial(timed_apply, function), shards, chunksize=1)
+    add_worker_cpu_time(sum(seconds for _, seconds in results))
+    return [result for result, _ in results]
+
+
+def timed_apply(function, texts):
+    """
+    :return: the result of applying a function to texts, and the CPU time this process spent computing it
+    :rtype: (object, float)
+    """
+    start = process_cpu_time()
+    result = function(texts)
+    return result, process_cpu_time() - start
+
+
+# Process pools used by parallel_apply, by number of processes.
+process_pool_singletons = {}
+process_pool_lock = threading.Lock()
+
+
+def process_pool(workers):
+    """
+    A pool of processes that is created the first time it is requested and shared by all later requests for the same
+    number of processes, such as every chunk of every epoch of streaming training.
+
+    The processes are started with the spawn method, because this process may already have initialized TensorFlow,
+    which is not safe to fork. The pools are terminated when the program exits.
+
+    :param workers: number of processes
+    :type workers: int
+    :return: process pool
+    :rtype: multiprocessing.pool.Pool
+    """
+    with process_pool_lock:
+        if workers not in process_pool_singletons:
+            process_pool_singletons[workers] = multiprocessing.get_context("spawn").Pool(workers)
+        return process_pool_singletons[workers]
+
+
+class TokenizedTexts(Sequence):
+    """
+    A sequence of texts that is parsed at most once per language model.
+
+    This behaves like a list of the original texts. The tokens in the texts are computed the first time they are
+    requested and reused afterwards, so determining the length of the longest text and encoding the texts with a
+    TextSequenceEmbedder share a single parse.
+
+    If an encoding cache is specified, text lengths are also stored there, so that a later run over the same data can
+    determine the longest text without parsing.
+    """
+
+    def __init__(self, texts, cache=None, workers=1):
+        """
+        :param texts: texts to tokenize
+        :type texts: sequence of str
+        :param cache: optional cache in which to store text lengths
+        :type cache: mycroft.cache.EncodingCache or None
+        :param workers: number of processes to use for tokenization
+        :type workers: int
+        """
+        self.texts = list(texts)
+        self.cache = cache
+        self.workers = workers
+        self._tokens = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return self.texts[index]
+
+    def __repr__(self):
+        return "Tokenized texts: %d texts, parsed with %s" % (
+            len(self), ", ".join("%s %s" % key for key in sorted(self._tokens)))
+
+    def tokens(self, language_model="en", tokenizer="spacy"):
+        """
+        :param language_model: spaCy language model name
+        :type language_model: str
+        :param tokenizer: one of TOKENIZERS
+        :type tokenizer: str
+        :return: the token strings in each text
+        :rtype: list of list of str
+        """
+        if (language_model, tokenizer) not in self._tokens:
+            self._tokens[(language_model, tokenizer)] = tokenize(self.texts, language_model, self.workers, tokenizer)
+        return self._tokens[(language_model, tokenizer)]
+
+    def subset(self, indexes):
+        """
+        :param indexes: indexes of texts
+        :type indexes: sequence of int
+        :return: the texts at the indexes, with any tokens that have already been computed for them
+        :rtype: TokenizedTexts
+        """
+        subset = TokenizedTexts([self.texts[i] for i in indexes], self.cache, self.workers)
+        subset._tokens = dict((key, [tokens[i] for i in indexes]) for key, tokens in self._tokens.items())
+        return subset
+
+    def lengths(self, language_model="en", tokenizer="spacy"):
+        """
+        :param language_model: spaCy language model name
+        :type language_model: str
+        :param tokenizer: one of TOKENIZERS
+        :type tokenizer: str
+        :return: the number of tokens in each text
+        :rtype: numpy.array
+        """
+        if (language_model, tokenizer) not in self._tokens and self.cache is not None:
+            key = self.cache.key({"lengths": language_model, "tokenizer": tokenizer}, self.texts)
+            lengths = self.cache.get(key)
+            if lengths is None:
+                lengths = self._token_lengths(language_model, tokenizer)
+                self.cache.put(key, lengths)
+            return lengths
+        return self._token_lengths(language_model, tokenizer)
+
+    def _token_lengths(self, language_model, tokenizer):
+        return numpy.array([len(tokens) for tokens in self.tokens(language_model, tokenizer)], dtype="int32")
+
+
+class LengthBuckets:
+    """
+    Variable-length sequences grouped into batches of similar length.
+
+    The sequences are sorted by length and divided into batches, each of which is padded only to the length of its
+    longest sequence. This wastes much less computation on padding than padding every sequence to the same length.
+    Padding is added to the start of the sequences, as with fixed-length encoding.
+    """
+
+    def __init__(self, sequences, labels=None, batch_size=32):
+        """
+        :param sequences: vocabulary index sequences
+        :type sequences: list of numpy.array
+        :param labels: optional label index of each sequence
+        :type labels: numpy.array or None
+        :param batch_size: maximum number of sequences in a batch
+        :type batch_size: int
+        """
+        self.sequences = sequences
+        self.labels = labels
+        self.batch_size = batch_size
+        self.lengths = numpy.array([len(sequence) for sequence in sequences], dtype="int64")
+
+    def __len__(self):
+        return math.ceil(len(self.sequences) / self.batch_size)
+
+    def __repr__(self):
+        return "Length buckets: %d sequences, %d batches, padding waste %0.3f" % (
+            len(self.sequences), len(self), self.padding_waste())
+
+    def batch_indexes(self, shuffle=False):
+        """
+        :param shuffle: randomize the order of the batches and of sequences of equal length?
+        :type shuffle: bool
+        :return: indexes of the sequences in each batch
+        :rtype: list of numpy.array
+        """
+        if shuffle:
+            order = numpy.lexsort((numpy.random.random(len(self.lengths)), self.lengths))
+        else:
+            order = numpy.argsort(self.lengths, kind="mergesort")
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if shuffle:
+            numpy.random.shuffle(batches)
+        return batches
+
+    def batch(self, indexes):
+        """
+        :param indexes: indexes of the sequences in the batch
+        :type indexes: numpy.array
+        :return: the sequences padded to the length of the longest one, and their labels if there are any
+        :rtype: (numpy.array, numpy.array or None)
+        """
+        # Keras requires at least one time step.
+        x = numpy.zeros((len(indexes), max(self.lengths[indexes].max(), 1)), dtype="int32")
+        for row, i in enumerate(indexes):
+            if self.lengths[i]:
+                x[row, -self.lengths[i]:] = self.sequences[i]
+        if self.labels is None:
+            return x, None
+        return x, self.labels[indexes]
+
+    def generate(self, shuffle=False):
+        """
+        Endlessly iterate over the batches for use with Keras generator functions.
+
+        :param shuffle: reshuffle the batches on each pass?
+        :type shuffle: bool
+        :return: padded sequences, and labels if there are any
+        :rtype: iterator of numpy.array or (numpy.array, numpy.array)
+        """
+        while True:
+            for indexes in self.batch_indexes(shuffle):
+                x, y = self.batch(indexes)
+                if y is None:
+                    yield x
+                else:
+                    yield x, y
+
+    def padding_waste(self, length=None):
+        """
+        Fraction of the padded batches that is padding.
+
+        :param length: if specified, compute the waste of padding every sequence to this length instead of bucketing
+        :type length: int or None
+        :return: padding fraction
+        :rtype: float
+        """
+        tokens = self.lengths.sum()
+        if length is not None:
+            cells = len(self.lengths) * length
+        else:
+            cells = sum(len(indexes) * max(self.lengths[indexes].max(), 1)
+                        for indexes in self.batch_indexes())
+        if cells == 0:
+            return 0.0
+        return float(1 - tokens / cells)
 
 
 class Embedder:
@@ -29,33 +406,76 @@ class Embedder:
     Base class of classes that convert text to continuous vector embeddings. Derived classes must implement the encode
     function.
 
-    Embedders use the spaCy package to process the text and map it to embedding vectors.
+    Embedders use the spaCy package to process the text and map it to embedding vectors. Setting workers to a value
+    greater than 1 shards the texts across that many processes, each with its own spaCy pipeline.
+
+    Only the tokens of the text are used, so the tokenizer may be one that skips the rest of the spaCy pipeline. (See
+    TOKENIZERS.)
     """
+    # Number of processes used to encode text. This is a property of the machine, so it is not saved with the embedder.
+    workers = 1
 
-    def __init__(self, language_model="en"):
+    def __init__(self, language_model="en", tokenizer="spacy"):
         """
         :param language_model: the name of the spaCy language model to use
         :type language_model: str
+        :param tokenizer: one of TOKENIZERS
+        :type tokenizer: str
         """
+        if tokenizer not in TOKENIZERS:
+            raise ValueError("Invalid tokenizer %s, must be one of %s" % (tokenizer, TOKENIZERS))
         self.language_model = language_model
+        self.tokenizer = tokenizer
         self.text_parser = text_parser(language_model)
 
     def __eq__(self, other):
-        return self.text_parser == other.text_parser
+        return self.text_parser == other.text_parser and self.tokenizer == other.tokenizer
 
     def __getstate__(self):
         d = self.__dict__.copy()
         d["text_parser"] = self.language_model
+        d.pop("workers", None)
         return d
 
     def __setstate__(self, d):
         d["text_parser"] = text_parser(d["text_parser"])
+        # Embedders saved by earlier versions always ran the full pipeline.
+        d.setdefault("tokenizer", "spacy")
         self.__dict__.update(d)
 
     @property
     def embedding_size(self):
         return self.text_parser.vocab.vectors_length
 
+    def configuration(self):
+        """
+        Values that determine how this embedder encodes text. Embedders with equal configurations produce identical
+        encodings.
+
+        :return: JSON-serializable description of the embedder
+        :rtype: dict
+        """
+        return {"embedder": self.__class__.__name__, "language_model": self.language_model,
+                "language_model_version": self.text_parser.meta.get("version"), "tokenizer": self.tokenizer}
+
+    def save(self, directory):
+        """
+        Write any data this embedder keeps outside of its pickled state to a model directory.
+
+        :param directory: model directory
+        :type directory: str
+        """
+        pass
+
+    def load(self, directory):
+        """
+        Read data written by save from a model directory.
+
+        :param directory: model directory
+        :type directory: str
+        """
+        pass
+
     def encode(self, texts):
         """
         Encode a sequence of texts as distributed vectors
@@ -68,39 +488,378 @@ class Embedder:
         raise NotImplementedError()
 
 
+class VectorTable:
+    """
+    The word vectors of a language model gathered into a single matrix as words are encountered.
+
+    Row 0 is all zeros and stands for every word that does not have a vector. The other rows are the vectors of the
+    words that have been looked up so far, so the table only grows as large as the vocabulary of the texts encoded with
+    it. The language model is consulted once per word with a vector rather than once per token. Words without vectors
+    are not remembered, so that a long-running process does not accumulate every misspelling it has seen.
+
+    The table may be shared by threads.
+    """
+
+    def __init__(self, language_model="en", capacity=1024):
+        """
+        :param language_model: the name of the spaCy language model to use
+        :type language_model: str
+        :param capacity: initial number of rows to allocate
+        :type capacity: int
+        """
+        self.language_model = language_model
+        self.index = {}
+        self.size = 1
+        self._vectors = numpy.zeros((capacity, text_parser(language_model).vocab.vectors_length), dtype="float32")
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return "Vector table: %s, %d words" % (self.language_model, len(self) - 1)
+
+    @property
+    def vectors(self):
+        """
+        :return: the rows of the table that are in use
+        :rtype: numpy.array
+        """
+        return self._vectors[:self.size]
+
+    def indexes(self, tokens):
+        """
+        :param tokens: tokens
+        :type tokens: iterable of str
+        :return: the row of each token in the table, adding rows for words that have not been seen before
+        :rtype: numpy.array
+        """
+        return self.lookup(tokens)[0]
+
+    def lookup(self, tokens):
+        """
+        Look up the rows of tokens along with the vectors of the table at the time they were looked up.
+
+        Other threads may add words to the table at any time, but never change the rows that are already in use, so
+        the returned vectors contain every returned row.
+
+        :param tokens: tokens
+        :type tokens: iterable of str
+        :return: the row of each token in the table, and the rows of the table that are in use
+        :rtype: (numpy.array, numpy.array)
+        """
+        tokens = list(tokens)
+        with self.lock:
+            index = self.index
+            new_words = set(tokens).difference(index)
+            if new_words:
+                self.add(new_words)
+            # Words without vectors are not kept in the index, so that it only grows with the words that have them.
+            return numpy.array([index.get(token, 0) for token in tokens], dtype="int64"), self._vectors[:self.size]
+
+    def add(self, words):
+        """
+        Add rows for the words that have vectors. The caller must hold the lock.
+
+        :param words: words that are not in the table
+        :type words: iterable of str
+        """
+        vocabulary = text_parser(self.language_model).vocab
+        for word in words:
+            vector = word_vector(vocabulary, word)
+            if vector is None:
+                continue
+            if self.size == len(self._vectors):
+                # Copy into a new array rather than resizing in place, so that callers holding the old vectors are
+                # unaffected.
+                vectors = numpy.zeros((2 * len(self._vectors), self._vectors.shape[1]), dtype="float32")
+                vectors[:self.size] = self._vectors[:self.size]
+                self._vectors = vectors
+            self._vectors[self.size] = vector
+            self.index[word] = self.size
+            self.size += 1
+
+    def counts(self, token_sequences):
+        """
+        :param token_sequences: the tokens in each text
+        :type token_sequences: sequence of list of str
+        :return: sparse matrix of the number of times each row of the table appears in each text
+        :rtype: scipy.sparse.csr_matrix
+        """
+        return self.counts_and_vectors(token_sequences)[0]
+
+    def counts_and_vectors(self, token_sequences):
+        """
+        :param token_sequences: the tokens in each text
+        :type token_sequences: sequence of list of str
+        :return: sparse matrix of the number of times each row of the table appears in each text, and the rows of the
+            table it counts
+        :rtype: (scipy.sparse.csr_matrix, numpy.array)
+        """
+        from scipy.sparse import csr_matrix
+
+        lengths = numpy.array([len(tokens) for tokens in token_sequences], dtype="int64")
+        offsets = numpy.concatenate([[0], numpy.cumsum(lengths)])
+        rows, vectors = self.lookup(chain.from_iterable(token_sequences))
+        # Repeated words in a text are duplicate entries in the matrix, which are summed.
+        counts = csr_matrix((numpy.ones(len(rows), dtype="float32"), rows, offsets),
+                            shape=(len(token_sequences), len(vectors)))
+        return counts, vectors
+
+    def document_vectors(self, token_sequences):
+        """
+        Like spaCy document vectors, the mean of the vectors of all the tokens in each text, counting tokens without
+        vectors as zero. An empty text has a vector of zeros.
+
+        :param token_sequences: the tokens in each text
+        :type token_sequences: sequence of list of str
+        :return: document vectors
+        :rtype: numpy.array
+        """
+        counts, vectors = self.counts_and_vectors(token_sequences)
+        lengths = numpy.maximum(numpy.asarray(counts.sum(axis=1), dtype="float32"), 1)
+        return numpy.asarray(counts.dot(vectors) / lengths, dtype="float32")
+
+
+def word_vector(vocabulary, word):
+    """
+    Look up a word's vector by its hash. Unlike indexing the vocabulary, this does not add a lexeme for the word, so
+    looking up the words of arbitrary texts does not grow the language model's vocabulary.
+
+    :param vocabulary: spaCy vocabulary
+    :type vocabulary: spacy.vocab.Vocab
+    :param word: word
+    :type word: str
+    :return: the word's vector, or None if it does not have one
+    :rtype: numpy.array or None
+    """
+    key = vocabulary.strings[word]
+    if key not in vocabulary.vectors:
+        return None
+    return vocabulary.vectors[key]
+
+
 class BagOfWordsEmbedder(Embedder):
     """
     Encode a sequence of words as a single vector that is mean of their embeddings.
+
+    The texts are encoded a chunk at a time. Each chunk is tokenized, then its document vectors are computed in a single
+    product of a sparse matrix of word counts and the language model's VectorTable, which is shared by all the bag of
+    words embedders that use that language model.
     """
+    # Number of texts to encode at a time.
+    chunk_size = 10000
 
     def encode(self, texts):
-        return numpy.array([document.vector for document in self.text_parser.pipe(texts)])
+        table = vector_table(self.language_model)
+        if isinstance(texts, TokenizedTexts):
+            token_sequences = texts.tokens(self.language_model, self.tokenizer)
+            chunks = (token_sequences[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size))
+        else:
+            texts = list(texts)
+            chunks = (tokenize(texts[i:i + self.chunk_size], self.language_model, self.workers, self.tokenizer)
+                      for i in range(0, len(texts), self.chunk_size))
+        vectors = numpy.zeros((len(texts), self.embedding_size), dtype="float32")
+        start = 0
+        for token_sequences in chunks:
+            with span("document vectors"):
+                vectors[start:start + len(token_sequences)] = table.document_vectors(token_sequences)
+            start += len(token_sequences)
+        return vectors
 
     def __repr__(self):
-        return "Bag of words embedder: %s" % (self.text_parser.meta["name"])
+        return "Bag of words embedder: %s, %s tokenizer" % (self.text_parser.meta["name"], self.tokenizer)
 
 
 class TextSequenceEmbedder(Embedder):
     """
     Encode a sequence of words as a matrix of their embeddings.
+
+    By default the vocabulary is the language model's most frequent words that have vectors. If texts are specified,
+    it is instead the words in those texts that have vectors, which is usually a much smaller set and so produces a
+    much smaller embedding matrix.
+
+    The embedding matrix is stored at the precision given by the embedding type, one of EMBEDDING_DTYPES. The Keras
+    embedding layer is initialized with a float32 copy of it, which Keras keeps in memory and saves in the model file
+    at full precision. Only the embedder's own copy and models exported for NumPy inference are smaller.
+
+    The vocabulary and embedding matrix are not pickled. Instead they are written to a model directory with save and
+    memory-mapped from it by load. If they have not been loaded, they are rebuilt from the language model the first
+    time they are used.
     """
+    # Names of files created in the model directory.
+    vocabulary_name = "vocabulary.json"
+    embedding_matrix_name = "embeddings.npy"
+    embedding_scales_name = "embedding_scales.npy"
 
-    def __init__(self, max_vocabulary_size, sequence_length, language_model="en"):
-        super(self.__class__, self).__init__(language_model)
+    def __init__(self, max_vocabulary_size, sequence_length, language_model="en", tokenizer="spacy", texts=None,
+                 min_frequency=1, embedding_dtype="float32"):
+        """
+        :param max_vocabulary_size: maximum number of words in the vocabulary, or None for no maximum
+        :type max_vocabulary_size: int or None
+        :param sequence_length: number of tokens to which texts are clipped or padded
+        :type sequence_length: int
+        :param language_model: the name of the spaCy language model to use
+        :type language_model: str
+        :param tokenizer: one of TOKENIZERS
+        :type tokenizer: str
+        :param texts: if specified, build the vocabulary from the words in these texts
+        :type texts: iterable of str or TokenizedTexts or None
+        :param min_frequency: the minimum number of times a word must appear in the texts to be in the vocabulary
+        :type min_frequency: int
+        :param embedding_dtype: precision of the stored embedding matrix, one of EMBEDDING_DTYPES
+        :type embedding_dtype: str
+        """
+        super(self.__class__, self).__init__(language_model, tokenizer)
+        if embedding_dtype not in EMBEDDING_DTYPES:
+            raise ValueError("Invalid embedding type %s, must be one of %s" % (embedding_dtype, EMBEDDING_DTYPES))
         self.max_vocabulary_size = max_vocabulary_size
         self.sequence_length = sequence_length
-        self.vocabulary, self.embedding_matrix = self.initialize_embeddings()
+        self.embedding_dtype = embedding_dtype
+        if texts is None:
+            self.corpus_words = None
+        else:
+            self.corpus_words = self.corpus_vocabulary(texts, min_frequency)
+        self._vocabulary, self._embedding_matrix, self._embedding_scales = self.initialize_embeddings()
         self.vocabulary_size = len(self.vocabulary)
 
+    def configuration(self):
+        configuration = {**super().configuration(), **{"max_vocabulary_size": self.max_vocabulary_size,
+                                                       "sequence_length": self.sequence_length}}
+        if self.corpus_words is not None:
+            configuration["corpus_vocabulary"] = hashlib.sha256(json.dumps(self.corpus_words).encode("utf-8")) \
+                .hexdigest()
+        return configuration
+
+    def corpus_vocabulary(self, texts, min_frequency, batch_size=10000):
+        """
+        The words in a corpus that have vectors, from most to least frequent.
+
+        :param texts: the corpus
+        :type texts: iterable of str or TokenizedTexts
+        :param min_frequency: the minimum number of times a word must appear
+        :type min_frequency: int
+        :param batch_size: number of texts to tokenize at a time, so that the corpus may be streamed
+        :type batch_size: int
+        :return: at most max_vocabulary_size words
+        :rtype: list of str
+        """
+        counts = Counter()
+        if isinstance(texts, TokenizedTexts):
+            batches = [texts.tokens(self.language_model, self.tokenizer)]
+        else:
+            texts = iter(texts)
+            batches = iter(lambda: tokenize(list(islice(texts, batch_size)), self.language_model, self.workers,
+                                            self.tokenizer), [])
+        for token_sequences in batches:
+            for tokens in token_sequences:
+                counts.update(tokens)
+        vocabulary = self.text_parser.vocab
+        words = [word for word, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+                 if count >= min_frequency and word_vector(vocabulary, word) is not None]
+        return words[:self.max_vocabulary_size]
+
+    def oov_statistics(self, texts):
+        """
+        How many of the tokens and distinct words in a set of texts are not in the vocabulary.
+
+        :param texts: texts
+        :type texts: sequence of str or TokenizedTexts
+        :return: counts of tokens, out of vocabulary tokens, types and out of vocabulary types, and the out of
+            vocabulary rates of tokens and types
+        :rtype: dict
+        """
+        if isinstance(texts, TokenizedTexts):
+            token_sequences = texts.tokens(self.language_model, self.tokenizer)
+        else:
+            token_sequences = tokenize(texts, self.language_model, self.workers, self.tokenizer)
+        counts = Counter(chain.from_iterable(token_sequences))
+        vocabulary = self.vocabulary
+        oov = dict((word, count) for word, count in counts.items() if word not in vocabulary)
+        tokens, oov_tokens = sum(counts.values()), sum(oov.values())
+        return {"tokens": tokens, "oov_tokens": oov_tokens, "types": len(counts), "oov_types": len(oov),
+                "oov_token_rate": oov_tokens / tokens if tokens else 0.0,
+                "oov_type_rate": len(oov) / len(counts) if counts else 0.0}
+
+    @property
+    def vocabulary(self):
+        self.build_embeddings()
+        return self._vocabulary
+
+    @property
+    def embedding_matrix(self):
+        """
+        :return: the embedding matrix at its stored precision
+        :rtype: numpy.array
+        """
+        self.build_embeddings()
+        return self._embedding_matrix
+
+    @property
+    def embedding_scales(self):
+        """
+        :return: the scale of each row of an int8 embedding matrix, or None if it is not int8
+        :rtype: numpy.array or None
+        """
+        self.build_embeddings()
+        return self._embedding_scales
+
+    def build_embeddings(self):
+        """
+        Build the vocabulary and embedding matrix if they have been neither built nor loaded yet.
+        """
+        if self._vocabulary is None or self._embedding_matrix is None:
+            self._vocabulary, self._embedding_matrix, self._embedding_scales = self.initialize_embeddings()
+
+    def embedding_weights(self):
+        """
+        :return: float32 copy of the embedding matrix with which to initialize an embedding layer
+        :rtype: numpy.array
+        """
+        return dequantize_embeddings(self.embedding_matrix, self.embedding_scales)
+
     def initialize_embeddings(self):
-        lexemes = sorted((lexeme for lexeme in self.text_parser.vocab if lexeme.has_vector),
-                         key=operator.attrgetter("rank"))[:self.max_vocabulary_size]
+        if self.corpus_words is None:
+            lexemes = sorted((lexeme for lexeme in self.text_parser.vocab if lexeme.has_vector),
+                             key=operator.attrgetter("rank"))[:self.max_vocabulary_size]
+        else:
+            lexemes = [self.text_parser.vocab[word] for word in self.corpus_words]
         vocabulary = {}
-        embedding_matrix = numpy.zeros((len(lexemes) + 1, self.text_parser.vocab.vectors_length))
+        embedding_matrix = numpy.zeros((len(lexemes) + 1, self.text_parser.vocab.vectors_length), dtype="float32")
         for index, lexeme in enumerate(lexemes, 1):
             embedding_matrix[index] = lexeme.vector
             vocabulary[lexeme.orth_] = index
-        return vocabulary, embedding_matrix
+        return (vocabulary,) + quantize_embeddings(embedding_matrix, self.embedding_dtype)
+
+    def save(self, directory):
+        words = [None] * (len(self.vocabulary) + 1)
+        for word, index in self.vocabulary.items():
+            words[index] = word
+        # Write to temporary files and rename them so that a memory-mapped copy of the old files remains valid.
+        vocabulary_filename = os.path.join(directory, self.vocabulary_name)
+        with open(vocabulary_filename + ".tmp", mode="w", encoding="utf-8") as f:
+            json.dump(words[1:], f)
+        os.replace(vocabulary_filename + ".tmp", vocabulary_filename)
+        arrays = [(self.embedding_matrix_name, self.embedding_matrix)]
+        if self.embedding_scales is not None:
+            arrays.append((self.embedding_scales_name, self.embedding_scales))
+        for name, array in arrays:
+            filename = os.path.join(directory, name)
+            with open(filename + ".tmp", mode="wb") as f:
+                numpy.save(f, array)
+            os.replace(filename + ".tmp", filename)
+
+    def load(self, directory):
+        vocabulary_filename = os.path.join(directory, self.vocabulary_name)
+        embedding_matrix_filename = os.path.join(directory, self.embedding_matrix_name)
+        embedding_scales_filename = os.path.join(directory, self.embedding_scales_name)
+        # Models saved by earlier versions do not have these files, so their embeddings are rebuilt when needed.
+        if os.path.isfile(vocabulary_filename) and os.path.isfile(embedding_matrix_filename):
+            with open(vocabulary_filename, encoding="utf-8") as f:
+                self._vocabulary = dict((word, index) for index, word in enumerate(json.load(f), 1))
+            self._embedding_matrix = numpy.load(embedding_matrix_filename, mmap_mode="r")
+            if self.embedding_dtype == "int8":
+                self._embedding_scales = numpy.load(embedding_scales_filename)
 
     def __eq__(self, other):
         return super().__eq__(other) and \
@@ -110,31 +869,64 @@ class TextSequenceEmbedder(Embedder):
 
     def __getstate__(self):
         d = super().__getstate__()
-        del d["vocabulary"]
-        del d["embedding_matrix"]
+        d["_vocabulary"] = None
+        d["_embedding_matrix"] = None
+        d["_embedding_scales"] = None
         return d
 
     def __setstate__(self, d):
+        d.setdefault("_vocabulary", None)
+        d.setdefault("_embedding_matrix", None)
+        d.setdefault("_embedding_scales", None)
+        d.setdefault("corpus_words", None)
+        # Earlier versions stored float64 embeddings, which are converted to float32 when they are rebuilt.
+        d.setdefault("embedding_dtype", "float32")
         super().__setstate__(d)
-        d["vocabulary"], d["embedding_matrix"] = self.initialize_embeddings()
-        self.__dict__.update(d)
 
     def encode(self, texts):
         from keras.preprocessing.sequence import pad_sequences
 
-        token_index_sequences = pad_sequences(
-            list([self.vocabulary.get(token.orth_, 0) for token in document]
-                 for document in self.text_parser.pipe(texts)),
-            maxlen=self.sequence_length)
+        sequences = self.encode_sequences(texts)
+        with span("pad sequences"):
+            token_index_sequences = pad_sequences(sequences, maxlen=self.sequence_length)
         return numpy.array(token_index_sequences)
 
+    def encode_sequences(self, texts):
+        """
+        Encode texts as unpadded sequences of vocabulary indexes. Like encode, this keeps only the last sequence length
+        tokens of longer texts.
+
+        :param texts: texts to encode
+        :type texts: sequence of str or TokenizedTexts
+        :return: vocabulary index sequences
+        :rtype: list of numpy.array
+        """
+        if isinstance(texts, TokenizedTexts):
+            token_sequences = texts.tokens(self.language_model, self.tokenizer)
+        else:
+            token_sequences = tokenize(texts, self.language_model, self.workers, self.tokenizer)
+        vocabulary = self.vocabulary
+        return [numpy.array([vocabulary.get(token, 0) for token in tokens[max(len(tokens) - self.sequence_length, 0):]],
+                            dtype="int32")
+                for tokens in token_sequences]
+
     def embedding_layer_factory(self):
         from keras.layers import Embedding
-        return partial(Embedding, self.vocabulary_size + 1, self.embedding_size, weights=[self.embedding_matrix])
+        return partial(Embedding, self.vocabulary_size + 1, self.embedding_size, weights=[self.embedding_weights()])
 
     def __repr__(self):
-        return "Text sequence embedder: %s, embedding matrix %s" % (
-            self.text_parser.meta["name"], self.embedding_matrix.shape)
+        return "Text sequence embedder: %s, %s tokenizer, embedding matrix %s" % (
+            self.text_parser.meta["name"], self.tokenizer, self.embedding_matrix.shape)
+
+
+vector_table_singletons = {}
+
+
+def vector_table(language_model):
+    global vector_table_singletons
+    if language_model not in vector_table_singletons:
+        vector_table_singletons[language_model] = VectorTable(language_model)
+    return vector_table_singletons[language_model]
 
 
 text_parser_singletons = {}
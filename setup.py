@@ -50,7 +50,7 @@ setup(
     author_email="billmcn@gmail.com",
     description="Text classifier",
     long_description=readme(),
-    install_requires=["cytoolz", "keras", "numpy", "pandas", "scikit-learn", "spacy"],
+    install_requires=["cytoolz", "keras", "numpy", "pandas", "scikit-learn", "scipy", "spacy"],
     cmdclass={
         "develop": PostDevelopCommand,
         "install": PostInstallCommand
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from mycroft.asynchronous import AsyncClassifier
+from test.test_server import LengthClassifier
+
+
+class BlockingClassifier(LengthClassifier):
+    """
+    Length classifier that does not return predictions until it is released.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def predict(self, texts, batch_size=32):
+        self.released.wait()
+        return super().predict(texts, batch_size)
+
+
+class TestAsyncClassifier(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_predict(self):
+        model = LengthClassifier()
+
+        async def predict():
+            async with AsyncClassifier(model, max_wait=0.2) as classifier:
+                self.assertEqual(["long", "short"], classifier.label_names)
+                label_probabilities, label = await classifier.predict_one("a cat")
+                label_probabilities, labels = await classifier.predict_many([])
+                self.assertEqual((0, 2), label_probabilities.shape)
+                self.assertEqual([], labels)
+                self.assertEqual("short", label)
+                self.assertEqual((2,), label_probabilities.shape)
+                results = await asyncio.gather(*[classifier.predict_many(["cat %d" % i, "a long text about a cat"])
+                                                 for i in range(10)])
+                return results, classifier.metrics
+
+        results, metrics = self.run_coroutine(predict())
+        for label_probabilities, labels in results:
+            self.assertEqual((2, 2), label_probabilities.shape)
+            self.assertEqual(["short", "long"], labels)
+        # The concurrent requests were predicted in fewer batches than there were requests.
+        self.assertLess(len(model.calls), 11)
+        self.assertEqual(11, metrics["requests"])
+        self.assertEqual(0, metrics["pending_texts"])
+
+    def test_backpressure(self):
+        model = BlockingClassifier()
+
+        async def predict():
+            classifier = AsyncClassifier(model, max_wait=0, max_pending=4)
+            tasks = [self.loop.create_task(classifier.predict_many(["a", "b"])) for _ in range(4)]
+            await asyncio.sleep(0.05)
+            metrics = classifier.metrics
+            self.assertEqual(4, metrics["pending_texts"])
+            self.assertEqual(2, metrics["waiting_requests"])
+            # A cancelled request gives up its place in the line.
+            tasks[-1].cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(1, classifier.metrics["waiting_requests"])
+            model.released.set()
+            results = await asyncio.gather(*tasks[:-1])
+            self.assertEqual(3, len(results))
+            metrics = classifier.metrics
+            self.assertEqual((0, 0, 4), (metrics["pending_texts"], metrics["waiting_requests"],
+                                         metrics["maximum_pending_texts"]))
+            # A request larger than the limit is accepted when nothing else is pending.
+            _, labels = await classifier.predict_many(["a"] * 10)
+            self.assertEqual(10, len(labels))
+            await classifier.close()
+
+        self.run_coroutine(predict())
+
+    def test_reject(self):
+        model = BlockingClassifier()
+
+        async def predict():
+            classifier = AsyncClassifier(model, max_wait=0, max_pending=2, reject=True)
+            task = self.loop.create_task(classifier.predict_many(["a", "b"]))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(asyncio.QueueFull):
+                await classifier.predict_one("c")
+            self.assertEqual(1, classifier.metrics["rejected_requests"])
+            model.released.set()
+            await task
+            await classifier.close()
+
+        self.run_coroutine(predict())
+
+    def test_model_error(self):
+        async def predict():
+            async with AsyncClassifier(LengthClassifier()) as classifier:
+                with self.assertRaises(TypeError):
+                    await classifier.predict_one(None)
+                return classifier.metrics["pending_texts"]
+
+        self.assertEqual(0, self.run_coroutine(predict()))
+
+    def test_closed(self):
+        async def predict():
+            classifier = AsyncClassifier(LengthClassifier())
+            await classifier.close()
+            with self.assertRaises(RuntimeError):
+                await classifier.predict_one("a cat")
+            return classifier.metrics["pending_texts"]
+
+        self.assertEqual(0, self.run_coroutine(predict()))
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks import Measurement, compare_results, load_results, save_results, synthetic_corpus
+
+
+class TestBenchmarks(TestCase):
+    def test_synthetic_corpus(self):
+        texts, labels, label_names = synthetic_corpus(50, seed=1, minimum_length=3, maximum_length=7)
+        self.assertEqual(50, len(texts))
+        self.assertEqual(50, len(labels))
+        self.assertEqual(["Joyce", "Kafka"], label_names)
+        self.assertTrue(set(labels).issubset(label_names))
+        self.assertTrue(all(3 <= len(text.split()) <= 7 for text in texts))
+        self.assertEqual((texts, labels, label_names), synthetic_corpus(50, seed=1, minimum_length=3, maximum_length=7))
+
+    def test_compare_results(self):
+        baseline = {"encode/1000": Measurement(100.0, "texts/s", True), "load/1000": Measurement(2.0, "s", False),
+                    "removed/1000": Measurement(1.0, "s", False)}
+        results = {"encode/1000": Measurement(80.0, "texts/s", True), "load/1000": Measurement(1.0, "s", False),
+                   "added/1000": Measurement(1.0, "s", False)}
+        comparisons = compare_results(results, baseline, tolerance=0.1)
+        self.assertEqual(["encode/1000", "load/1000"], [comparison[0] for comparison in comparisons])
+        name, previous, current, change, regression = comparisons[0]
+        self.assertEqual((100.0, 80.0, True), (previous, current, regression))
+        self.assertAlmostEqual(-0.2, change)
+        name, previous, current, change, regression = comparisons[1]
+        self.assertAlmostEqual(1.0, change)
+        self.assertFalse(regression)
+
+    def test_save_and_load_results(self):
+        results = {"predict/bow/batch-32/1000": Measurement(5000.0, "texts/s", True)}
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "results.json")
+        try:
+            save_results(filename, results)
+            loaded = load_results(filename)
+        finally:
+            os.remove(filename)
+            os.rmdir(directory)
+        self.assertEqual(["predict/bow/batch-32/1000"], list(loaded))
+        self.assertEqual(results["predict/bow/batch-32/1000"].as_dict(), loaded["predict/bow/batch-32/1000"].as_dict())
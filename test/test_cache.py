@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from numpy.testing import assert_array_equal
+
+from mycroft.cache import EncodingCache
+
+
+class CountingEmbedder:
+    def __init__(self, sequence_length):
+        self.sequence_length = sequence_length
+        self.calls = 0
+
+    def configuration(self):
+        return {"embedder": "counting", "sequence_length": self.sequence_length}
+
+    def encode(self, texts):
+        self.calls += 1
+        return numpy.array([[len(text)] * self.sequence_length for text in texts], dtype="int32")
+
+
+class TestEncodingCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.texts = ["The quick brown fox", "jumped over the lazy dog."]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cache_hit(self):
+        cache = EncodingCache(self.directory)
+        embedder = CountingEmbedder(5)
+        encoding_1 = cache.encode(embedder, self.texts)
+        encoding_2 = cache.encode(embedder, self.texts)
+        self.assertEqual(1, embedder.calls)
+        assert_array_equal(encoding_1, encoding_2)
+        self.assertEqual(numpy.dtype("int32"), encoding_2.dtype)
+
+    def test_key(self):
+        key = EncodingCache.key({"sequence_length": 5}, self.texts)
+        self.assertEqual(key, EncodingCache.key({"sequence_length": 5}, list(self.texts)))
+        self.assertNotEqual(key, EncodingCache.key({"sequence_length": 6}, self.texts))
+        self.assertNotEqual(key, EncodingCache.key({"sequence_length": 5}, self.texts[:1]))
+        self.assertNotEqual(EncodingCache.key({}, ["ab", "c"]), EncodingCache.key({}, ["a", "bc"]))
+
+    def test_configuration_change(self):
+        cache = EncodingCache(self.directory)
+        embedder_1 = CountingEmbedder(5)
+        embedder_2 = CountingEmbedder(7)
+        self.assertEqual((2, 5), cache.encode(embedder_1, self.texts).shape)
+        self.assertEqual((2, 7), cache.encode(embedder_2, self.texts).shape)
+        self.assertEqual(1, embedder_2.calls)
+
+    def test_eviction(self):
+        embedder = CountingEmbedder(1000)
+        cache = EncodingCache(self.directory, maximum_size=1)
+        cache.put("a", numpy.zeros(1000))
+        self.assertEqual(0, cache.size)
+        cache = EncodingCache(self.directory, maximum_size=10000)
+        cache.encode(embedder, ["one"])
+        cache.encode(embedder, ["two"])
+        cache.encode(embedder, ["three"])
+        self.assertLessEqual(cache.size, 10000)
+        cache.encode(embedder, ["three"])
+        self.assertEqual(3, embedder.calls)
@@ -1,7 +1,11 @@
+import json
 import os
+import re
 import shutil
+import subprocess
+import sys
 import tempfile
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 import pandas
 
@@ -37,12 +41,110 @@ class TestConsole(TestCase):
         self.assertIsInstance(model, BagOfWordsClassifier)
         self.run_command("predict %s %s" % (self.model_directory, self.data_filename))
         self.run_command("evaluate %s %s" % (self.model_directory, self.data_filename))
+        with self.assertRaises(SystemExit):
+            self.run_command("predict %s %s --bucket" % (self.model_directory, self.data_filename))
+        with self.assertRaises(SystemExit):
+            self.run_command("evaluate %s %s --embedding-dtypes int8" % (self.model_directory, self.data_filename))
+
+    def test_chunked_predict(self):
+        self.run_command(
+            "train bow %s --save-model %s --logging none" % (self.data_filename, self.model_directory))
+        output_filename = os.path.join(self.directory, "predictions.csv")
+        self.run_command("predict %s %s --chunk-size 7 --output %s" % (
+            self.model_directory, self.data_filename, output_filename))
+        predictions = pandas.read_csv(output_filename)
+        self.assertEqual(len(pandas.read_csv(self.data_filename)), len(predictions))
+        self.assertEqual(["Joyce", "Kafka", "predicted label"], list(predictions.columns)[-3:])
+
+    def test_profile(self):
+        profile_filename = os.path.join(self.directory, "profile.json")
+        self.run_command("train bow %s --save-model %s --logging none --epochs 2 --profile %s" % (
+            self.data_filename, self.model_directory, profile_filename))
+        with open(profile_filename) as f:
+            profile = json.load(f)
+        spans = [s["name"] for s in profile["spans"]]
+        for name in ["read data", "encode", "fit", "save"]:
+            self.assertIn(name, spans)
+        self.assertEqual([1, 2], [epoch["epoch"] for epoch in profile["epochs"]])
+        self.run_command("predict %s %s --output %s --profile %s" % (
+            self.model_directory, self.data_filename, os.path.join(self.directory, "predictions.csv"),
+            profile_filename))
+        with open(profile_filename) as f:
+            spans = [s["name"] for s in json.load(f)["spans"]]
+        for name in ["load model", "read data", "encode", "predict", "write predictions"]:
+            self.assertIn(name, spans)
+
+    def test_tune(self):
+        tuning_directory = os.path.join(self.directory, "tuning")
+        self.run_command("tune conv %s --validation-fraction 0.2 --epochs 2 --search dropout 0.2 0.5 "
+                         "--search filters 10 20 --workers 2 --output %s" % (self.data_filename, tuning_directory))
+        with open(os.path.join(tuning_directory, "leaderboard.json")) as f:
+            leaderboard = json.load(f)
+        self.assertEqual([1, 2, 3, 4], [result["rank"] for result in leaderboard])
+        for result in leaderboard:
+            self.assertIsNone(result["error"])
+            self.assertTrue(os.path.isfile(os.path.join(tuning_directory, result["name"], "history.json")))
+        self.run_command("tune bow %s --validation-fraction 0.2 --search learning_rate log-uniform:0.0001:0.01 "
+                         "--schedule halving --trials 4 --eta 2 --epochs 2 --output %s" % (
+                             self.data_filename, tuning_directory))
+        self.assertTrue(os.path.isdir(os.path.join(tuning_directory, "rung-2")))
+
+    def test_crossval(self):
+        output_filename = os.path.join(self.directory, "crossval.json")
+        self.run_command("crossval 3 conv %s --epochs 2 --workers 3 --save-model %s --output %s" % (
+            self.data_filename, self.model_directory, output_filename))
+        with open(output_filename) as f:
+            results = json.load(f)
+        self.assertEqual([1, 2, 3], [fold["fold"] for fold in results["folds"]])
+        self.assertEqual([None, None, None], [fold["error"] for fold in results["folds"]])
+        self.assertEqual(len(pandas.read_csv(self.data_filename)), sum(fold["test_size"] for fold in results["folds"]))
+        self.assertEqual({"acc", "loss"}, set(results["summary"]))
+        self.assertIsInstance(load_embedding_model(self.model_directory), ConvolutionNetClassifier)
 
     def test_conv(self):
         self.run_command("train conv %s --save-model %s --logging none" % (self.data_filename, self.model_directory))
         model = load_embedding_model(self.model_directory)
         self.assertIsInstance(model, ConvolutionNetClassifier)
 
+    def test_embedding_dtypes(self):
+        self.run_command("train conv %s --save-model %s --logging none --epochs 2 --corpus-vocabulary "
+                         "--embedding-dtype int8" % (self.data_filename, self.model_directory))
+        self.assertTrue(os.path.isfile(os.path.join(self.model_directory, "embedding_scales.npy")))
+        model = load_embedding_model(self.model_directory)
+        self.assertEqual("int8", model.embedder.embedding_matrix.dtype)
+        self.run_command("evaluate %s %s --embedding-dtypes float16 int8" % (self.model_directory, self.data_filename))
+
+    def test_streaming(self):
+        self.run_command("train conv %s --save-model %s --logging none --chunk-size 10 --validation-data %s" % (
+            self.data_filename, self.model_directory, self.data_filename))
+        model = load_embedding_model(self.model_directory)
+        self.assertIsInstance(model, ConvolutionNetClassifier)
+        self.assertEqual(["Joyce", "Kafka"], model.label_names)
+
+    def test_sampled_training(self):
+        self.run_command("train bow %s --save-model %s --logging none --sample-size 20 --stratify --sample-seed 0" % (
+            self.data_filename, self.model_directory))
+        self.assertEqual(["Joyce", "Kafka"], load_embedding_model(self.model_directory).label_names)
+        self.run_command("train conv %s --save-model %s --logging none --chunk-size 10 --sample-fraction 0.5 "
+                         "--omit-labels Kafka" % (self.data_filename, self.model_directory))
+        self.assertEqual(["Joyce"], load_embedding_model(self.model_directory).label_names)
+
+    def test_continued_training(self):
+        self.run_command("train bow %s --save-model %s --logging none --epochs 2 --validation-data %s" % (
+            self.data_filename, self.model_directory, self.data_filename))
+        self.run_command("train load %s --load-model %s --logging none --epochs 3 --validation-data %s --resume" % (
+            self.data_filename, self.model_directory, self.data_filename))
+        with open(os.path.join(self.model_directory, "training_state.json")) as f:
+            self.assertEqual(3, json.load(f)["epoch"])
+        data = pandas.read_csv(self.data_filename)
+        data[:10].to_csv(self.data_filename, mode="a", header=False, index=False)
+        self.run_command("train load %s --load-model %s --logging none --epochs 1 --validation-data %s --incremental" %
+                         (self.data_filename, self.model_directory, self.data_filename))
+        with open(os.path.join(self.model_directory, "training_state.json")) as f:
+            state = json.load(f)
+        self.assertEqual(4, state["epoch"])
+        self.assertEqual(len(data) + 10, state["rows"][os.path.abspath(self.data_filename)])
+
     def test_non_default_sequence_length(self):
         self.run_command("train conv %s --save-model %s --logging none --sequence-length 17" % (
             self.data_filename, self.model_directory))
@@ -69,3 +171,54 @@ class TestConsole(TestCase):
     @staticmethod
     def run_command(s):
         return default_main(s.split())
+
+
+@skipIf(sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+class TestStartup(TestCase):
+    """
+    Commands that do not touch data or models should not import the numerical and machine learning libraries.
+    """
+    HEAVY_MODULES = {"numpy", "pandas", "sklearn", "keras", "tensorflow", "spacy"}
+
+    def test_version(self):
+        self.assert_light("--version")
+
+    def test_help(self):
+        self.assert_light("--help")
+        self.assert_light("train bow --help")
+        self.assert_light("predict --help")
+        self.assert_light("tune rnn --help")
+
+    def test_argument_error(self):
+        self.assert_light("train bow data.csv --validation-fraction 0.2 --validation-data validation.csv")
+        self.assert_light("train bow data.csv --stratify")
+        self.assert_light("train rnn data.csv --workers 2 --bucket")
+        self.assert_light("train conv data.csv --bucket")
+        self.assert_light("tune bow data.csv --validation-fraction 0.2 --search foo 1")
+        self.assert_light("tune rnn data.csv --validation-fraction 0.2 --schedule grid --search dropout uniform:0:1")
+
+    def assert_light(self, command):
+        imports = self.imports(command)
+        slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:5]
+        self.assertEqual(set(), self.HEAVY_MODULES.intersection(imports), "%s imported heavy modules, slowest: %s" % (
+            command, ", ".join("%s %0.1fms" % (name, t / 1000) for name, t in slowest)))
+
+    @staticmethod
+    def imports(command):
+        """
+        :return: top level module names imported by the command and their cumulative import times in microseconds
+        :rtype: dict of str to int
+        """
+        code = "from mycroft.console import default_main; default_main(%r.split())" % command
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True,
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        # Argument errors exit with status 2.
+        assert process.returncode in [0, 2], process.stderr
+        imports = {}
+        for line in process.stderr.splitlines():
+            match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", line)
+            if match:
+                name = match.group(2).split(".")[0]
+                imports[name] = max(imports.get(name, 0), int(match.group(1)))
+        return imports
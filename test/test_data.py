@@ -0,0 +1,240 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+
+import numpy
+import pandas
+from numpy.testing import assert_array_equal
+
+from mycroft.data import Dataset, LabeledDataStream, Sampler, allocate, data_format, iterate_data_files, \
+    label_filter, read_data_files, sniff_delimiter
+from test import to_lines
+
+
+class TestData(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        joyce_samples = to_lines("joyce.txt")
+        joyce = pandas.DataFrame({"text": joyce_samples, "label": ["Joyce"] * len(joyce_samples)})
+        kafka_samples = to_lines("kafka.txt")
+        kafka = pandas.DataFrame({"text": kafka_samples, "label": ["Kafka"] * len(kafka_samples)})
+        self.data = pandas.concat([joyce, kafka])
+        self.data_filename = os.path.join(self.directory, "data.csv")
+        self.data.to_csv(self.data_filename, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iterate_data_files(self):
+        chunks = list(iterate_data_files([self.data_filename], 10))
+        self.assertEqual(len(self.data), sum(len(chunk) for chunk in chunks))
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        chunks = list(iterate_data_files([self.data_filename, self.data_filename], 10, limit=len(self.data) + 5))
+        self.assertEqual(len(self.data) + 5, sum(len(chunk) for chunk in chunks))
+
+    def test_sniff_delimiter(self):
+        self.assertEqual(",", sniff_delimiter(self.data_filename))
+        for delimiter, name in [("\t", "data.tsv"), (";", "data.txt"), ("\t", "data.tsv.gz")]:
+            filename = os.path.join(self.directory, name)
+            self.data.to_csv(filename, sep=delimiter, index=False)
+            self.assertEqual(delimiter, sniff_delimiter(filename))
+            self.assertEqual(list(self.data["text"]), list(read_data_files([filename])["text"]))
+
+    def test_read_data_files(self):
+        self.data.loc[len(self.data)] = ["Missing label", None]
+        self.data["other"] = None
+        self.data.to_csv(self.data_filename, index=False)
+        data = read_data_files([self.data_filename, self.data_filename], columns=["text", "label"])
+        self.assertEqual(["text", "label"], list(data.columns))
+        self.assertEqual(2 * (len(self.data) - 1), len(data))
+        self.assertEqual(0, len(read_data_files([self.data_filename])))
+        data = read_data_files([self.data_filename, self.data_filename], limit=len(self.data) + 5,
+                               columns=["label", "text"])
+        self.assertEqual(len(self.data) + 5, len(data))
+
+    def test_json_lines(self):
+        filename = os.path.join(self.directory, "data.jsonl")
+        self.data.to_json(filename, orient="records", lines=True)
+        self.assertEqual("jsonl", data_format(filename))
+        data = read_data_files([filename], columns=["text"])
+        self.assertEqual(["text"], list(data.columns))
+        assert_array_equal(self.data["text"], data["text"])
+        chunks = list(iterate_data_files([filename], 10, columns=["text", "label"]))
+        self.assertEqual(len(self.data), sum(len(chunk) for chunk in chunks))
+        with self.assertRaises(ValueError):
+            read_data_files([filename], columns=["body"])
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "Parquet and Feather files require pyarrow")
+    def test_columnar_formats(self):
+        data = self.data.reset_index(drop=True)
+        for name, write in [("data.parquet", data.to_parquet), ("data.feather", data.to_feather)]:
+            filename = os.path.join(self.directory, name)
+            write(filename)
+            assert_array_equal(data["label"], read_data_files([filename], columns=["label"])["label"])
+            chunks = list(iterate_data_files([filename], 10, columns=["text"]))
+            self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+            self.assertEqual(list(data["text"]), [text for chunk in chunks for text in chunk["text"]])
+
+    def test_label_filter(self):
+        self.assertIsNone(label_filter("label"))
+        kafka = len(to_lines("kafka.txt"))
+        data = read_data_files([self.data_filename, self.data_filename], keep=label_filter("label", ["Joyce"]))
+        self.assertEqual(["Kafka"], list(data["label"].unique()))
+        self.assertEqual(2 * kafka, len(data))
+        # The limit counts the rows that are kept.
+        data = read_data_files([self.data_filename], limit=kafka - 1, keep=label_filter("label", ["Joyce"]))
+        self.assertEqual(["Kafka"] * (kafka - 1), list(data["label"]))
+        self.assertEqual(0, len(read_data_files([self.data_filename], keep=label_filter("label", None, ["Tolstoy"]))))
+
+    def test_sample_fraction(self):
+        data = read_data_files([self.data_filename], sampler=Sampler(fraction=0.5, seed=0))
+        self.assertLess(0, len(data))
+        self.assertLess(len(data), len(self.data))
+        # Sampled rows are in reading order.
+        texts = list(self.data["text"])
+        self.assertEqual(sorted(texts.index(text) for text in data["text"]),
+                         [texts.index(text) for text in data["text"]])
+        self.assertEqual(list(data["text"]),
+                         list(read_data_files([self.data_filename], sampler=Sampler(fraction=0.5, seed=0))["text"]))
+        self.assertEqual(len(self.data), len(read_data_files([self.data_filename], sampler=Sampler(fraction=1))))
+        self.assertEqual(3, len(read_data_files([self.data_filename], limit=3, sampler=Sampler(fraction=0.5))))
+
+    def test_sample_size(self):
+        for chunk_size in [1, 7, 1000]:
+            chunks = list(iterate_data_files([self.data_filename], chunk_size, sampler=Sampler(size=10, seed=0)))
+            self.assertTrue(all(len(chunk) <= chunk_size for chunk in chunks))
+            data = pandas.concat(chunks)
+            self.assertEqual(10, len(data))
+            self.assertEqual(10, len(set(data["text"])))
+            self.assertTrue(set(data["text"]).issubset(self.data["text"]))
+        sampler = Sampler(size=2 * len(self.data), seed=0)
+        self.assertEqual(list(self.data["text"]), list(read_data_files([self.data_filename], sampler=sampler)["text"]))
+        # Rows at the start and end of the data are equally likely to be sampled.
+        counts = numpy.zeros(len(self.data))
+        for seed in range(200):
+            data = read_data_files([self.data_filename], sampler=Sampler(size=5, seed=seed))
+            counts[data.index] += 1
+        half = len(self.data) // 2
+        self.assertLess(abs(counts[:half].sum() - counts[-half:].sum()), 0.2 * counts.sum())
+
+    def test_stratified_sample(self):
+        data = pandas.DataFrame({"text": ["text %d" % i for i in range(100)], "label": ["a"] * 90 + ["b"] * 10})
+        data.to_csv(self.data_filename, index=False)
+        for chunk_size in [3, 100]:
+            sample = pandas.concat(iterate_data_files([self.data_filename], chunk_size,
+                                                      sampler=Sampler(size=10, stratify="label", seed=0)))
+            self.assertEqual(["a"] * 9 + ["b"], list(sample["label"]))
+        sample = read_data_files([self.data_filename], sampler=Sampler(size=1000, stratify="label", seed=0))
+        self.assertEqual(100, len(sample))
+        self.assertEqual({"a": 2, "b": 1, "c": 0}, allocate(3, {"a": 5, "b": 4, "c": 1}))
+        for arguments in [{}, {"size": 10, "fraction": 0.5}, {"size": 0}, {"fraction": 1.5},
+                          {"fraction": 0.5, "stratify": "label"}]:
+            with self.assertRaises(ValueError):
+                Sampler(**arguments)
+
+    def test_labeled_data_stream_sample(self):
+        data = LabeledDataStream([self.data_filename], 7, "text", "label", sampler=Sampler(size=20, seed=0))
+        self.assertEqual(20, len(data))
+        self.assertEqual(list(data.texts), list(data.texts))
+        data = LabeledDataStream([self.data_filename], 7, "text", "label", limit=5, omit_labels=["Kafka"])
+        self.assertEqual(5, len(data))
+        self.assertEqual(["Joyce"], data.label_names)
+
+    def test_offsets(self):
+        offsets = {}
+        self.assertEqual(len(self.data), len(read_data_files([self.data_filename], offsets=offsets)))
+        self.assertEqual({self.data_filename: len(self.data)}, offsets)
+        new_data = pandas.DataFrame({"text": ["new text %d" % i for i in range(12)], "label": ["Joyce"] * 12})
+        new_data.to_csv(self.data_filename, mode="a", header=False, index=False)
+        self.assertEqual(list(new_data["text"]),
+                         list(read_data_files([self.data_filename], offsets=dict(offsets))["text"]))
+        chunks = list(iterate_data_files([self.data_filename], 5, offsets=offsets))
+        self.assertEqual(list(new_data["text"]), [text for chunk in chunks for text in chunk["text"]])
+        self.assertEqual({self.data_filename: len(self.data) + 12}, offsets)
+        self.assertEqual(0, len(read_data_files([self.data_filename], offsets=offsets)))
+        # A limit that stops reading before the end of a file leaves its offset unchanged.
+        offsets = {self.data_filename: len(self.data)}
+        self.assertEqual(3, len(read_data_files([self.data_filename], limit=3, offsets=offsets)))
+        self.assertEqual({self.data_filename: len(self.data)}, offsets)
+        data = LabeledDataStream([self.data_filename], 7, "text", "label",
+                                 offsets={self.data_filename: len(self.data)})
+        self.assertEqual(12, len(data))
+        self.assertEqual(list(new_data["text"]), list(data.texts))
+        self.assertEqual({self.data_filename: len(self.data) + 12}, data.offsets)
+
+    def test_labeled_data_stream(self):
+        data = LabeledDataStream([self.data_filename], 7, "text", "label")
+        self.assertEqual(len(self.data), len(data))
+        self.assertEqual(["Joyce", "Kafka"], data.label_names)
+        self.assertEqual(list(self.data["text"]), list(data.texts))
+        self.assertEqual(list(self.data["text"]), list(data.texts))
+
+    def test_labeled_data_stream_omit_labels(self):
+        data = LabeledDataStream([self.data_filename], 7, "text", "label", omit_labels=["Joyce"])
+        self.assertEqual(["Kafka"], data.label_names)
+        self.assertEqual(len(to_lines("kafka.txt")), len(data))
+        data = LabeledDataStream([self.data_filename], 7, "text", "label", label_names=["Joyce"])
+        self.assertEqual(len(to_lines("joyce.txt")), len(data))
+
+
+class TestDataset(TestCase):
+    def test_from_labels(self):
+        data = Dataset.from_labels(["one", "two", "three"], ["b", "a", "b"])
+        self.assertEqual(3, len(data))
+        self.assertEqual(["a", "b"], data.label_names)
+        assert_array_equal([1, 0, 1], data.label_codes)
+        assert_array_equal(["b", "a", "b"], data.labels)
+        texts, labels, label_names = data
+        self.assertEqual(["one", "two", "three"], texts)
+        self.assertEqual(["a", "b"], label_names)
+
+    def test_label_names(self):
+        data = Dataset.from_labels(["one", "two"], ["b", "b"], ["a", "b", "c"])
+        assert_array_equal([1, 1], data.label_codes)
+        with self.assertRaises(ValueError):
+            Dataset.from_labels(["one", "two"], ["b", "d"], ["a", "b", "c"])
+        with self.assertRaises(ValueError):
+            Dataset(["one", "two"], [0, 3], ["a", "b", "c"])
+
+    def test_unlabeled(self):
+        data = Dataset(["one", "two"])
+        self.assertIsNone(data.labels)
+        self.assertEqual("Data set: 2 texts", str(data))
+
+    def test_encode(self):
+        class Embedder:
+            def __init__(self, size):
+                self.size = size
+
+            def configuration(self):
+                return {"size": self.size}
+
+        calls = []
+
+        def encode(texts):
+            calls.append(texts)
+            return numpy.zeros((len(texts), 4))
+
+        data = Dataset(["one", "two"])
+        self.assertIs(data.encode(Embedder(4), encode), data.encode(Embedder(4), encode))
+        data.encode(Embedder(5), encode)
+        self.assertEqual(2, len(calls))
+
+    def test_subset(self):
+        class Embedder:
+            @staticmethod
+            def configuration():
+                return {"size": 2}
+
+        data = Dataset.from_labels(pandas.Series(["one", "two", "three"], index=[10, 20, 30]), ["b", "a", "b"])
+        encoding = numpy.arange(6).reshape((3, 2))
+        data.add_encoding(Embedder(), encoding)
+        subset = data.subset([2, 0])
+        self.assertEqual(["three", "one"], list(subset.texts))
+        assert_array_equal([1, 1], subset.label_codes)
+        self.assertEqual(["a", "b"], subset.label_names)
+        assert_array_equal(encoding[[2, 0]], subset.encode(Embedder(), None))
+        with self.assertRaises(ValueError):
+            data.add_encoding(Embedder(), encoding[:2])
@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from numpy.testing import assert_allclose, assert_array_equal
+
+from mycroft.inference import Bidirectional, Conv1D, Embedding, GRU, InferenceModel, LSTM, MaxPooling1D, \
+    is_exported_model, softmax
+
+
+class TestLayers(TestCase):
+    def setUp(self):
+        self.random = numpy.random.RandomState(0)
+
+    def test_conv1d(self):
+        x = self.random.normal(size=(2, 7, 3))
+        kernel = self.random.normal(size=(3, 3, 4))
+        bias = self.random.normal(size=4)
+        y, mask = Conv1D({"activation": "linear", "padding": "valid", "strides": [1]}, [kernel, bias])(x, None)
+        self.assertIsNone(mask)
+        self.assertEqual((2, 5, 4), y.shape)
+        for t in range(5):
+            assert_allclose(numpy.einsum("bki,kio->bo", x[:, t:t + 3], kernel) + bias, y[:, t])
+        y, _ = Conv1D({"activation": "relu", "padding": "same", "strides": [2]}, [kernel, bias])(x, None)
+        self.assertEqual((2, 4, 4), y.shape)
+        self.assertGreaterEqual(y.min(), 0)
+
+    def test_max_pooling1d(self):
+        x = numpy.arange(2 * 9 * 2).reshape((2, 9, 2))
+        y, _ = MaxPooling1D({"pool_size": [4], "strides": [4], "padding": "valid"}, [])(x, None)
+        assert_array_equal(x[:, [3, 7]], y)
+
+    def test_embedding_mask(self):
+        weights = self.random.normal(size=(5, 2))
+        y, mask = Embedding({"mask_zero": True, "input_length": None}, [weights])(numpy.array([[0, 0, 3]]), None)
+        assert_array_equal(weights[[0, 0, 3]], y[0])
+        assert_array_equal([[False, False, True]], mask)
+
+    def test_quantized_embedding(self):
+        from mycroft.text import dequantize_embeddings, quantize_embeddings
+
+        weights = self.random.normal(size=(5, 2)).astype("float32")
+        x = numpy.array([[0, 4, 3]])
+        for dtype in ["float16", "int8"]:
+            matrix, scales = quantize_embeddings(weights, dtype)
+            y, _ = Embedding({"input_length": None}, [matrix] if scales is None else [matrix, scales])(x, None)
+            self.assertEqual(numpy.dtype("float32"), y.dtype)
+            assert_allclose(dequantize_embeddings(matrix, scales)[x], y, rtol=1e-6)
+
+    def test_masked_recurrent_layers(self):
+        # Masked padding at the start of a sequence does not change the output of a recurrent layer.
+        x = self.random.normal(size=(1, 4, 3))
+        padded = numpy.concatenate([numpy.zeros((1, 2, 3)), x], axis=1)
+        mask = numpy.array([[False, False, True, True, True, True]])
+        for layer_class, gates in [(GRU, 3), (LSTM, 4)]:
+            weights = [self.random.normal(size=(3, gates * 5)), self.random.normal(size=(5, gates * 5)),
+                       self.random.normal(size=gates * 5)]
+            layer = layer_class({"units": 5, "activation": "tanh", "recurrent_activation": "hard_sigmoid"}, weights)
+            y, output_mask = layer(x, None)
+            self.assertEqual((1, 5), y.shape)
+            self.assertIsNone(output_mask)
+            assert_allclose(y, layer(padded, mask)[0])
+            sequences = layer_class({"units": 5, "return_sequences": True}, weights)
+            y_sequences, output_mask = sequences(padded, mask)
+            self.assertEqual((1, 6, 5), y_sequences.shape)
+            assert_array_equal(mask, output_mask)
+            assert_allclose(y, y_sequences[:, -1])
+
+    def test_bidirectional(self):
+        x = self.random.normal(size=(2, 4, 3))
+        weights = [self.random.normal(size=(3, 15)), self.random.normal(size=(5, 15)), self.random.normal(size=15)]
+        backward_weights = [self.random.normal(size=w.shape) for w in weights]
+        config = {"layer": {"class_name": "GRU", "config": {"units": 5, "return_sequences": True}},
+                  "merge_mode": "concat"}
+        y, _ = Bidirectional(config, weights + backward_weights)(x, None)
+        self.assertEqual((2, 4, 10), y.shape)
+        assert_allclose(GRU({"units": 5, "return_sequences": True}, weights)(x, None)[0], y[:, :, :5])
+        backward = GRU({"units": 5, "return_sequences": True}, backward_weights)(x[:, ::-1], None)[0]
+        assert_allclose(backward[:, ::-1], y[:, :, 5:])
+
+    def test_softmax(self):
+        p = softmax(self.random.normal(size=(3, 4)))
+        assert_allclose(numpy.ones(3), p.sum(axis=1))
+
+
+class TestInferenceModel(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_exported_sequence_model(self):
+        # Write by hand what export_model writes for a small RNN model that uses the regex tokenizer.
+        random = numpy.random.RandomState(0)
+        weights = {"0.0": random.normal(size=(4, 3)), "1.0": random.normal(size=(3, 6)),
+                   "1.1": random.normal(size=(2, 6)), "1.2": random.normal(size=6),
+                   "3.0": random.normal(size=(2, 2)), "3.1": random.normal(size=2)}
+        layers = [{"class_name": "Embedding", "config": {"input_length": None, "mask_zero": True}, "weights": ["0.0"]},
+                  {"class_name": "GRU", "config": {"units": 2}, "weights": ["1.0", "1.1", "1.2"]},
+                  {"class_name": "Dropout", "config": {"rate": 0.5}, "weights": []},
+                  {"class_name": "Dense", "config": {"activation": "softmax"}, "weights": ["3.0", "3.1"]}]
+        metadata = {"format_version": 1, "model": "RNNClassifier", "label_names": ["Joyce", "Kafka"],
+                    "language_model": "en", "tokenizer": "regex", "embedder": "sequence", "sequence_length": 3,
+                    "layers": layers}
+        with open(os.path.join(self.directory, "model.json"), "w") as f:
+            json.dump(metadata, f)
+        with open(os.path.join(self.directory, "vocabulary.json"), "w") as f:
+            json.dump(["the", "cat", "sat"], f)
+        numpy.savez(os.path.join(self.directory, "weights.npz"), **weights)
+        self.assertTrue(is_exported_model(self.directory))
+        model = InferenceModel(self.directory)
+        self.assertEqual(["Joyce", "Kafka"], model.label_names)
+        encodings = model.encode(["the cat sat down", "", "a dog"])
+        assert_array_equal([2, 3, 0], encodings[0])
+        self.assertEqual(0, len(encodings[1]))
+        assert_array_equal([[2, 3, 0], [0, 0, 0], [0, 0, 0]], model.batch(encodings))
+        label_probabilities, predicted_labels = model.predict(["the cat sat down", "the cat", "", "a dog"],
+                                                              batch_size=3)
+        self.assertEqual((4, 2), label_probabilities.shape)
+        assert_allclose(numpy.ones(4), label_probabilities.sum(axis=1), rtol=1e-6)
+        # Leading unknown words and padding are masked, so these all have the output of an empty sequence.
+        assert_allclose(label_probabilities[2], label_probabilities[3], rtol=1e-6)
+        self.assertTrue(set(predicted_labels).issubset({"Joyce", "Kafka"}))
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        from test.test_model import TestModel
+
+        self.directory = tempfile.mkdtemp()
+        self.texts, self.labels, self.label_names = TestModel.create_data_set()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export(self):
+        from mycroft.inference import export_model
+        from mycroft.model import BagOfWordsClassifier, ConvolutionNetClassifier, RNNClassifier
+
+        training = (self.texts, self.labels, self.label_names)
+        models = [BagOfWordsClassifier(training),
+                  ConvolutionNetClassifier(training, sequence_length=50, vocabulary_size=20000),
+                  RNNClassifier(training, sequence_length=50, vocabulary_size=20000, rnn_units=(8, 8)),
+                  RNNClassifier(training, sequence_length=50, vocabulary_size=20000, rnn_type="lstm",
+                                bidirectional=True, tokenizer="regex"),
+                  ConvolutionNetClassifier(training, sequence_length=50, vocabulary_size=20000, embedding_dtype="int8")]
+        for model in models:
+            model.train(self.texts, self.labels, epochs=1, batch_size=10, verbose=0)
+            export_model(model, self.directory)
+            exported = InferenceModel(self.directory)
+            self.assertEqual(model.label_names, exported.label_names)
+            label_probabilities, predicted_labels = model.predict(self.texts)
+            exported_probabilities, exported_labels = exported.predict(self.texts, batch_size=7)
+            assert_allclose(label_probabilities, exported_probabilities, rtol=1e-4, atol=1e-5)
+            self.assertEqual(predicted_labels, exported_labels)
+        # The embeddings of the int8 model are exported at that precision.
+        with numpy.load(os.path.join(self.directory, "weights.npz")) as weights:
+            self.assertEqual(numpy.dtype("int8"), weights["0.0"].dtype)
+
+    def test_gru_reset_after(self):
+        from keras.layers import GRU as KerasGRU
+        from keras.models import Sequential
+
+        x = numpy.random.RandomState(0).normal(size=(2, 4, 3)).astype("float32")
+        for reset_after in [False, True]:
+            model = Sequential()
+            model.add(KerasGRU(5, input_shape=(4, 3), reset_after=reset_after, bias_initializer="uniform"))
+            layer = model.layers[0]
+            y, _ = GRU(layer.get_config(), layer.get_weights())(x, None)
+            assert_allclose(model.predict(x), y, rtol=1e-4, atol=1e-5)
+
+    def test_unsupported_recurrent_options(self):
+        from keras.layers import LSTM as KerasLSTM
+        from keras.models import Sequential
+        from mycroft.inference import check_recurrent_options
+
+        model = Sequential()
+        model.add(KerasLSTM(5, batch_input_shape=(1, 4, 3), stateful=True))
+        with self.assertRaises(ValueError):
+            check_recurrent_options("LSTM", model.layers[0])
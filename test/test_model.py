@@ -8,7 +8,9 @@ from unittest import TestCase
 import numpy
 from keras.callbacks import History
 
-from mycroft.model import BagOfWordsClassifier, RNNClassifier, load_embedding_model, ConvolutionNetClassifier
+from mycroft.data import Dataset
+from mycroft.model import BagOfWordsClassifier, RNNClassifier, load_embedding_model, ConvolutionNetClassifier, \
+    ModelRegistry, TrainingState
 from test import to_lines
 
 
@@ -54,6 +56,52 @@ class TestModel(TestCase):
         self.assertEqual(False, model.bidirectional)
         self.embedding_model_train_predict_evaluate(model)
 
+    def test_bucketed_rnn(self):
+        fixed_length = RNNClassifier((self.texts, self.labels, self.label_names), sequence_length=50,
+                                     vocabulary_size=20000)
+        self.assertEqual(50, fixed_length.model.get_layer("embedding").input_length)
+        with self.assertRaises(ValueError):
+            fixed_length.predict(self.texts, bucket=True)
+        model = RNNClassifier((self.texts, self.labels, self.label_names), sequence_length=50, vocabulary_size=20000,
+                              variable_length=True)
+        self.assertIsNone(model.model.get_layer("embedding").input_length)
+        history = model.train(self.texts, self.labels, epochs=2, batch_size=10, validation_fraction=0.1, verbose=0,
+                              bucket=True)
+        self.assertIsInstance(history, History)
+        self.assertLess(history.padding_waste["bucketed"], history.padding_waste["fixed"])
+        label_probabilities, predicted_labels = model.predict(self.texts, batch_size=10, bucket=True)
+        unbucketed_probabilities, _ = model.predict(self.texts, batch_size=10)
+        numpy.testing.assert_allclose(unbucketed_probabilities, label_probabilities, rtol=1e-4, atol=1e-5)
+        self.is_loss_and_accuracy(model.evaluate(self.texts, self.labels, bucket=True))
+
+    def test_corpus_vocabulary(self):
+        model = RNNClassifier((self.texts, self.labels, self.label_names), sequence_length=50, corpus_vocabulary=True)
+        input_dim = model.model.get_layer("embedding").input_dim
+        self.assertEqual(model.embedder.vocabulary_size + 1, input_dim)
+        self.assertLess(input_dim, 20000)
+        self.embedding_model_train_predict_evaluate(model)
+
+    def test_embedding_dtypes(self):
+        model = RNNClassifier((self.texts, self.labels, self.label_names), sequence_length=50, vocabulary_size=20000,
+                              embedding_dtype="int8")
+        self.assertEqual(numpy.dtype("int8"), model.embedder.embedding_matrix.dtype)
+        model.train(self.texts, self.labels, epochs=1, batch_size=10, verbose=0)
+        weights = model.model.get_layer("embedding").get_weights()[0]
+        results = model.evaluate_embedding_dtypes(self.texts, self.labels, dtypes=["float32", "float16"])
+        self.assertEqual(["float32", "float16"], [dtype for dtype, _ in results])
+        for _, scores in results:
+            self.is_loss_and_accuracy(scores)
+        numpy.testing.assert_array_equal(weights, model.model.get_layer("embedding").get_weights()[0])
+        with self.assertRaises(ValueError):
+            BagOfWordsClassifier((self.texts, self.labels, self.label_names)).evaluate_embedding_dtypes(
+                self.texts, self.labels)
+
+    def test_convolution_cannot_bucket(self):
+        model = ConvolutionNetClassifier((self.texts, self.labels, self.label_names),
+                                         sequence_length=50, vocabulary_size=20000)
+        with self.assertRaises(ValueError):
+            model.predict(self.texts, bucket=True)
+
     def test_convolution(self):
         model = ConvolutionNetClassifier((self.texts, self.labels, self.label_names),
                                          sequence_length=50, vocabulary_size=20000)
@@ -75,6 +123,68 @@ class TestModel(TestCase):
         self.assertTrue(os.path.exists(os.path.join(self.model_directory, "description.txt")))
         self.assertTrue(os.path.exists(os.path.join(self.model_directory, "history.json")))
 
+    def test_dataset(self):
+        data = Dataset.from_labels(self.texts, self.labels)
+        model = BagOfWordsClassifier(data)
+        history = model.train(data, epochs=2, batch_size=10, validation_data=data, verbose=0)
+        self.assertIsInstance(history, History)
+        self.assertEqual(1, len(data.encodings))
+        label_probabilities, predicted_labels = model.predict(data)
+        self.assertEqual((len(data), 2), label_probabilities.shape)
+        self.is_loss_and_accuracy(model.evaluate(data))
+
+    def test_resume_training(self):
+        model = BagOfWordsClassifier((self.texts, self.labels, self.label_names))
+        model.train(self.texts, self.labels, epochs=2, batch_size=10, validation_data=(self.texts, self.labels),
+                    early_stop=5, reduce=1, model_directory=self.model_directory, verbose=0)
+        self.assertTrue(os.path.exists(os.path.join(self.model_directory, "checkpoint.hd5")))
+        state = TrainingState.load(self.model_directory)
+        self.assertEqual(2, state.epoch)
+        self.assertEqual("val_loss", state.monitor)
+        self.assertEqual(2, len(state.history["val_loss"]))
+        self.assertEqual({"EarlyStopping", "ReduceLROnPlateau", "ModelCheckpoint"}, set(state.progress))
+        self.assertEqual(min(state.history["val_loss"]), state.progress["ModelCheckpoint"]["best"])
+        loaded_model = load_embedding_model(self.model_directory, checkpoint=True)
+        history = loaded_model.train(self.texts, self.labels, epochs=3, batch_size=10,
+                                     validation_data=(self.texts, self.labels), early_stop=5, reduce=1,
+                                     model_directory=self.model_directory, verbose=0, training_state=state)
+        self.assertEqual([0, 1, 2], history.epoch)
+        self.assertEqual(3, len(history.history["val_loss"]))
+        self.assertEqual(3, TrainingState.load(self.model_directory).epoch)
+        with self.assertRaises(ValueError):
+            loaded_model.train(self.texts, self.labels, epochs=4, verbose=0, training_state=state)
+        # Continuing on new data keeps the epoch count but starts early stopping afresh.
+        restarted = state.restart()
+        self.assertEqual((3, {}), (restarted.epoch, restarted.progress))
+
+    def test_model_registry(self):
+        model_directory_1 = os.path.join(self.model_directory, "1")
+        model_directory_2 = os.path.join(self.model_directory, "2")
+        for model_directory in [model_directory_1, model_directory_2]:
+            model = BagOfWordsClassifier((self.texts, self.labels, self.label_names))
+            model.train(self.texts, self.labels, epochs=1, model_directory=model_directory, verbose=0)
+        registry = ModelRegistry(max_models=1)
+        model_1 = registry.get(model_directory_1)
+        self.assertIsInstance(model_1, BagOfWordsClassifier)
+        self.assertIs(model_1, registry.get(model_directory_1))
+        self.assertEqual((1, 1), (registry.hits, registry.misses))
+        self.assertEqual({}, registry.loading_locks)
+        registry.get(model_directory_2)
+        self.assertEqual(1, len(registry))
+        self.assertNotIn(model_directory_1, registry)
+        self.assertIn(model_directory_2, registry)
+        # A model is reloaded when its files change.
+        model_2 = registry.get(model_directory_2)
+        history_filename = os.path.join(model_directory_2, "history.json")
+        stat = os.stat(history_filename)
+        os.utime(history_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNot(model_2, registry.get(model_directory_2))
+        # Temporary files written by a save in progress do not change the signature.
+        signature = ModelRegistry.directory_signature(model_directory_2)
+        with open(os.path.join(model_directory_2, "classifier.pk.tmp"), mode="w") as f:
+            f.write("partial")
+        self.assertEqual(signature, ModelRegistry.directory_signature(model_directory_2))
+
     def embedding_model_train_predict_evaluate(self, model):
         # Train
         history = model.train(self.texts, self.labels, epochs=2, batch_size=10, validation_fraction=0.1,
@@ -86,6 +196,8 @@ class TestModel(TestCase):
         self.assertTrue(os.path.exists(os.path.join(self.model_directory, "history.json")))
         # Predict
         loaded_model = load_embedding_model(self.model_directory)
+        if hasattr(model.embedder, "embedding_matrix"):
+            self.assertIsInstance(loaded_model.embedder.embedding_matrix, numpy.memmap)
         self.assertTrue(isinstance(loaded_model, model.__class__))
         n = len(self.texts)
         label_probabilities, predicted_labels = loaded_model.predict(self.texts)
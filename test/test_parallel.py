@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mycroft.parallel import ParallelTrainer
+
+
+class TestParallelTrainer(TestCase):
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            ParallelTrainer(None, 1)
+        with self.assertRaises(ValueError):
+            ParallelTrainer(None, 2, sync_steps=0)
+
+
+class TestParallelTraining(TestCase):
+    def setUp(self):
+        from test.test_model import TestModel
+
+        self.model_directory = tempfile.mkdtemp()
+        self.texts, self.labels, self.label_names = TestModel.create_data_set()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_directory)
+
+    def test_parallel_training(self):
+        from keras.callbacks import History
+        from mycroft.model import BagOfWordsClassifier, ConvolutionNetClassifier, load_embedding_model
+
+        training = (self.texts, self.labels, self.label_names)
+        for model in [BagOfWordsClassifier(training),
+                      ConvolutionNetClassifier(training, sequence_length=50, vocabulary_size=20000)]:
+            history = model.train(self.texts, self.labels, epochs=3, batch_size=10, validation_fraction=0.2,
+                                  early_stop=None, reduce=1, model_directory=self.model_directory, verbose=0,
+                                  workers=2)
+            self.assertIsInstance(history, History)
+            self.assertEqual([0, 1, 2], history.epoch)
+            self.assertEqual({"loss", "acc", "val_loss", "val_acc", "lr"}, set(history.history))
+            # The training loss falls as the averaged weights are trained.
+            self.assertLess(history.history["loss"][-1], history.history["loss"][0])
+            self.assertTrue(os.path.isfile(os.path.join(self.model_directory, "model.hd5")))
+            loaded_model = load_embedding_model(self.model_directory)
+            label_probabilities, _ = loaded_model.predict(self.texts)
+            self.assertEqual((len(self.texts), 2), label_probabilities.shape)
+        with self.assertRaises(ValueError):
+            model.train(self.texts, self.labels, epochs=1, bucket=True, workers=2)
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+import mycroft.profiling
+from mycroft.profiling import Profiler, span
+
+
+class TestProfiling(TestCase):
+    def test_nested_spans(self):
+        with Profiler() as profiler:
+            self.assertIs(profiler, mycroft.profiling.active_profiler)
+            for _ in range(3):
+                with span("read"):
+                    pass
+            with span("train"):
+                with span("encode"):
+                    sum(range(10000))
+        self.assertIsNone(mycroft.profiling.active_profiler)
+        self.assertEqual(["read", "train/encode", "train"], list(profiler.spans))
+        self.assertEqual(3, profiler.spans["read"]["calls"])
+        self.assertGreaterEqual(profiler.spans["train"]["wall_seconds"], profiler.spans["train/encode"]["wall_seconds"])
+        report = profiler.report()
+        self.assertEqual({"spans", "epochs", "peak_rss_bytes", "wall_seconds", "cpu_seconds"}, set(report))
+        self.assertEqual({"name", "calls", "wall_seconds", "cpu_seconds", "peak_rss_growth_bytes"},
+                         set(report["spans"][0]))
+        if report["peak_rss_bytes"] is not None:
+            self.assertGreaterEqual(profiler.spans["train"]["peak_rss_growth_bytes"], 0)
+
+    def test_worker_cpu_time(self):
+        with Profiler() as profiler:
+            with span("tokenize"):
+                mycroft.profiling.add_worker_cpu_time(100.0)
+            with span("train"):
+                pass
+        self.assertGreaterEqual(profiler.spans["tokenize"]["cpu_seconds"], 100.0)
+        self.assertLess(profiler.spans["train"]["cpu_seconds"], 100.0)
+        self.assertGreaterEqual(profiler.report()["cpu_seconds"], 100.0)
+        # Without an active profiler worker CPU time is ignored.
+        mycroft.profiling.add_worker_cpu_time(1.0)
+
+    def test_span_records_exceptions(self):
+        with Profiler() as profiler:
+            with self.assertRaises(ValueError):
+                with span("fail"):
+                    raise ValueError()
+            with span("next"):
+                pass
+        self.assertEqual(["fail", "next"], list(profiler.spans))
+
+    def test_inactive_span(self):
+        with span("nothing"):
+            pass
+        self.assertIsNone(mycroft.profiling.epoch_callback())
+
+    def test_epoch_excludes_validation(self):
+        profiler = Profiler()
+        callback = profiler.epoch_callback()
+        callback.on_epoch_begin(0)
+        callback.on_batch_end(0, {"size": 10})
+        callback.on_batch_end(1, {"size": 6})
+        # Stand-in for validation and the other end of epoch callbacks.
+        time.sleep(0.2)
+        callback.on_epoch_end(0)
+        epoch = profiler.report()["epochs"][0]
+        self.assertEqual(16, epoch["samples"])
+        self.assertLess(epoch["seconds"], 0.1)
+
+    def test_save(self):
+        with Profiler() as profiler:
+            with span("stage"):
+                pass
+        profiler.add_epoch(1, 100, 0.5)
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "profile.json")
+        try:
+            profiler.save(filename)
+            with open(filename) as f:
+                report = json.load(f)
+        finally:
+            os.remove(filename)
+            os.rmdir(directory)
+        self.assertEqual("stage", report["spans"][0]["name"])
+        self.assertEqual([{"epoch": 1, "samples": 100, "seconds": 0.5, "samples_per_second": 200.0}], report["epochs"])
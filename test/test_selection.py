@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from mycroft.data import Dataset
+from mycroft.model import ConvolutionNetClassifier, RNNClassifier
+from mycroft.selection import CrossValidator, Distribution, SearchSpace, Tuner, add_shared_encoding
+
+
+class TestSearchSpace(TestCase):
+    def test_from_command_line(self):
+        space = SearchSpace.from_command_line(RNNClassifier, [
+            ["dropout", "0.2", "0.5"], ["rnn-units", "64", "32 32"], ["bidirectional", "true", "false"],
+            ["rnn_type", "lstm"], ["learning_rate", "log-uniform:0.0001:0.01"]])
+        self.assertEqual([0.2, 0.5], space.dimensions["dropout"])
+        self.assertEqual([(64,), (32, 32)], space.dimensions["rnn_units"])
+        self.assertEqual([True, False], space.dimensions["bidirectional"])
+        self.assertEqual(["lstm"], space.dimensions["rnn_type"])
+        self.assertEqual(Distribution("log-uniform", 0.0001, 0.01), space.dimensions["learning_rate"])
+        self.assertFalse(space.is_grid)
+        with self.assertRaises(ValueError):
+            space.grid()
+        for configuration in space.sample(20, random.Random(0)):
+            self.assertIn(configuration["rnn_units"], [(64,), (32, 32)])
+            self.assertGreaterEqual(configuration["learning_rate"], 0.0001)
+            self.assertLessEqual(configuration["learning_rate"], 0.01)
+        filters = SearchSpace.from_command_line(ConvolutionNetClassifier, [["filters", "uniform:50:150"]])
+        self.assertIsInstance(filters.sample(1)[0]["filters"], int)
+
+    def test_invalid_specifications(self):
+        for specification in [["epochs", "10"], ["dropout"], ["dropout", "high"], ["rnn_type", "transformer"],
+                              ["bidirectional", "yes"], ["rnn_type", "uniform:1:2"], ["dropout", "uniform:0.5:0.1"],
+                              ["learning_rate", "log-uniform:0:1"]]:
+            with self.assertRaises(ValueError):
+                SearchSpace.from_command_line(RNNClassifier, [specification])
+
+    def test_grid(self):
+        space = SearchSpace([("dropout", [0.2, 0.5]), ("filters", [10, 20, 30])])
+        self.assertTrue(space.is_grid)
+        grid = space.grid()
+        self.assertEqual(6, len(grid))
+        self.assertEqual({"dropout": 0.2, "filters": 10}, grid[0])
+        self.assertEqual({"dropout": 0.5, "filters": 30}, grid[-1])
+
+
+class TestTuner(TestCase):
+    """
+    Test the search schedules with trials whose validation loss is given by the dropout parameter instead of training
+    a model.
+    """
+
+    class DropoutLossTuner(Tuner):
+        def run_trials(self, trials):
+            assert os.path.isdir(self.encoding_directory)
+            results = []
+            for trial in trials:
+                loss = trial["parameters"]["dropout"]
+                results.append(dict(trial, error=None, loss=loss, best_epoch=trial["epochs"],
+                                    epochs_run=trial["epochs"], metrics={"val_loss": loss}, seconds=0.0))
+            return sorted(results, key=lambda result: result["loss"])
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        data = Dataset.from_labels(["a", "b"], ["x", "y"])
+        self.tuner = self.DropoutLossTuner(ConvolutionNetClassifier, {"filters": 10}, data,
+                                           {"validation_fraction": 0.5}, self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_arguments(self):
+        self.assertEqual(10, self.tuner.arguments["filters"])
+        self.assertEqual(ConvolutionNetClassifier.KERNEL_SIZE, self.tuner.arguments["kernel_size"])
+        with self.assertRaises(ValueError):
+            Tuner(ConvolutionNetClassifier, {}, Dataset.from_labels(["a"], ["x"]))
+
+    def test_grid_search(self):
+        leaderboard = self.tuner.grid_search(SearchSpace([("dropout", [0.5, 0.1, 0.3])]), 5)
+        self.assertEqual([0.1, 0.3, 0.5], [result["parameters"]["dropout"] for result in leaderboard])
+        self.assertEqual([1, 2, 3], [result["rank"] for result in leaderboard])
+        with open(os.path.join(self.directory, Tuner.leaderboard_name)) as f:
+            self.assertEqual(leaderboard, json.load(f))
+        self.assertIsNone(self.tuner.encoding_directory)
+
+    def test_successive_halving(self):
+        space = SearchSpace([("dropout", Distribution("uniform", 0, 1))])
+        leaderboard = self.tuner.successive_halving(space, 9, 1, 10, eta=3, seed=0)
+        self.assertEqual(9, len(leaderboard))
+        self.assertEqual([3, 2, 2, 1, 1, 1, 1, 1, 1], [result["rung"] for result in leaderboard])
+        self.assertEqual([9, 3, 3, 1, 1, 1, 1, 1, 1], [result["epochs"] for result in leaderboard])
+        first_rung = sorted(result["loss"] for result in self.tuner.results if result["rung"] == 1)
+        self.assertEqual(first_rung[0], leaderboard[0]["loss"])
+        self.assertEqual(os.path.join("rung-3", "trial-%03d" % leaderboard[0]["trial"]), leaderboard[0]["name"])
+        # The maximum number of epochs ends the search even if more than one configuration remains.
+        leaderboard = self.tuner.successive_halving(space, 9, 2, 4, eta=2, seed=0)
+        self.assertEqual([4, 4, 4, 4, 4, 2, 2, 2, 2], [result["epochs"] for result in leaderboard])
+
+
+class TestSharedEncoding(TestCase):
+    class Embedder:
+        def __init__(self, size):
+            self.size = size
+
+        def configuration(self):
+            return {"size": self.size}
+
+    class Model:
+        def __init__(self, size):
+            self.embedder = TestSharedEncoding.Embedder(size)
+            self.encoded = 0
+
+        def encode(self, data):
+            self.encoded += 1
+            return numpy.full((len(data), self.embedder.size), self.encoded, dtype="float32")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add_shared_encoding(self):
+        first, second, other = self.Model(3), self.Model(3), self.Model(4)
+        for model in [first, second, other]:
+            data = Dataset.from_labels(["a", "b"], ["x", "y"])
+            add_shared_encoding(model, data, self.directory, "training")
+            encoding = data.encodings[Dataset.encoding_key(model.embedder)]
+            self.assertIsInstance(encoding, numpy.memmap)
+            self.assertEqual((2, model.embedder.size), encoding.shape)
+        # Only the first model with each embedder configuration encodes the data.
+        self.assertEqual([1, 0, 1], [model.encoded for model in [first, second, other]])
+
+    def test_stale_claim(self):
+        model, data = self.Model(3), Dataset.from_labels(["a", "b"], ["x", "y"])
+        key = "training-" + hashlib.sha256(Dataset.encoding_key(model.embedder).encode("utf-8")).hexdigest()
+        claim = os.path.join(self.directory, key + ".claim")
+        # A claim made by a process that has exited is taken over.
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        with open(claim, mode="w") as f:
+            f.write(str(process.pid))
+        add_shared_encoding(model, data, self.directory, "training")
+        self.assertEqual(1, model.encoded)
+        # A claim held by a live process times out.
+        other = Dataset.from_labels(["a", "b"], ["x", "y"])
+        with open(claim.replace("training-", "validation-"), mode="w") as f:
+            f.write(str(os.getpid()))
+        with self.assertRaises(TimeoutError):
+            add_shared_encoding(model, other, self.directory, "validation", timeout=0.2)
+
+
+class TestCrossValidator(TestCase):
+    def test_fold_indexes(self):
+        data = Dataset.from_labels(["text %d" % i for i in range(30)], ["x"] * 20 + ["y"] * 10)
+        cross_validator = CrossValidator(RNNClassifier, {"rnn_units": (8,)}, data, folds=5, seed=0)
+        self.assertEqual((8,), cross_validator.arguments["rnn_units"])
+        folds = cross_validator.fold_indexes()
+        self.assertEqual(5, len(folds))
+        self.assertEqual(list(range(30)), sorted(i for _, test in folds for i in test))
+        for train, test in folds:
+            self.assertEqual(set(), set(train).intersection(test))
+            # Each fold has the same proportion of labels as the data.
+            self.assertEqual([4, 2], list(numpy.bincount(data.label_codes[test])))
+        with self.assertRaises(ValueError):
+            CrossValidator(RNNClassifier, {}, data, folds=1)
@@ -0,0 +1,122 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy
+
+from mycroft.server import PredictionBatcher, PredictionServer
+
+
+class LengthClassifier:
+    """
+    Stand-in for a trained model that classifies texts as short or long.
+    """
+
+    def __init__(self):
+        self.label_names = ["long", "short"]
+        self.calls = []
+
+    def predict(self, texts, batch_size=32):
+        self.calls.append(len(texts))
+        short = numpy.array([len(text) < 10 for text in texts], dtype="float32")
+        label_probabilities = numpy.stack([1 - short, short], axis=1)
+        return label_probabilities, [self.label_names[i] for i in label_probabilities.argmax(axis=1)]
+
+
+class TestPredictionBatcher(TestCase):
+    def setUp(self):
+        self.model = LengthClassifier()
+
+    def test_predict(self):
+        batcher = PredictionBatcher(self.model)
+        label_probabilities, labels = batcher.predict(["a cat", "a long sentence about a cat"])
+        batcher.close()
+        self.assertEqual(["short", "long"], labels)
+        self.assertEqual((2, 2), label_probabilities.shape)
+
+    def test_batching(self):
+        batcher = PredictionBatcher(self.model, max_batch_size=8, max_wait=0.2)
+        futures = [batcher.submit(["text %d" % i, "a much longer text %d" % i]) for i in range(10)]
+        results = [future.result() for future in futures]
+        batcher.close()
+        for label_probabilities, labels in results:
+            self.assertEqual(["short", "long"], labels)
+        self.assertEqual(20, sum(self.model.calls))
+        self.assertLess(len(self.model.calls), 10)
+        self.assertTrue(all(n <= 8 for n in self.model.calls))
+        statistics = batcher.statistics.as_dict()
+        self.assertEqual(10, statistics["requests"])
+        self.assertEqual(20, statistics["texts"])
+        self.assertEqual(len(self.model.calls), statistics["batches"])
+
+    def test_closed(self):
+        batcher = PredictionBatcher(self.model)
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.predict(["a cat"])
+        # Closing again does nothing.
+        batcher.close()
+
+    def test_model_error(self):
+        batcher = PredictionBatcher(self.model)
+        with self.assertRaises(TypeError):
+            batcher.predict([None])
+        batcher.close()
+
+    def test_error_isolated_to_request(self):
+        batcher = PredictionBatcher(self.model, max_wait=0.2)
+        good = batcher.submit(["a cat"])
+        bad = batcher.submit([None])
+        self.assertEqual(["short"], good.result()[1])
+        with self.assertRaises(TypeError):
+            bad.result()
+        batcher.close()
+        self.assertEqual([2, 1, 1], self.model.calls)
+
+
+class TestPredictionServer(TestCase):
+    def setUp(self):
+        self.batcher = PredictionBatcher(LengthClassifier(), max_wait=0.05)
+        self.server = PredictionServer(("127.0.0.1", 0), self.batcher)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.batcher.close()
+
+    def test_predict(self):
+        def post(texts):
+            request = Request(self.url + "/predict", data=json.dumps({"texts": texts}).encode("utf-8"),
+                              headers={"Content-Type": "application/json"})
+            with urlopen(request) as response:
+                return json.loads(response.read().decode("utf-8"))
+
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(post, [["cat %d" % i, "a long text about a cat"] for i in range(16)]))
+        for response in responses:
+            self.assertEqual(["short", "long"], response["labels"])
+            self.assertEqual(["long", "short"], response["label_names"])
+            self.assertEqual(2, len(response["probabilities"]))
+        with urlopen(self.url + "/stats") as response:
+            statistics = json.loads(response.read().decode("utf-8"))
+        self.assertEqual(16, statistics["requests"])
+        self.assertLessEqual(statistics["batches"], 16)
+
+    def test_invalid_request(self):
+        request = Request(self.url + "/predict", data=b"{\"text\": 1}")
+        with self.assertRaises(HTTPError) as context:
+            urlopen(request)
+        self.assertEqual(400, context.exception.code)
+
+    def test_empty_request(self):
+        request = Request(self.url + "/predict", data=json.dumps({"texts": []}).encode("utf-8"))
+        with urlopen(request) as response:
+            content = json.loads(response.read().decode("utf-8"))
+        self.assertEqual({"labels": [], "label_names": ["long", "short"], "probabilities": []}, content)
+        self.assertEqual([], self.batcher.model.calls)
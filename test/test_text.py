@@ -2,10 +2,14 @@ import os
 import pickle
 import shutil
 import tempfile
+from itertools import chain
 from unittest import TestCase
 
 import numpy
-from mycroft.text import text_parser, BagOfWordsEmbedder, TextSequenceEmbedder, Embedder, maximum_text_length
+from mycroft.text import text_parser, BagOfWordsEmbedder, TextSequenceEmbedder, Embedder, maximum_text_length, \
+    TokenizedTexts, parallel_apply, LengthBuckets, tokenize, tokenizer_agreement, regex_tokens, quantize_embeddings, \
+    dequantize_embeddings, vector_table, process_pool
+from test import to_lines
 from numpy.testing import assert_array_equal
 
 
@@ -21,6 +25,95 @@ class TestText(TestCase):
     def test_text_statistics(self):
         max_length = maximum_text_length(["Jabberwocky", "the cat is in the hat", "the dog is tired"])
         self.assertEqual(6, max_length)
+        texts = (text for text in ["Jabberwocky", "the cat is in the hat", "the dog is tired"])
+        self.assertEqual(6, maximum_text_length(texts, tokenizer="regex"))
+        self.assertEqual(0, maximum_text_length([]))
+
+    def test_tokenized_texts(self):
+        texts = TokenizedTexts(["Jabberwocky", "the cat is in the hat", "the dog is tired"])
+        self.assertEqual(3, len(texts))
+        self.assertEqual("Jabberwocky", texts[0])
+        self.assertEqual(["the", "dog", "is", "tired"], texts.tokens()[2])
+        assert_array_equal([1, 6, 4], texts.lengths())
+        self.assertEqual(6, maximum_text_length(texts))
+        embedder = TextSequenceEmbedder(10000, 10)
+        assert_array_equal(embedder.encode(list(texts)), embedder.encode(texts))
+
+    def test_regex_tokens(self):
+        self.assertEqual(["I", "do", "n't", "know", ",", "it", "'s", "3.5", "dogs", "."],
+                         regex_tokens("I don't know, it's 3.5 dogs."))
+        self.assertEqual([], regex_tokens("  "))
+
+    def test_tokenizers(self):
+        texts = to_lines("joyce.txt") + to_lines("kafka.txt")
+        self.assertEqual(tokenize(texts), tokenize(texts, tokenizer="spacy-tokenizer"))
+        self.assertEqual(1.0, tokenizer_agreement(texts, "spacy-tokenizer"))
+        self.assertGreater(tokenizer_agreement(texts, "regex"), 0.5)
+        for tokenizer in ["spacy-tokenizer", "regex"]:
+            embedder = TextSequenceEmbedder(10000, 10, tokenizer=tokenizer)
+            self.assertEqual(tokenizer, embedder.configuration()["tokenizer"])
+            self.assertEqual((len(texts), 10), embedder.encode(texts).shape)
+            self.assertEqual((len(texts), 300), BagOfWordsEmbedder(tokenizer=tokenizer).encode(texts).shape)
+        numpy.testing.assert_allclose(BagOfWordsEmbedder().encode(self.texts),
+                                      BagOfWordsEmbedder(tokenizer="spacy-tokenizer").encode(self.texts), rtol=1e-5)
+        with self.assertRaises(ValueError):
+            BagOfWordsEmbedder(tokenizer="whitespace")
+
+    def test_quantize_embeddings(self):
+        matrix = numpy.random.RandomState(0).normal(size=(20, 8)).astype("float32")
+        matrix[0] = 0
+        values, scales = quantize_embeddings(matrix)
+        self.assertEqual(numpy.dtype("float32"), values.dtype)
+        self.assertIsNone(scales)
+        values, scales = quantize_embeddings(matrix, "float16")
+        self.assertEqual(numpy.dtype("float16"), values.dtype)
+        numpy.testing.assert_allclose(matrix, dequantize_embeddings(values, scales), rtol=1e-3)
+        values, scales = quantize_embeddings(matrix, "int8")
+        self.assertEqual(numpy.dtype("int8"), values.dtype)
+        self.assertEqual((20,), scales.shape)
+        self.assertEqual(127, numpy.abs(values[1:]).max(axis=1).min())
+        restored = dequantize_embeddings(values, scales)
+        self.assertEqual(numpy.dtype("float32"), restored.dtype)
+        assert_array_equal(numpy.zeros(8), restored[0])
+        self.assertTrue((numpy.abs(matrix - restored) <= scales[:, numpy.newaxis] / 2 + 1e-6).all())
+        with self.assertRaises(ValueError):
+            quantize_embeddings(matrix, "int4")
+
+    def test_parallel_apply(self):
+        texts = ["text %d" % i for i in range(100)]
+        lengths = parallel_apply(len, texts, workers=3)
+        self.assertEqual(12, len(lengths))
+        self.assertEqual(100, sum(lengths))
+        self.assertEqual([100], parallel_apply(len, texts))
+        self.assertIs(process_pool(3), process_pool(3))
+
+    def test_parallel_encoding(self):
+        texts = self.texts * 20
+        for embedder in [BagOfWordsEmbedder(), TextSequenceEmbedder(10000, 50)]:
+            serial = embedder.encode(texts)
+            embedder.workers = 2
+            assert_array_equal(serial, embedder.encode(texts))
+
+    def test_length_buckets(self):
+        sequences = [numpy.arange(1, n + 1, dtype="int32") for n in [3, 0, 5, 1, 2, 8]]
+        buckets = LengthBuckets(sequences, numpy.arange(6), batch_size=2)
+        self.assertEqual(3, len(buckets))
+        batches = buckets.batch_indexes()
+        self.assertEqual([[1, 3], [4, 0], [2, 5]], [list(indexes) for indexes in batches])
+        x, y = buckets.batch(batches[1])
+        assert_array_equal([[0, 1, 2], [1, 2, 3]], x)
+        assert_array_equal([4, 0], y)
+        self.assertEqual((2, 1), buckets.batch(batches[0])[0].shape)
+        self.assertAlmostEqual(1 - 19 / 24, buckets.padding_waste())
+        self.assertAlmostEqual(1 - 19 / 48, buckets.padding_waste(8))
+        shuffled = [sorted(indexes) for indexes in buckets.batch_indexes(shuffle=True)]
+        self.assertEqual(list(range(6)), sorted(i for indexes in shuffled for i in indexes))
+
+    def test_encode_sequences(self):
+        embedder = TextSequenceEmbedder(10000, 4)
+        sequences = embedder.encode_sequences(self.texts)
+        self.assertEqual([4, 4], [len(sequence) for sequence in sequences])
+        assert_array_equal(embedder.encode(self.texts), numpy.array(sequences))
 
     def test_base_class(self):
         embedder = Embedder()
@@ -29,7 +122,7 @@ class TestText(TestCase):
 
     def test_bag_of_words_embedder(self):
         embedder = BagOfWordsEmbedder()
-        self.assertEqual("Bag of words embedder: core_web_sm", str(embedder))
+        self.assertEqual("Bag of words embedder: core_web_sm, spacy tokenizer", str(embedder))
         self.assertEqual("en", embedder.language_model)
         self.assertEqual(300, embedder.embedding_size)
         self.assertFalse(hasattr(embedder, "embedding_matrix"))
@@ -37,9 +130,31 @@ class TestText(TestCase):
         self.assertEqual((2, 300), embedding.shape)
         self.assertEqual(numpy.dtype("float32"), embedding.dtype)
 
+    def test_vector_table(self):
+        texts = to_lines("joyce.txt") + to_lines("kafka.txt") + [""]
+        table = vector_table("en")
+        self.assertIs(table, vector_table("en"))
+        vectors = table.document_vectors(tokenize(texts))
+        self.assertEqual((len(texts), 300), vectors.shape)
+        self.assertEqual(numpy.dtype("float32"), vectors.dtype)
+        spacy_vectors = [document.vector for document in text_parser("en").pipe(texts[:-1])]
+        numpy.testing.assert_allclose(spacy_vectors, vectors[:-1], rtol=1e-4, atol=1e-6)
+        assert_array_equal(numpy.zeros(300), vectors[-1])
+        assert_array_equal(numpy.zeros(300), table.vectors[0])
+        self.assertEqual(table.indexes(["the"]), table.indexes(["the"]))
+        vocabulary_size = len(text_parser("en").vocab)
+        assert_array_equal([0], table.indexes(["xqzvbnwk"]))
+        self.assertNotIn("xqzvbnwk", table.index)
+        self.assertEqual(vocabulary_size, len(text_parser("en").vocab))
+        embedder = BagOfWordsEmbedder()
+        embedder.chunk_size = 7
+        numpy.testing.assert_allclose(vectors, embedder.encode(texts), rtol=1e-6)
+        assert_array_equal(embedder.encode(texts), embedder.encode(TokenizedTexts(texts)))
+
     def test_text_sequence_embedder(self):
         embedder = TextSequenceEmbedder(10000, 50)
-        self.assertEqual("Text sequence embedder: core_web_sm, embedding matrix (10001, 300)", str(embedder))
+        self.assertEqual("Text sequence embedder: core_web_sm, spacy tokenizer, embedding matrix (10001, 300)",
+                         str(embedder))
         self.assertEqual("en", embedder.language_model)
         self.assertEqual(300, embedder.embedding_size)
         self.assertEqual(10000, embedder.vocabulary_size)
@@ -49,6 +164,23 @@ class TestText(TestCase):
         self.assertEqual((2, 50), embedding.shape)
         self.assertEqual(numpy.dtype("int32"), embedding.dtype)
 
+    def test_corpus_vocabulary(self):
+        texts = TokenizedTexts(to_lines("joyce.txt") + to_lines("kafka.txt"))
+        embedder = TextSequenceEmbedder(None, 20, texts=texts)
+        self.assertLess(embedder.vocabulary_size, len(set(chain.from_iterable(texts.tokens()))) + 1)
+        self.assertEqual((embedder.vocabulary_size + 1, 300), embedder.embedding_matrix.shape)
+        self.assertIn("corpus_vocabulary", embedder.configuration())
+        frequent = TextSequenceEmbedder(None, 20, texts=texts, min_frequency=3)
+        self.assertLess(frequent.vocabulary_size, embedder.vocabulary_size)
+        self.assertEqual(10, TextSequenceEmbedder(10, 20, texts=texts).vocabulary_size)
+        self.assertEqual(embedder.vocabulary, TextSequenceEmbedder(None, 20, texts=list(texts)).vocabulary)
+        oov = embedder.oov_statistics(texts)
+        self.assertEqual(len(set(chain.from_iterable(texts.tokens()))), oov["types"])
+        self.assertLess(oov["oov_token_rate"], frequent.oov_statistics(texts)["oov_token_rate"])
+        restored = pickle.loads(pickle.dumps(embedder))
+        self.assertEqual(embedder.vocabulary, restored.vocabulary)
+        assert_array_equal(embedder.encode(texts), restored.encode(texts))
+
 
 class TestTextSerialization(TestCase):
     def setUp(self):
@@ -74,6 +206,32 @@ class TestTextSerialization(TestCase):
         embedding_2 = embedder_2.encode(self.texts)
         assert_array_equal(embedding_1, embedding_2)
 
+    def test_save_and_load_text_sequence_embedder(self):
+        embedder_1 = TextSequenceEmbedder(10000, 50)
+        embedder_1.save(self.temporary_directory)
+        self.assertTrue(os.path.isfile(os.path.join(self.temporary_directory, "vocabulary.json")))
+        self.assertTrue(os.path.isfile(os.path.join(self.temporary_directory, "embeddings.npy")))
+        embedder_2 = self.serialization_round_trip(embedder_1, "seq.pk")
+        embedder_2.load(self.temporary_directory)
+        self.assertIsInstance(embedder_2.embedding_matrix, numpy.memmap)
+        self.assertEqual(embedder_1, embedder_2)
+        assert_array_equal(embedder_1.encode(self.texts), embedder_2.encode(self.texts))
+
+    def test_reduced_precision_text_sequence_embedder(self):
+        embedder_1 = TextSequenceEmbedder(10000, 50)
+        self.assertEqual(numpy.dtype("float32"), embedder_1.embedding_matrix.dtype)
+        for dtype in ["float16", "int8"]:
+            embedder_2 = TextSequenceEmbedder(10000, 50, embedding_dtype=dtype)
+            self.assertEqual(numpy.dtype(dtype), embedder_2.embedding_matrix.dtype)
+            self.assertEqual(numpy.dtype("float32"), embedder_2.embedding_weights().dtype)
+            numpy.testing.assert_allclose(embedder_1.embedding_matrix, embedder_2.embedding_weights(), atol=0.05)
+            assert_array_equal(embedder_1.encode(self.texts), embedder_2.encode(self.texts))
+            embedder_2.save(self.temporary_directory)
+            embedder_3 = self.serialization_round_trip(embedder_2, "seq.pk")
+            embedder_3.load(self.temporary_directory)
+            self.assertEqual(numpy.dtype(dtype), embedder_3.embedding_matrix.dtype)
+            assert_array_equal(embedder_2.embedding_weights(), embedder_3.embedding_weights())
+
     def serialization_round_trip(self, obj, name):
         with open(os.path.join(self.temporary_directory, name), mode="wb") as f:
             pickle.dump(obj, f)